@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.utils.html import format_html
-from .models import Profile, Post, LikePost, Comment, Follow, Chat, Message
+from .models import Profile, Post, LikePost, Comment, Follow, Chat, Message, Hashtag
 
 
 admin.site.site_header = "𝕾𝖔𝖈𝖎𝖆𝖑𝕬𝖕𝖕 Admin"
@@ -9,11 +9,11 @@ admin.site.index_title = "Welcome to 𝕾𝖔𝖈𝖎𝖆𝖑𝕬𝖕𝖕 Admini
 
 # Profile model admin customization
 class ProfileAdmin(admin.ModelAdmin):    
-    list_display = ('user', 'profile_pic_display', 'bio', 'location', 'created_at', 'updated_at')
+    list_display = ('user', 'profile_pic_display', 'bio', 'location', 'followers_count', 'following_count', 'posts_count', 'created_at', 'updated_at')
     search_fields = ('user__username', 'bio', 'location')
     list_filter = ('created_at', 'updated_at')
     ordering = ('-created_at',)
-    readonly_fields = ('created_at', 'updated_at')
+    readonly_fields = ('followers_count', 'following_count', 'posts_count', 'created_at', 'updated_at')
     
     def profile_pic_display(self, obj):
         if obj.profile_pic:
@@ -32,10 +32,10 @@ class CommentInline(admin.TabularInline):
 # Post model admin customization
 class PostAdmin(admin.ModelAdmin):
     def total_likes(self, obj):
-        return obj.likes.count()
+        return obj.likes_count
     
     def total_comments(self, obj):
-        return obj.comments.count()
+        return obj.comments_count
 
     def preview_image(self, obj):
         if obj.image:
@@ -56,6 +56,7 @@ class PostAdmin(admin.ModelAdmin):
     ordering = ('-created_at',)
     list_select_related = ('user',)
     list_per_page = 20
+    readonly_fields = ('likes_count', 'comments_count')
     inlines = [CommentInline]
     actions = ['mark_as_featured']
     
@@ -96,7 +97,7 @@ class ChatAdmin(admin.ModelAdmin):
         return ", ".join([user.username for user in obj.participants.all()])
     participants_display.short_description = 'Participants'
     
-    list_display = ('participants_display', 'created_at')
+    list_display = ('participants_display', 'last_message_at', 'created_at')
     list_filter = ('participants', 'created_at')
     ordering = ('-created_at',)
 
@@ -111,6 +112,12 @@ class MessageAdmin(admin.ModelAdmin):
         return obj.content[:50] + '...' if len(obj.content) > 50 else obj.content
     content_preview.short_description = 'Content'
 
+# Hashtag model admin customization
+class HashtagAdmin(admin.ModelAdmin):
+    list_display = ('name', 'created_at')
+    search_fields = ('name',)
+    ordering = ('name',)
+
 # Registering models with admin site
 admin.site.register(Profile, ProfileAdmin)
 admin.site.register(Post, PostAdmin)
@@ -119,3 +126,4 @@ admin.site.register(Comment, CommentAdmin)
 admin.site.register(Follow, FollowAdmin)
 admin.site.register(Chat, ChatAdmin)
 admin.site.register(Message, MessageAdmin)
+admin.site.register(Hashtag, HashtagAdmin)
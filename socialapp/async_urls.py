@@ -0,0 +1,18 @@
+from django.urls import path
+from . import async_views
+from .urls import handler404, handler500, urlpatterns as sync_urlpatterns
+
+# The app's URLs with the JSON write endpoints served by their async versions,
+# included instead of urls.py when ASYNC_VIEWS is on (set by socialmedia/asgi.py)
+ASYNC_VIEWS = {
+    'like_post': async_views.like_post,
+    'toggle_follow': async_views.toggle_follow,
+    'add_comment': async_views.add_comment,
+    'send_message': async_views.send_message,
+    'open_chat': async_views.open_chat,
+}
+
+urlpatterns = [
+    path(str(pattern.pattern), ASYNC_VIEWS[pattern.name], name=pattern.name) if pattern.name in ASYNC_VIEWS else pattern
+    for pattern in sync_urlpatterns
+]
@@ -0,0 +1,134 @@
+from django.contrib.auth.decorators import login_required
+from django.contrib.auth.models import User
+from django.http import JsonResponse
+from django.shortcuts import aget_object_or_404
+from django.template.loader import render_to_string
+from django.utils.dateformat import format
+from django.views.decorators.http import require_POST
+from .chats import aget_or_create_direct_chat, apost_message
+from .comments import areply_parent
+from .counters import aadjust
+from .feed import abackfill_follow, abump_rank, aremove_follow
+from .forms import CommentForm
+from .graph import arecord_follow
+from .models import Chat, Comment, Follow, LikePost, Post, Profile
+from .ratelimit import rate_limit
+
+# Native async versions of the small JSON write endpoints in views.py, routed in
+# their place under ASGI (see socialapp/async_urls.py). They take the same
+# requests and return the same JSON, awaiting the async ORM instead of holding
+# a worker thread per request.
+#
+# The async ORM has no transactions, so each toggle deletes or inserts its row
+# first and only moves the counters when that statement changed something;
+# reconcile_counters repairs a counter left behind by a crash in between.
+
+
+# AJAX-enabled Like post view
+@login_required
+@rate_limit('like_post')
+async def like_post(request, pk):
+    user = await request.auser()
+    post = await aget_object_or_404(Post.objects.only('id', 'created_at'), pk=pk)
+    deleted, _ = await LikePost.objects.filter(post=post, user=user).adelete()
+    if deleted:
+        liked = False
+        await aadjust(Post.objects.filter(pk=post.pk), likes_count=-1, card_version=1)
+        await abump_rank(post)
+    else:
+        liked = True
+        _, created = await LikePost.objects.aget_or_create(post=post, user=user)
+        if created:
+            await aadjust(Post.objects.filter(pk=post.pk), likes_count=1, card_version=1)
+            await abump_rank(post)
+    like_count = await Post.objects.filter(pk=post.pk).values_list('likes_count', flat=True).aget()
+    return JsonResponse({'liked': liked, 'like_count': like_count})
+
+
+# AJAX-enabled Follow/Unfollow user view
+@login_required
+@require_POST
+@rate_limit('toggle_follow')
+async def toggle_follow(request, username):
+    user = await request.auser()
+    target_user = await aget_object_or_404(User, username=username)
+    if user.pk == target_user.pk:
+        return JsonResponse({'error': 'You cannot follow yourself.'}, status=400)
+
+    deleted, _ = await Follow.objects.filter(follower=user, followed=target_user).adelete()
+    if deleted:
+        following_status, delta = False, -1
+    else:
+        _, created = await Follow.objects.aget_or_create(follower=user, followed=target_user)
+        following_status, delta = True, 1 if created else 0
+    if delta:
+        await aadjust(Profile.objects.filter(user=user), following_count=delta)
+        await aadjust(Profile.objects.filter(user=target_user), followers_count=delta)
+        await arecord_follow(user, target_user, following_status)
+        if following_status:
+            await abackfill_follow(user, target_user)
+        else:
+            await aremove_follow(user, target_user)
+
+    followers_count, following_count = await Profile.objects.filter(user=target_user).values_list(
+        'followers_count', 'following_count').aget()
+    return JsonResponse({
+        'following_status': following_status,
+        'followers_count': followers_count,
+        'following_count': following_count,
+    })
+
+
+# AJAX-enabled Add comment view
+@login_required
+@rate_limit('add_comment')
+async def add_comment(request, pk):
+    post = await aget_object_or_404(Post.objects.only('id', 'created_at'), pk=pk)
+    if request.method == 'POST':
+        form = CommentForm(request.POST)
+        if form.is_valid():
+            comment = form.save(commit=False)
+            comment.user = await request.auser()
+            comment.post = post
+            if request.POST.get('parent'):
+                parent = await Comment.objects.filter(post=post, pk=request.POST['parent']).afirst() if request.POST['parent'].isdigit() else None
+                if parent is None:
+                    return JsonResponse({'error': 'Invalid request'}, status=400)
+                comment.parent = await areply_parent(parent)
+            await comment.asave()
+            await aadjust(Post.objects.filter(pk=post.pk), comments_count=1)
+            await abump_rank(post)
+            comment_count = await Post.objects.filter(pk=post.pk).values_list('comments_count', flat=True).aget()
+            return JsonResponse({
+                'id': comment.id,
+                'parent_id': comment.parent_id,
+                'username': comment.user.username,
+                'text': comment.text,
+                'created_at': format(comment.created_at, 'N j, Y, P'),
+                'comment_count': comment_count,
+                'html': render_to_string('comment_list_page.html', {'comments': [comment], 'post_id': post.pk}),
+            })
+    return JsonResponse({'error': 'Invalid request'}, status=400)
+
+
+@login_required
+@rate_limit('send_message')
+async def send_message(request):
+    if request.method == 'POST':
+        chat_id = request.POST.get('chat_id')
+        content = request.POST.get('content')
+        if not chat_id or not content:
+            return JsonResponse({'error': 'Chat ID and content are required'}, status=400)
+
+        user = await request.auser()
+        chat = await aget_object_or_404(Chat, id=chat_id, participants=user)
+        message = await apost_message(chat, user, content)
+        return JsonResponse({'id': message.id, 'sender': user.username, 'content': message.content,
+                             'timestamp': message.timestamp.isoformat()})
+
+
+@login_required
+async def open_chat(request, username):
+    recipient = await aget_object_or_404(User, username=username)
+    chat = await aget_or_create_direct_chat(await request.auser(), recipient)
+    return JsonResponse({'chat_id': chat.id})
@@ -0,0 +1,101 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils.html import format_html
+from . import metrics
+
+# Fragment cache of rendered post cards. The shared part of a card (media,
+# caption, like count) is rendered once per post and card mode and kept in the
+# POST_CARD_CACHE alias under
+#
+#   post_card:<CARD_FORMAT>:<mode>:<post id>:<Post.card_version>
+#
+# Bump CARD_FORMAT when the card template changes, so fragments rendered by an
+# older one are never served. Writers that change what a card shows bump
+# card_version in the same UPDATE (likes, edits, new renditions; comments are
+# loaded by the comment modal, not cached), so stale fragments are never read
+# again and age out of the cache. Viewer-specific bits are left as slots in the
+# fragment and filled in per request by personalize(): the follow button, the
+# liked heart and, on the author's own profile, the edit and delete buttons.
+
+POST_CARD_CACHE = getattr(settings, 'POST_CARD_CACHE', 'post_cards')
+POST_CARD_CACHE_TIMEOUT = getattr(settings, 'POST_CARD_CACHE_TIMEOUT', 24 * 60 * 60)
+CARD_MODES = ('feed', 'profile')
+CARD_FORMAT = 2
+STATS_KEYS = {'hits': 'post_card_stats:hits', 'misses': 'post_card_stats:misses'}
+
+FOLLOW_SLOT = '<!--card:follow-->'
+LIKED_SLOT = '<!--card:liked-->'
+OWNER_START = '<!--card:owner-->'
+OWNER_END = '<!--/card:owner-->'
+
+
+def card_cache():
+    return caches[POST_CARD_CACHE]
+
+
+def card_key(post, mode):
+    return f'post_card:{CARD_FORMAT}:{mode}:{post.id}:{post.card_version}'
+
+
+def _count(outcome, amount):
+    if amount:
+        cache = card_cache()
+        cache.add(STATS_KEYS[outcome], 0, timeout=None)
+        try:
+            cache.incr(STATS_KEYS[outcome], amount)
+        except ValueError:  # culled between add() and incr()
+            pass
+
+
+# {'hits': ..., 'misses': ...} since the cache was last cleared
+def cache_stats():
+    values = card_cache().get_many(STATS_KEYS.values())
+    return {outcome: values.get(key, 0) for outcome, key in STATS_KEYS.items()}
+
+
+# Cached fragments of a page of posts as {post id: html}, counting hits and misses
+def cached_cards(posts, mode):
+    keys = {card_key(post, mode): post.id for post in posts}
+    found = card_cache().get_many(keys) if keys else {}
+    _count('hits', len(found))
+    _count('misses', len(keys) - len(found))
+    metrics.CARD_CACHE.inc(len(found), result='hit')
+    metrics.CARD_CACHE.inc(len(keys) - len(found), result='miss')
+    return {keys[key]: html for key, html in found.items()}
+
+
+# Render and cache the shared fragment of one card
+def render_card(post, mode):
+    html = render_to_string('post_card_shared.html', {'post': post, 'card_mode': mode})
+    card_cache().set(card_key(post, mode), html, POST_CARD_CACHE_TIMEOUT)
+    return html
+
+
+def evict_cards(post):
+    card_cache().delete_many([card_key(post, mode) for mode in CARD_MODES])
+
+
+def _owner_actions(post, csrf_token):
+    return format_html(
+        '<form method="GET" action="{}" style="display:inline;">'
+        '<button type="submit"class="edit-btn"><i class="fa-regular fa-pen-to-square"></i> </button></form>'
+        '<form method="POST" action="{}" style="display:inline;">'
+        '<input type="hidden" name="csrfmiddlewaretoken" value="{}">'
+        '<button type="submit" class="delete-btn" onclick="return confirm(\'Are you sure you want to delete this post?\');">'
+        '<i class="fas fa-trash-alt"></i> </button></form>',
+        reverse('edit_post', args=[post.id]), reverse('delete_post', args=[post.id]), csrf_token)
+
+
+# Fill the viewer's slots of a cached fragment
+def personalize(html, post, mode, viewer, following, csrf_token=''):
+    follow = ''
+    if viewer.is_authenticated and viewer.id != post.user_id:
+        follow = format_html('<button onclick="toggleFollowUser(\'{}\')" class="btn-f"><b>{}</b></button>',
+                             post.user.username, 'Unfollow' if following else 'Follow')
+    html = html.replace(FOLLOW_SLOT, follow, 1).replace(LIKED_SLOT, '❤️' if getattr(post, 'is_liked', False) else '🩷', 1)
+    if mode == 'profile' and viewer.id == post.user_id:
+        head, _, rest = html.partition(OWNER_START)
+        html = head + _owner_actions(post, csrf_token) + rest.partition(OWNER_END)[2]
+    return html
@@ -0,0 +1,143 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+from .models import Chat, ChatReadMarker, Message
+from .pagination import decode_cursor, encode_cursor, keyset_filter, keyset_page
+from .realtime import chat_group, get_broadcast
+
+# Chat write path shared by the send_message view and the chat WebSocket, the
+# incremental read path behind load_messages, and the inbox read model: one
+# ChatReadMarker per participant carrying the counterpart, unread count and
+# latest activity, so the inbox is a single indexed query.
+
+MESSAGE_PAGE_SIZE = getattr(settings, 'MESSAGE_PAGE_SIZE', 50)
+INBOX_PAGE_SIZE = getattr(settings, 'INBOX_PAGE_SIZE', 20)
+MESSAGE_FIELDS = ('id', 'sender__username', 'content', 'timestamp')
+MESSAGE_KEYS = ('timestamp', 'id')
+
+
+# Same keys load_messages returns, so the front end renders both alike
+def message_payload(message):
+    return {
+        'id': message.id,
+        'sender__username': message.sender.username,
+        'content': message.content,
+        'timestamp': message.timestamp.isoformat(),
+    }
+
+
+# Store a message and push it to every socket connected to the chat once committed
+def post_message(chat, sender, content):
+    with transaction.atomic():  # the message and the inbox rows it updates land together
+        message = Message.objects.create(chat=chat, sender=sender, content=content)
+    payload = message_payload(message)
+    transaction.on_commit(lambda: get_broadcast().publish(chat_group(chat.id), payload))
+    return message
+
+
+# Async post_message for the ASGI send_message. Without an async transaction
+# the message and its inbox update (a post_save receiver) are two statements;
+# a failure in between leaves the inbox a message behind until the next one.
+async def apost_message(chat, sender, content):
+    message = await Message.objects.acreate(chat=chat, sender=sender, content=content)
+    payload = message_payload(message)
+    await sync_to_async(get_broadcast().publish)(chat_group(chat.id), payload)  # the Redis client blocks
+    return message
+
+
+# The one-to-one chat of two users, created on first use. The unique pair_key
+# makes this one indexed lookup, and two concurrent first calls cannot both
+# create a chat: the loser's insert fails and it reads the winner's row.
+def get_or_create_direct_chat(user, other):
+    pair_key = Chat.pair_key_for(user.id, other.id)
+    chat = Chat.objects.filter(pair_key=pair_key).first()
+    if chat is None:
+        try:
+            with transaction.atomic():
+                chat = Chat.objects.create(pair_key=pair_key)
+                chat.participants.add(user, other)
+        except IntegrityError:
+            chat = Chat.objects.get(pair_key=pair_key)
+    return chat
+
+
+async def aget_or_create_direct_chat(user, other):
+    chat = await Chat.objects.filter(pair_key=Chat.pair_key_for(user.id, other.id)).afirst()
+    if chat is None:
+        chat = await sync_to_async(get_or_create_direct_chat)(user, other)  # creating needs a transaction
+    return chat
+
+
+# Keep one marker per participant; in a two-person chat the counterpart is the other one
+def sync_read_markers(chat_id):
+    chat = Chat.objects.only('created_at', 'last_message_at').get(id=chat_id)
+    member_ids = set(chat.participants.values_list('id', flat=True))
+    ChatReadMarker.objects.filter(chat_id=chat_id).exclude(user_id__in=member_ids).delete()
+    markers = []
+    for user_id in member_ids:
+        others = member_ids - {user_id}
+        markers.append(ChatReadMarker(chat_id=chat_id, user_id=user_id,
+                                      counterpart_id=others.pop() if len(others) == 1 else None,
+                                      last_read_at=chat.last_message_at,
+                                      last_activity_at=chat.last_message_at or chat.created_at))
+    ChatReadMarker.objects.bulk_create(markers, update_conflicts=True, unique_fields=['chat', 'user'],
+                                       update_fields=['counterpart'])
+
+
+# Move the chat to the top of every participant's inbox, unread for all but the sender
+def record_message(message):
+    Chat.objects.filter(id=message.chat_id).update(last_message=message, last_message_at=message.timestamp)
+    ChatReadMarker.objects.filter(chat_id=message.chat_id).update(
+        last_activity_at=message.timestamp,
+        unread_count=Case(When(user_id=message.sender_id, then=Value(0)), default=F('unread_count') + 1),
+        last_read_at=Case(When(user_id=message.sender_id, then=Value(message.timestamp)), default=F('last_read_at')),
+    )
+
+
+def mark_read(chat_id, user):
+    ChatReadMarker.objects.filter(chat_id=chat_id, user=user, unread_count__gt=0).update(
+        unread_count=0, last_read_at=timezone.now())
+
+
+# One page of the user's conversations, latest activity first: (markers, next_cursor)
+def inbox_page(user, cursor=None, page_size=INBOX_PAGE_SIZE):
+    markers = (ChatReadMarker.objects.filter(user=user)
+               .select_related('counterpart__profile', 'chat__last_message'))
+    return keyset_page(markers, cursor, page_size, keys=('last_activity_at', 'id'))
+
+
+def _cursor(row):
+    return encode_cursor([row[key] for key in MESSAGE_KEYS])
+
+
+# One window of a chat's messages, oldest first, in a single joined query.
+#   no cursor: the latest page_size messages
+#   before:    the page_size messages preceding that cursor (scrolling back)
+#   since:     up to page_size messages following that cursor (polling)
+# Returns {'messages', 'before', 'since', 'more'}: `before` pages further back
+# (None once the start of the chat is reached), `since` is what the next poll
+# sends, `more` means a poll hit page_size and should be repeated right away.
+# Raises InvalidCursor for a malformed cursor.
+def message_history(chat_id, since=None, before=None, page_size=MESSAGE_PAGE_SIZE):
+    messages = Message.objects.filter(chat_id=chat_id).values(*MESSAGE_FIELDS)
+
+    if since:
+        rows = list(messages.filter(keyset_filter(MESSAGE_KEYS, decode_cursor(since, Message, MESSAGE_KEYS), 'gt'))
+                    .order_by(*MESSAGE_KEYS)[:page_size + 1])
+        more = len(rows) > page_size
+        rows = rows[:page_size]
+        return {'messages': rows, 'before': None, 'since': _cursor(rows[-1]) if rows else since, 'more': more}
+
+    if before:
+        messages = messages.filter(keyset_filter(MESSAGE_KEYS, decode_cursor(before, Message, MESSAGE_KEYS)))
+    rows = list(messages.order_by(*[f'-{key}' for key in MESSAGE_KEYS])[:page_size + 1])
+    older = len(rows) > page_size
+    rows = rows[:page_size][::-1]
+    return {
+        'messages': rows,
+        'before': _cursor(rows[0]) if older else None,
+        'since': None if before else (_cursor(rows[-1]) if rows else None),
+        'more': False,
+    }
@@ -0,0 +1,50 @@
+from django.conf import settings
+from .models import Comment
+from .pagination import decode_cursor, encode_cursor, keyset_filter
+
+# Comment threads, read through the materialized path on Comment (see
+# models.py). The comment modal of a post card loads them a page at a time when
+# it is opened, so feed pages carry no comment bodies:
+#
+#   thread_page(post_id)        the whole thread, depth-first, oldest first
+#   thread_page(post_id, root)  only the replies under `root`, same order
+#
+# Either is one range read on the (post, path) index.
+
+COMMENT_PAGE_SIZE = getattr(settings, 'COMMENT_PAGE_SIZE', 20)
+PATH_KEYS = ('path',)
+
+
+# First path after every path in the subtree of `path`: its last id plus one
+def _subtree_end(path):
+    return Comment.path_for(int(path[-Comment.PATH_SEGMENT_LENGTH:]) + 1, path[:-Comment.PATH_SEGMENT_LENGTH])
+
+
+# Returns (comments, next_cursor); raises InvalidCursor for a malformed cursor
+def thread_page(post_id, root=None, cursor=None, page_size=COMMENT_PAGE_SIZE):
+    comments = Comment.objects.filter(post_id=post_id).select_related('user')
+    if root is not None:
+        comments = comments.filter(path__gt=root.path, path__lt=_subtree_end(root.path))
+    if cursor:
+        comments = comments.filter(keyset_filter(PATH_KEYS, decode_cursor(cursor, Comment, PATH_KEYS), 'gt'))
+
+    items = list(comments.order_by('path')[:page_size + 1])
+    next_cursor = None
+    if len(items) > page_size:
+        items = items[:page_size]
+        next_cursor = encode_cursor([items[-1].path])
+    return items, next_cursor
+
+
+# Threads stop nesting at Comment.MAX_DEPTH: a reply to a comment on the last
+# level goes next to it instead of under it
+def reply_parent(parent):
+    if parent is not None and parent.depth >= Comment.MAX_DEPTH - 1:
+        return parent.parent
+    return parent
+
+
+async def areply_parent(parent):
+    if parent is not None and parent.depth >= Comment.MAX_DEPTH - 1:
+        return await Comment.objects.aget(pk=parent.parent_id)
+    return parent
@@ -0,0 +1,53 @@
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+from .models import Comment, Follow, LikePost, Post, Profile
+
+# Denormalized engagement counters (Post.likes_count, Profile.followers_count, ...).
+# Writers adjust them with a single atomic UPDATE inside the same transaction
+# as the row they add or remove; reconcile_counters() repairs any drift
+# (admin deletes, cascades, crashes) in bulk.
+
+
+# Apply relative changes, e.g. adjust(Post.objects.filter(pk=1), likes_count=1)
+def adjust(queryset, **deltas):
+    return queryset.update(**_deltas(deltas))
+
+
+async def aadjust(queryset, **deltas):
+    return await queryset.aupdate(**_deltas(deltas))
+
+
+def _deltas(deltas):
+    return {field: Greatest(F(field) + delta, 0) for field, delta in deltas.items()}
+
+
+# Correlated COUNT(*) of `model` rows whose `column` points at the outer row
+def _count(model, column, outer='pk'):
+    counted = (model._base_manager.filter(**{column: OuterRef(outer)}).order_by()
+               .values(column).annotate(total=Count('pk')).values('total'))
+    return Coalesce(Subquery(counted, output_field=IntegerField()), Value(0))
+
+
+def _reconcile(queryset, batch_size=1000, **expected):
+    drifted = queryset.annotate(**{f'expected_{field}': value for field, value in expected.items()})
+    condition = Q()
+    for field in expected:
+        condition |= ~Q(**{field: F(f'expected_{field}')})
+    ids = list(drifted.filter(condition).values_list('pk', flat=True))
+    for start in range(0, len(ids), batch_size):
+        queryset.model._base_manager.filter(pk__in=ids[start:start + batch_size]).update(**expected)
+    return len(ids)
+
+
+# Recount the counters of every row (or of the given queryset's rows) from the
+# relation tables, returns the number of rows repaired
+def reconcile_post_counters(posts=None):
+    return _reconcile(Post._base_manager.all() if posts is None else posts, likes_count=_count(LikePost, 'post'),
+                      comments_count=_count(Comment, 'post'))
+
+
+def reconcile_profile_counters(profiles=None):
+    return _reconcile(Profile.objects.all() if profiles is None else profiles, followers_count=_count(Follow, 'followed', 'user_id'),
+                      following_count=_count(Follow, 'follower', 'user_id'),
+                      posts_count=_count(Post, 'user', 'user_id'))
+
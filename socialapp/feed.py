@@ -0,0 +1,288 @@
+import logging
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Case, Exists, F, FloatField, OuterRef, Q, Subquery, Value, When, Window
+from django.db.models.functions import Log, RowNumber
+from django.utils import timezone
+from .cards import cached_cards
+from .models import FeedEntry, Follow, LikePost, Post
+from .pagination import keyset_filter, keyset_page
+
+# Fan-out-on-write home timeline. Every post is copied into the FeedEntry
+# table of its author and of each follower when it is created, so reading
+# the home page is a single indexed slice instead of a scan over all posts.
+# Fan-out is queued after the post's transaction commits and runs on a worker
+# pool, so creating a post costs the same however many followers its author
+# has (unless FEED_FANOUT_ASYNC is off). Each timeline keeps only its newest
+# FEED_TIMELINE_SIZE entries, older ones are trimmed as new ones come in;
+# backfill_feeds rebuilds timelines from scratch if queued work was lost.
+#
+# The timeline can be read newest-first ('latest') or by rank ('top'). Posts
+# rank by
+#
+#   affinity * (post + likes * like + comments * comment) * 0.5 ** (age / half-life)
+#
+# where the weights are FEED_RANK_WEIGHTS and affinity is higher when the
+# author follows the owner back. Each entry stores the log2 of that, taken
+# against the fixed RANK_EPOCH instead of the current time:
+#
+#   log2(affinity * points) + (created_at - RANK_EPOCH) / half-life
+#
+# which orders posts the same at every moment, so scores never need decaying.
+# like_post and add_comment have the scores of the post's entries recomputed
+# from its counters after they commit, on the fan-out pool (bump_rank()); the
+# rerank_feeds command recomputes the entries
+# of the last FEED_RANK_HORIZON after follows changed or counters were repaired.
+# Reading a ranked page is an indexed slice like the newest-first one.
+
+FEED_PAGE_SIZE = getattr(settings, 'FEED_PAGE_SIZE', 20)
+FEED_BACKFILL_SIZE = getattr(settings, 'FEED_BACKFILL_SIZE', 200)
+FEED_BATCH_SIZE = getattr(settings, 'FEED_BATCH_SIZE', 1000)
+FEED_TIMELINE_SIZE = getattr(settings, 'FEED_TIMELINE_SIZE', 500)
+FEED_FANOUT_ASYNC = getattr(settings, 'FEED_FANOUT_ASYNC', True)
+FEED_FANOUT_WORKERS = getattr(settings, 'FEED_FANOUT_WORKERS', 2)
+FEED_MODES = ('latest', 'top')
+RANK_WEIGHTS = getattr(settings, 'FEED_RANK_WEIGHTS', {'post': 1.0, 'like': 1.0, 'comment': 3.0})
+RANK_HALF_LIFE = getattr(settings, 'FEED_RANK_HALF_LIFE', timedelta(hours=12))
+RANK_HORIZON = getattr(settings, 'FEED_RANK_HORIZON', timedelta(days=7))
+MUTUAL_AFFINITY = getattr(settings, 'FEED_MUTUAL_AFFINITY', 1.5)
+RANK_EPOCH = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+MODE_KEYS = {'latest': ('created_at', 'post_id'), 'top': ('rank_score', 'post_id')}
+
+
+def _affinity(mutual):
+    return MUTUAL_AFFINITY if mutual else 1.0
+
+
+# Python numbers or F() expressions of the counters
+def _points(likes, comments):
+    return RANK_WEIGHTS['post'] + RANK_WEIGHTS['like'] * likes + RANK_WEIGHTS['comment'] * comments
+
+
+def _recency(created_at):
+    return (created_at - RANK_EPOCH) / RANK_HALF_LIFE
+
+
+def rank_score(post, affinity=1.0):
+    return math.log2(affinity * _points(post.likes_count, post.comments_count)) + _recency(post.created_at)
+
+
+def _entry(owner_id, post, affinity=1.0):
+    return FeedEntry(owner_id=owner_id, post=post, author_id=post.user_id, created_at=post.created_at,
+                     affinity=affinity, rank_score=rank_score(post, affinity))
+
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=FEED_FANOUT_WORKERS, thread_name_prefix='fanout')
+    return _executor
+
+
+# Entries of the given timelines past their newest `size`
+def _overflow(owner_ids, size):
+    ranked = (FeedEntry.objects.filter(owner_id__in=owner_ids)
+              .annotate(position=Window(RowNumber(), partition_by=F('owner_id'), order_by=[F('created_at').desc(), F('post_id').desc()])))
+    return ranked.filter(position__gt=size).values('id')
+
+
+def trim_timelines(owner_ids, size):
+    return FeedEntry.objects.filter(id__in=_overflow(owner_ids, size)).delete()[0]
+
+
+def _bulk_insert(entries):
+    for start in range(0, len(entries), FEED_BATCH_SIZE):
+        batch = entries[start:start + FEED_BATCH_SIZE]
+        FeedEntry.objects.bulk_create(batch, ignore_conflicts=True)
+        trim_timelines({entry.owner_id for entry in batch}, FEED_TIMELINE_SIZE)
+
+
+# Whether `author` follows each user whose Follow row is the outer one (Follow.follower)
+def _follows_back(author_id):
+    return Exists(Follow.objects.filter(follower_id=author_id, followed_id=OuterRef('follower_id')))
+
+
+# Queue the fan-out of a newly created post, called inside its transaction
+def schedule_fan_out(post):
+    if FEED_FANOUT_ASYNC:
+        transaction.on_commit(lambda: _get_executor().submit(_run_fan_out, post.pk))
+    else:
+        transaction.on_commit(lambda: fan_out_post(post))
+
+
+def _run_fan_out(post_id):
+    close_old_connections()
+    try:
+        post = Post.objects.filter(pk=post_id).first()
+        if post is not None:
+            fan_out_post(post)
+    except Exception:
+        logger.exception('Fanning out post %s failed', post_id)
+    finally:
+        close_old_connections()
+
+
+# Push a new post into the timelines of its author and all followers, a batch at a time
+def fan_out_post(post):
+    entries = [_entry(post.user_id, post)]
+    followers = (Follow.objects.filter(followed_id=post.user_id).annotate(mutual=_follows_back(post.user_id))
+                 .values_list('follower_id', 'mutual'))
+    for follower_id, mutual in followers.iterator(chunk_size=FEED_BATCH_SIZE):
+        entries.append(_entry(follower_id, post, _affinity(mutual)))
+        if len(entries) >= FEED_BATCH_SIZE:
+            _bulk_insert(entries)
+            entries = []
+    if entries:
+        _bulk_insert(entries)
+
+
+# Copy the most recent posts of a newly followed user into the follower's timeline
+def backfill_follow(follower, followed, limit=FEED_BACKFILL_SIZE):
+    affinity = _affinity(Follow.objects.filter(follower=followed, followed=follower).exists())
+    posts = Post.objects.filter(user=followed).order_by('-created_at', '-id')[:limit]
+    _bulk_insert([_entry(follower.id, post, affinity) for post in posts])
+
+
+async def abackfill_follow(follower, followed, limit=FEED_BACKFILL_SIZE):
+    affinity = _affinity(await Follow.objects.filter(follower=followed, followed=follower).aexists())
+    posts = Post.objects.filter(user=followed).order_by('-created_at', '-id')[:limit]
+    entries = [_entry(follower.id, post, affinity) async for post in posts]
+    await FeedEntry.objects.abulk_create(entries, batch_size=FEED_BATCH_SIZE, ignore_conflicts=True)
+    await FeedEntry.objects.filter(id__in=_overflow([follower.id], FEED_TIMELINE_SIZE)).adelete()
+
+
+# Drop an unfollowed user's posts from the follower's timeline
+def remove_follow(follower, followed):
+    FeedEntry.objects.filter(owner=follower, author=followed).delete()
+
+
+async def aremove_follow(follower, followed):
+    await FeedEntry.objects.filter(owner=follower, author=followed).adelete()
+
+
+# Rebuild one user's timeline from scratch (own posts plus followed users)
+def rebuild_timeline(user, limit=FEED_BACKFILL_SIZE):
+    FeedEntry.objects.filter(owner=user).delete()
+    followed_ids = Follow.objects.filter(follower=user).values_list('followed_id', flat=True)
+    mutual_ids = set(Follow.objects.filter(followed=user, follower_id__in=followed_ids).values_list('follower_id', flat=True))
+    posts = (Post.objects.filter(Q(user=user) | Q(user_id__in=followed_ids))
+             .order_by('-created_at', '-id')[:limit])
+    _bulk_insert([_entry(user.id, post, _affinity(post.user_id in mutual_ids)) for post in posts])
+
+
+# Page of a user's timeline, newest first or best ranked first, returns (posts, next_cursor)
+def timeline_page(user, cursor=None, page_size=FEED_PAGE_SIZE, mode='latest'):
+    entries = FeedEntry.objects.filter(owner=user).select_related('post__user')
+    entries, next_cursor = keyset_page(entries, cursor, page_size, keys=MODE_KEYS[mode])
+    return [entry.post for entry in entries], next_cursor
+
+
+# Recompute the ranks of a post's entries from its counters after a like or
+# comment changed them. That rewrites one row per follower, so it is kept off
+# the request: queued on the fan-out pool once the counters are committed, like
+# fan-out (run on commit instead unless FEED_FANOUT_ASYNC). A post already
+# waiting in the queue is not queued again, its update reads the counters when
+# it runs. Only the post's id and created_at are used.
+_pending_ranks = set()
+_pending_ranks_lock = threading.Lock()
+
+
+def _bumped_rank(post_id, created_at):
+    points = Post.objects.filter(pk=post_id).values(points=_points(F('likes_count'), F('comments_count')))
+    return Log(2.0, F('affinity') * Subquery(points, output_field=FloatField())) + _recency(created_at)
+
+
+def update_rank(post_id, created_at):
+    return FeedEntry.objects.filter(post_id=post_id).update(rank_score=_bumped_rank(post_id, created_at))
+
+
+def _queue_rank_update(post_id, created_at):
+    with _pending_ranks_lock:
+        if post_id in _pending_ranks:
+            return
+        _pending_ranks.add(post_id)
+    _get_executor().submit(_run_rank_update, post_id, created_at)
+
+
+def _run_rank_update(post_id, created_at):
+    with _pending_ranks_lock:
+        _pending_ranks.discard(post_id)
+    close_old_connections()
+    try:
+        update_rank(post_id, created_at)
+    except Exception:
+        logger.exception('Updating the ranks of post %s failed', post_id)
+    finally:
+        close_old_connections()
+
+
+# Called inside the transaction that changed the counters
+def bump_rank(post):
+    post_id, created_at = post.pk, post.created_at
+    if FEED_FANOUT_ASYNC:
+        transaction.on_commit(lambda: _queue_rank_update(post_id, created_at))
+    else:
+        transaction.on_commit(lambda: update_rank(post_id, created_at))
+
+
+# The async views update the counters in autocommit, so they are committed already
+async def abump_rank(post):
+    if FEED_FANOUT_ASYNC:
+        _queue_rank_update(post.pk, post.created_at)
+    else:
+        await FeedEntry.objects.filter(post_id=post.pk).aupdate(rank_score=_bumped_rank(post.pk, post.created_at))
+
+
+# Recompute the affinity and rank of every entry of the posts of the last
+# RANK_HORIZON, returns the number of posts. Run by the rerank_feeds command.
+# Posts are read a batch at a time, newest first, and each batch is updated
+# before the next one is read.
+def rerank_recent_posts(now=None, batch_size=500):
+    now = now or timezone.now()
+    posts = (Post.objects.filter(created_at__gte=now - RANK_HORIZON)
+             .only('id', 'created_at', 'likes_count', 'comments_count').order_by('-created_at', '-id'))
+    mutual = Exists(Follow.objects.filter(follower_id=OuterRef('author_id'), followed_id=OuterRef('owner_id')))
+    count = 0
+    batch = list(posts[:batch_size])
+    while batch:
+        entries = FeedEntry.objects.filter(post_id__in=[post.id for post in batch])
+        entries.update(affinity=Case(When(mutual, then=Value(MUTUAL_AFFINITY)), default=Value(1.0)))
+        entries.update(rank_score=Log(2.0, F('affinity')) + Case(*[When(post_id=post.id, then=Value(rank_score(post))) for post in batch],
+                                                                 output_field=FloatField()))
+        count += len(batch)
+        last = batch[-1]
+        batch = list(posts.filter(keyset_filter(('created_at', 'id'), (last.created_at, last.id)))[:batch_size])
+    return count
+
+
+# Batch-load everything a page of post cards renders beyond the post row
+# itself (the viewer's own likes) in a fixed number of queries whatever the
+# page size. Authors must already be select_related. Comments are not part of
+# a card, the comment modal loads them (see comments.py).
+def load_post_cards(posts, viewer, card_mode='feed'):
+    posts = list(posts)
+    post_ids = [post.id for post in posts]
+    if not post_ids:
+        return posts
+
+    liked_ids = set()
+    if viewer.is_authenticated:
+        liked_ids = set(LikePost.objects.filter(user=viewer, post_id__in=post_ids).values_list('post_id', flat=True))
+    cards = cached_cards(posts, card_mode)
+
+    for post in posts:
+        post.is_liked = post.id in liked_ids
+        post.card_html = cards.get(post.id)
+    return posts
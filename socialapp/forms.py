@@ -42,9 +42,13 @@ class PostForm(forms.ModelForm):
             'video': forms.FileInput(attrs={'accept': 'video/*'}),
         }
     
-    def __init__(self, *args, **kwargs):
+    # upload: a finished UploadSession sent as upload_id instead of a file field;
+    # rejected_uploads: {field: message} from LimitedUploadHandler
+    def __init__(self, *args, upload=None, rejected_uploads=None, **kwargs):
         super().__init__(*args, **kwargs)
         self.fields['caption'].required = True
+        self.upload = upload
+        self.rejected_uploads = rejected_uploads or {}
         
     def clean(self):
         cleaned_data = super().clean()
@@ -52,6 +56,11 @@ class PostForm(forms.ModelForm):
         video = cleaned_data.get('video')
         caption = cleaned_data.get('caption')
 
+        for field, message in self.rejected_uploads.items():
+            self.add_error(field if field in self.fields else None, message)
+        if self.rejected_uploads or self.upload:
+            return cleaned_data
+
         if image and video:
             raise forms.ValidationError("You can't upload both an image and a video.")
         
@@ -0,0 +1,195 @@
+import heapq
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from itertools import accumulate
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Max
+from .models import Follow, FollowChange, FollowSuggestion
+
+# "People you may know" from an in-memory follow graph.
+#
+# Follow rows are loaded into two CSR (compressed sparse row) adjacency arrays
+# indexed directly by user id, one for the people a user follows and one for
+# their followers:
+#
+#   targets[offsets[user_id]:offsets[user_id + 1]]  ->  sorted neighbour ids
+#
+# That is two flat arrays of machine integers, about 16 bytes per follow, where
+# a dict of sets would need well over a hundred. Follows and unfollows made
+# after the load come from the FollowChange log written by toggle_follow and go
+# into small added/removed overlays on top of the arrays.
+#
+# Suggestions are friends of friends: people followed by the people a user
+# follows, ranked by how many of them do (the mutual count), plus a bonus for
+# people who already follow the user. build_follow_suggestions computes them in
+# batch into FollowSuggestion rows; pages only read those rows.
+
+SUGGESTION_LIMIT = getattr(settings, 'FOLLOW_SUGGESTION_LIMIT', 20)
+SUGGESTIONS_SHOWN = getattr(settings, 'FOLLOW_SUGGESTIONS_SHOWN', 5)
+FOLLOWS_YOU_BONUS = 0.5
+STORE_BATCH_SIZE = 500
+
+
+class Adjacency:
+    # `pairs` are (source, target) sorted by source then target, with every id below `size`
+    def __init__(self, pairs, size):
+        degrees = array('q', bytes(8 * (size + 1)))
+        self.targets = array('q')
+        for source, target in pairs:
+            self.targets.append(target)
+            degrees[source + 1] += 1
+        self.offsets = array('q', accumulate(degrees))
+
+    def _bounds(self, node):
+        if node + 1 >= len(self.offsets):
+            return 0, 0
+        return self.offsets[node], self.offsets[node + 1]
+
+    def neighbours(self, node):
+        start, end = self._bounds(node)
+        return self.targets[start:end]
+
+    def degree(self, node):
+        start, end = self._bounds(node)
+        return end - start
+
+    def has(self, source, target):
+        start, end = self._bounds(source)
+        index = bisect_left(self.targets, target, start, end)
+        return index < end and self.targets[index] == target
+
+
+class FollowGraph:
+    def __init__(self, following, followers, last_change_id=0):
+        self._following = following
+        self._followers = followers
+        self._added = ({}, {})  # following, followers
+        self._removed = ({}, {})
+        self.last_change_id = last_change_id
+
+    @classmethod
+    def from_edges(cls, edges):
+        edges = list(edges)
+        size = max((max(edge) for edge in edges), default=0) + 1
+        return cls(Adjacency(sorted(edges), size), Adjacency(sorted((b, a) for a, b in edges), size))
+
+    # Read every Follow row; changes logged from here on are replayed by apply_changes()
+    @classmethod
+    def load(cls):
+        last_change_id = FollowChange.objects.aggregate(last=Max('id'))['last'] or 0
+        size = (User.objects.aggregate(last=Max('id'))['last'] or 0) + 1
+        rows = Follow.objects.filter(follower_id__lt=size, followed_id__lt=size)
+        following = Adjacency(rows.order_by('follower_id', 'followed_id').values_list('follower_id', 'followed_id').iterator(chunk_size=10000), size)
+        followers = Adjacency(rows.order_by('followed_id', 'follower_id').values_list('followed_id', 'follower_id').iterator(chunk_size=10000), size)
+        return cls(following, followers, last_change_id)
+
+    def _neighbours(self, direction, adjacency, node):
+        removed = self._removed[direction].get(node)
+        neighbours = [other for other in adjacency.neighbours(node) if other not in removed] if removed else list(adjacency.neighbours(node))
+        neighbours.extend(self._added[direction].get(node, ()))
+        return neighbours
+
+    def following(self, user_id):
+        return self._neighbours(0, self._following, user_id)
+
+    def followers(self, user_id):
+        return self._neighbours(1, self._followers, user_id)
+
+    def follower_count(self, user_id):
+        return (self._followers.degree(user_id) + len(self._added[1].get(user_id, ()))
+                - len(self._removed[1].get(user_id, ())))
+
+    def follows(self, follower_id, followed_id):
+        if followed_id in self._added[0].get(follower_id, ()):
+            return True
+        if followed_id in self._removed[0].get(follower_id, ()):
+            return False
+        return self._following.has(follower_id, followed_id)
+
+    def _set(self, direction, adjacency, source, target, present):
+        added, removed = self._added[direction].setdefault(source, set()), self._removed[direction].setdefault(source, set())
+        added.discard(target)
+        removed.discard(target)
+        # Replaying a change the arrays already hold is a no-op
+        if present != adjacency.has(source, target):
+            (added if present else removed).add(target)
+
+    def apply(self, follower_id, followed_id, following):
+        self._set(0, self._following, follower_id, followed_id, following)
+        self._set(1, self._followers, followed_id, follower_id, following)
+
+    # Apply logged follows/unfollows, returns the users whose suggestions they change
+    def apply_changes(self, changes):
+        affected = set()
+        for change in changes:
+            self.apply(change.follower_id, change.followed_id, change.following)
+            # The follower's friends of friends, the followed user's "follows you"
+            # and the mutual counts of everyone following the follower
+            affected.update((change.follower_id, change.followed_id), self.followers(change.follower_id))
+            self.last_change_id = max(self.last_change_id, change.id)
+        return affected
+
+    # How many of the people `user_id` follows also follow `other_id`
+    def mutual_count(self, user_id, other_id):
+        return len(set(self.following(user_id)).intersection(self.followers(other_id)))
+
+    # Best friends-of-friends for a user as [(user id, mutual count, follows you, score)]
+    def suggestions(self, user_id, limit=SUGGESTION_LIMIT):
+        followed = set(self.following(user_id))
+        mutual = Counter()
+        for friend in followed:
+            mutual.update(self.following(friend))
+        follows_you = set(self.followers(user_id))
+        candidates = (mutual.keys() | follows_you) - followed - {user_id}
+
+        def score(candidate):
+            return mutual[candidate] + (FOLLOWS_YOU_BONUS if candidate in follows_you else 0)
+
+        best = heapq.nsmallest(limit, candidates, key=lambda candidate: (-score(candidate), -self.follower_count(candidate), candidate))
+        return [(candidate, mutual[candidate], candidate in follows_you, score(candidate)) for candidate in best]
+
+
+# Replace the stored suggestions of `user_ids` with fresh ones from the graph
+def store_suggestions(graph, user_ids, limit=SUGGESTION_LIMIT):
+    stored = 0
+    user_ids = sorted(user_ids)
+    for start in range(0, len(user_ids), STORE_BATCH_SIZE):
+        batch = user_ids[start:start + STORE_BATCH_SIZE]
+        computed = {user_id: graph.suggestions(user_id, limit) for user_id in batch}
+        # Users deleted since the graph was loaded
+        wanted = set(computed).union(*({candidate for candidate, *_ in rows} for rows in computed.values()))
+        existing = set(User.objects.filter(id__in=wanted).values_list('id', flat=True))
+        suggestions = [
+            FollowSuggestion(user_id=user_id, suggested_id=candidate, mutual_count=mutual_count, follows_you=follows_you, score=score)
+            for user_id, rows in computed.items() if user_id in existing
+            for candidate, mutual_count, follows_you, score in rows if candidate in existing
+        ]
+        with transaction.atomic():
+            FollowSuggestion.objects.filter(user_id__in=batch).delete()
+            FollowSuggestion.objects.bulk_create(suggestions)
+        stored += len(suggestions)
+    return stored
+
+
+# Called by toggle_follow once the Follow row changed
+def record_follow(follower, followed, following):
+    FollowChange.objects.create(follower_id=follower.pk, followed_id=followed.pk, following=following)
+
+
+async def arecord_follow(follower, followed, following):
+    await FollowChange.objects.acreate(follower_id=follower.pk, followed_id=followed.pk, following=following)
+
+
+# Stored suggestions for a page, leaving out anyone followed since the last batch
+def people_you_may_know(user, limit=SUGGESTIONS_SHOWN):
+    return list(FollowSuggestion.objects.filter(user=user)
+                .exclude(suggested__in=Follow.objects.filter(follower=user).values('followed'))
+                .select_related('suggested__profile').order_by('-score', 'id')[:limit])
+
+
+# The stored suggestion of `other` for `user` (mutual count and all), None if there is none
+def suggestion_for(user, other):
+    return FollowSuggestion.objects.filter(user=user, suggested=other).first()
@@ -0,0 +1,74 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F, Sum
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from .models import Hashtag, HashtagBucket, PostHashtag
+
+# Hashtag index and trending hashtags. Post captions are parsed once, when the
+# post is saved, into PostHashtag rows; every newly linked tag also bumps the
+# hourly HashtagBucket of the post, so trending is a sum over the last few
+# buckets instead of a rescan of all posts.
+
+TRENDING_WINDOW_HOURS = getattr(settings, 'TRENDING_WINDOW_HOURS', 24)
+TRENDING_LIMIT = getattr(settings, 'TRENDING_LIMIT', 10)
+TRENDING_CACHE_SECONDS = getattr(settings, 'TRENDING_CACHE_SECONDS', 300)
+
+
+def bucket_start(moment):
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def _bump_buckets(hashtag_ids, moment, delta):
+    if not hashtag_ids:
+        return
+    start = bucket_start(moment)
+    if delta > 0:
+        HashtagBucket.objects.bulk_create([HashtagBucket(hashtag_id=tag_id, bucket_start=start) for tag_id in hashtag_ids],
+                                          ignore_conflicts=True)
+    HashtagBucket.objects.filter(hashtag_id__in=hashtag_ids, bucket_start=start).update(count=Greatest(F('count') + delta, 0))
+
+
+# Make the post's PostHashtag rows match its caption
+def sync_post_hashtags(post):
+    names = post.hashtag_names()
+    linked = dict(PostHashtag.objects.filter(post=post).values_list('hashtag__name', 'hashtag_id'))
+
+    stale = [tag_id for name, tag_id in linked.items() if name not in names]
+    if stale:
+        PostHashtag.objects.filter(post=post, hashtag_id__in=stale).delete()
+        _bump_buckets(stale, post.created_at, -1)
+
+    added = names - linked.keys()
+    if added:
+        Hashtag.objects.bulk_create([Hashtag(name=name) for name in added], ignore_conflicts=True)
+        added_ids = list(Hashtag.objects.filter(name__in=added).values_list('id', flat=True))
+        PostHashtag.objects.bulk_create([PostHashtag(post=post, hashtag_id=tag_id, created_at=post.created_at) for tag_id in added_ids],
+                                        ignore_conflicts=True)
+        _bump_buckets(added_ids, post.created_at, 1)
+
+
+# Take a post that is about to be deleted out of the trending counts
+def release_post_hashtags(post):
+    _bump_buckets(list(PostHashtag.objects.filter(post=post).values_list('hashtag_id', flat=True)), post.created_at, -1)
+
+
+# Most used hashtags over the last `hours`, as [(name, uses), ...]
+def trending_hashtags(hours=TRENDING_WINDOW_HOURS, limit=TRENDING_LIMIT):
+    cache_key = f'trending_hashtags:{hours}:{limit}'
+    trending = cache.get(cache_key)
+    if trending is None:
+        since = bucket_start(timezone.now()) - timedelta(hours=hours - 1)
+        trending = list(HashtagBucket.objects.filter(bucket_start__gte=since, count__gt=0)
+                        .values('hashtag__name').annotate(uses=Sum('count'))
+                        .order_by('-uses', 'hashtag__name').values_list('hashtag__name', 'uses')[:limit])
+        cache.set(cache_key, trending, TRENDING_CACHE_SECONDS)
+    return trending
+
+
+# Drop buckets that have fallen out of every trending window
+def prune_buckets(keep_hours=TRENDING_WINDOW_HOURS):
+    cutoff = bucket_start(timezone.now()) - timedelta(hours=keep_hours)
+    deleted, _ = HashtagBucket.objects.filter(bucket_start__lt=cutoff).delete()
+    return deleted
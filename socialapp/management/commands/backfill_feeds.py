@@ -0,0 +1,24 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from socialapp.feed import FEED_BACKFILL_SIZE, rebuild_timeline
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the materialized home timelines (FeedEntry rows) from posts and follows.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', action='append', dest='usernames', help='Only rebuild these users (repeatable).')
+        parser.add_argument('--limit', type=int, default=FEED_BACKFILL_SIZE, help='Posts to keep per timeline.')
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by('id')
+        if options['usernames']:
+            users = users.filter(username__in=options['usernames'])
+
+        total = 0
+        for user in users.iterator():
+            rebuild_timeline(user, limit=options['limit'])
+            total += 1
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {total} timeline(s).'))
@@ -0,0 +1,214 @@
+import json
+import platform
+import statistics
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+from io import BytesIO
+import django
+from PIL import Image
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from socialapp import synthetic, urls
+from socialapp.chats import get_or_create_direct_chat
+from socialapp.media import media_storage
+from socialapp.models import Chat, Comment, Follow, Post
+from socialapp.ratelimit import DEFAULT_RATES
+from socialapp.uploads import start_session
+
+BENCH_PREFIX = 'bench_'
+UNLIMITED = {scope: '1000000000/s' for scope in DEFAULT_RATES}
+
+
+def _jpeg():
+    buffer = BytesIO()
+    Image.new('RGB', (64, 64), 'wheat').save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+# How to request each URL name in socialapp/urls.py, as a function of the
+# benchmark context and the request number returning
+# (client, method, path, data, extra headers). Unsafe requests get what they
+# need prepared outside the timed part, see Command._prepare().
+ENDPOINTS = {
+    'sign_in': lambda c, i: ('anonymous', 'get', reverse('sign_in'), None, {}),
+    'base': lambda c, i: ('viewer', 'get', reverse('base'), None, {}),
+    'feed_page': lambda c, i: ('viewer', 'get', reverse('feed_page'), {'source': 'profile', 'username': c['author'].username}, {}),
+    'search_posts': lambda c, i: ('viewer', 'get', reverse('search_posts'), {'q': synthetic.WORDS[i % len(synthetic.WORDS)]}, {}),
+    'hashtag': lambda c, i: ('viewer', 'get', reverse('hashtag', args=[synthetic.TAGS[i % len(synthetic.TAGS)]]), None, {}),
+    'sign_up': lambda c, i: ('anonymous', 'get', reverse('sign_up'), None, {}),
+    'sign_out': lambda c, i: ('signed_out', 'get', reverse('sign_out'), None, {}),
+    'profile_settings': lambda c, i: ('viewer', 'get', reverse('profile_settings'), None, {}),
+    'profile': lambda c, i: ('viewer', 'get', reverse('profile', args=[c['author'].username]), None, {}),
+    'followers': lambda c, i: ('viewer', 'get', reverse('followers', args=[c['author'].username]), None, {}),
+    'following': lambda c, i: ('viewer', 'get', reverse('following', args=[c['viewer'].username]), None, {}),
+    'message': lambda c, i: ('viewer', 'get', reverse('message'), None, {}),
+    'open_chat': lambda c, i: ('viewer', 'get', reverse('open_chat', args=[c['author'].username]), None, {}),
+    'get_messages': lambda c, i: ('viewer', 'get', reverse('get_messages', args=[c['chat'].id]), None, {}),
+    'send_message': lambda c, i: ('viewer', 'post', reverse('send_message'), {'chat_id': c['chat'].id, 'content': f'Benchmark {i}'}, {}),
+    'create_post': lambda c, i: ('viewer', 'get', reverse('create_post'), None, {}),
+    'start_upload': lambda c, i: ('viewer', 'post', reverse('start_upload'), {'filename': 'clip.mp4', 'content_type': 'video/mp4', 'size': 1024}, {}),
+    'upload_chunk': lambda c, i: ('viewer', 'head', reverse('upload_chunk', args=[c['upload'].id]), None, {}),
+    'edit_post': lambda c, i: ('viewer', 'get', reverse('edit_post', args=[c['own_post'].id]), None, {}),
+    'delete_post': lambda c, i: ('viewer', 'post', reverse('delete_post', args=[c['doomed'][i].id]), None, {}),
+    'like_post': lambda c, i: ('viewer', 'post', reverse('like_post', args=[c['post'].id]), None, {}),
+    'add_comment': lambda c, i: ('viewer', 'post', reverse('add_comment', args=[c['post'].id]), {'text': f'Benchmark {i}'}, {}),
+    'comments': lambda c, i: ('viewer', 'get', reverse('comments', args=[c['post'].id]), None, {}),
+    'comment_replies': lambda c, i: ('viewer', 'get', reverse('comment_replies', args=[c['post'].id, c['comment'].id]), None, {}),
+    'toggle_follow': lambda c, i: ('viewer', 'post', reverse('toggle_follow', args=[c['stranger'].username]), None, {}),
+    'serve_media': lambda c, i: ('viewer', 'get', c['media_url'], None, {}),
+    'metrics': lambda c, i: ('anonymous', 'get', reverse('metrics'), None, {}),
+}
+
+
+def _percentile(values, percent):
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method='inclusive')[percent - 1]
+
+
+# Requests every URL of socialapp/urls.py through the test client against
+# synthetic datasets of increasing size and reports latency percentiles, query
+# counts and peak traced memory per endpoint as JSON. By default it runs in a
+# throwaway test database (in-memory on SQLite), so it needs no services and
+# leaves the configured database alone.
+class Command(BaseCommand):
+    help = 'Benchmark every socialapp URL at several synthetic dataset sizes and print the results as JSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='100,500', help='Comma-separated numbers of generated users.')
+        parser.add_argument('--requests', type=int, default=20, help='Timed requests per endpoint.')
+        parser.add_argument('--warmup', type=int, default=2, help='Untimed requests per endpoint first.')
+        parser.add_argument('--endpoint', action='append', dest='endpoints', help='Only these URL names (repeatable).')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Write the JSON here instead of stdout.')
+        parser.add_argument('--current-db', action='store_true',
+                            help='Use the configured database instead of a test database (generated rows are removed after).')
+
+    def handle(self, *args, **options):
+        names = [pattern.name for pattern in urls.urlpatterns]
+        missing = set(names) - ENDPOINTS.keys()
+        if missing:
+            raise CommandError(f'No benchmark request for: {", ".join(sorted(missing))}')
+        names = [name for name in names if not options['endpoints'] or name in options['endpoints']]
+        sizes = [int(size) for size in options['sizes'].split(',') if size.strip()]
+        if options['requests'] < 1:
+            raise CommandError('--requests must be at least 1.')
+
+        old_name = None if options['current_db'] else connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with tempfile.TemporaryDirectory() as media_root, override_settings(
+                    MEDIA_ROOT=media_root, UPLOAD_SESSION_DIR=media_root, RATE_LIMITS=UNLIMITED,
+                    MAX_OPEN_UPLOADS=10 ** 9, MAX_PENDING_UPLOAD_BYTES=2 ** 62,
+                    ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+                    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher']):
+                runs = [self._run(size, names, options) for size in sizes]
+        finally:
+            if old_name is None:
+                synthetic.clear(BENCH_PREFIX)
+            else:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        report = json.dumps({
+            'created_at': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'requests': options['requests'],
+            'runs': runs,
+        }, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                output.write(report + '\n')
+        else:
+            self.stdout.write(report)
+
+    def _run(self, size, names, options):
+        synthetic.clear(BENCH_PREFIX)
+        for alias in ('default', 'ratelimit', settings.POST_CARD_CACHE):
+            caches[alias].clear()
+        started = time.perf_counter()
+        dataset = synthetic.generate(users=size, seed=options['seed'], prefix=BENCH_PREFIX)
+        generate_seconds = time.perf_counter() - started
+
+        total = options['warmup'] + options['requests'] + 1  # the last request is traced for memory
+        context = self._prepare(total)
+        clients = {'anonymous': Client(), 'viewer': Client(), 'signed_out': Client()}
+        clients['viewer'].force_login(context['viewer'])
+        endpoints = [self._measure(name, context, clients, options['warmup'], options['requests']) for name in names]
+        return {'users': size, 'dataset': dataset, 'generate_seconds': round(generate_seconds, 3), 'endpoints': endpoints}
+
+    # Objects the requests point at: the most followed user's posts and chats,
+    # seen by a user who follows them
+    def _prepare(self, total):
+        users = User.objects.filter(username__startswith=BENCH_PREFIX)
+        author = users.order_by('-profile__followers_count', 'id').first()
+        follower = Follow.objects.filter(followed=author).values_list('follower_id', flat=True).first()
+        viewer = users.get(id=follower) if follower else users.exclude(id=author.id).first()
+        if not follower:
+            Follow.objects.create(follower=viewer, followed=author)
+        post = Post.objects.filter(user=author).order_by('-created_at').first() or Post.objects.create(user=author, caption='Benchmark')
+        comment = Comment.objects.filter(post=post, parent=None).first() or Comment.objects.create(post=post, user=author, text='Benchmark')
+        chat = Chat.objects.filter(participants=viewer).first()
+        if chat is None:
+            chat = get_or_create_direct_chat(viewer, author)
+        stranger = User.objects.create_user(f'{BENCH_PREFIX}stranger')
+        media_name = media_storage.save('posts/benchmark.jpg', ContentFile(_jpeg()))
+        return {
+            'viewer': viewer,
+            'author': author,
+            'post': post,
+            'comment': comment,
+            'own_post': Post.objects.create(user=viewer, caption='Benchmark #travel'),
+            'doomed': [Post.objects.create(user=viewer, caption=f'Delete me {i}') for i in range(total)],
+            'chat': chat,
+            'stranger': stranger,
+            'upload': start_session(viewer, 'clip.mp4', 'video/mp4', 1024),
+            'media_url': f'{settings.MEDIA_URL}{media_name}',
+        }
+
+    def _measure(self, name, context, clients, warmup, timed):
+        latencies, queries, statuses = [], [], Counter()
+        peak_memory = 0
+        for index in range(warmup + timed + 1):
+            client_name, method, path, data, extra = ENDPOINTS[name](context, index)
+            client = clients[client_name]
+            if client_name == 'signed_out':
+                client.force_login(context['viewer'])
+            traced = index == warmup + timed
+            if traced:
+                tracemalloc.start()
+            connection.queries_log.clear()  # the log is capped, a full one would count nothing
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                response = getattr(client, method)(path, data, **extra)
+                elapsed = time.perf_counter() - started
+            if traced:
+                peak_memory = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            elif index >= warmup:
+                latencies.append(elapsed * 1000)
+                queries.append(len(captured.captured_queries))
+                statuses[str(response.status_code)] += 1
+        latencies.sort()
+        return {
+            'name': name,
+            'method': method.upper(),
+            'path': path,
+            'statuses': dict(statuses),
+            'p50_ms': round(_percentile(latencies, 50), 3),
+            'p95_ms': round(_percentile(latencies, 95), 3),
+            'p99_ms': round(_percentile(latencies, 99), 3),
+            'queries': round(statistics.mean(queries), 2),
+            'max_queries': max(queries),
+            'peak_memory_kb': round(peak_memory / 1024, 1),
+        }
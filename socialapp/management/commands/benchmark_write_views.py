@@ -0,0 +1,146 @@
+import asyncio
+import json
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import AsyncClient, Client, override_settings
+from socialapp.counters import reconcile_post_counters, reconcile_profile_counters
+from socialapp.models import Comment, Follow, LikePost, Post, Profile
+
+BENCH_PREFIX = 'bench_write_'
+UNLIMITED = {scope: '1000000000/s' for scope in ('like_post', 'toggle_follow', 'add_comment', 'send_message')}
+
+
+# Compares the sync write views (a fixed pool of worker threads, as under a
+# threaded WSGI server) with their async versions (one event loop, as under
+# ASGI) by firing the same requests at both through Django's in-process
+# handlers. Network and server overhead are left out on purpose; the numbers
+# show handler throughput, latency under concurrency and how many threads each
+# mode needed. It runs in a throwaway test database unless --current-db is
+# given, in which case the benchmark users and their rows are removed
+# afterwards and only the counters of the rows they touched are recounted.
+class Command(BaseCommand):
+    help = 'Benchmark the sync and async versions of the like/follow JSON endpoints.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--endpoint', choices=('like', 'follow'), default='like')
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--concurrency', type=int, default=200, help='Requests in flight in async mode.')
+        parser.add_argument('--threads', type=int, default=8, help='Worker threads in sync mode.')
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON.')
+        parser.add_argument('--current-db', action='store_true',
+                            help='Use the configured database instead of a test database (benchmark rows are removed after).')
+
+    def handle(self, *args, **options):
+        old_name = None if options['current_db'] else connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            users, author, post = self._setup(options['users'])
+            cookies = [self._session_cookie(user) for user in users]
+            path = f'/post/{post.id}/like/' if options['endpoint'] == 'like' else f'/toggle-follow/{author.username}/'
+            with override_settings(RATE_LIMITS=UNLIMITED, ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+                results = [
+                    self._run_sync(path, cookies, options['requests'], options['threads']),
+                    self._run_async(path, cookies, options['requests'], options['concurrency']),
+                ]
+        finally:
+            if old_name is None:
+                self._clear()
+            else:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        self.stdout.write(f'{"mode":<6} {"requests":>8} {"errors":>6} {"req/s":>9} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"threads":>7}')
+        for result in results:
+            self.stdout.write(f'{result["mode"]:<6} {result["requests"]:>8} {result["errors"]:>6} {result["requests_per_second"]:>9.1f} '
+                              f'{result["p50_ms"]:>8.1f} {result["p95_ms"]:>8.1f} {result["p99_ms"]:>8.1f} {result["peak_threads"]:>7}')
+
+    def _setup(self, count):
+        User.objects.filter(username__startswith=BENCH_PREFIX).delete()
+        author = User.objects.create_user(f'{BENCH_PREFIX}author')
+        users = [User.objects.create_user(f'{BENCH_PREFIX}{i}') for i in range(count)]
+        post = Post.objects.create(user=author, caption='Benchmark')
+        return users, author, post
+
+    # Remove the benchmark users, then recount the posts and profiles of other
+    # users that their likes, comments and follows pointed at
+    def _clear(self):
+        bench_users = User.objects.filter(username__startswith=BENCH_PREFIX)
+        post_ids = {*LikePost.objects.filter(user__in=bench_users).values_list('post_id', flat=True),
+                    *Comment._base_manager.filter(user__in=bench_users).values_list('post_id', flat=True)}
+        user_ids = {*Follow.objects.filter(follower__in=bench_users).values_list('followed_id', flat=True),
+                    *Follow.objects.filter(followed__in=bench_users).values_list('follower_id', flat=True)}
+        bench_users.delete()
+        reconcile_post_counters(Post._base_manager.filter(id__in=post_ids))
+        reconcile_profile_counters(Profile.objects.filter(user_id__in=user_ids))
+
+    def _session_cookie(self, user):
+        client = Client()
+        client.force_login(user)
+        return client.cookies[settings.SESSION_COOKIE_NAME].value
+
+    def _client(self, client_class, cookie):
+        client = client_class(raise_request_exception=False)  # failures count as errors
+        client.cookies[settings.SESSION_COOKIE_NAME] = cookie
+        return client
+
+    def _run_sync(self, path, cookies, total, threads):
+        peak = threading.active_count()
+
+        def request(i):
+            nonlocal peak
+            client = self._client(Client, cookies[i % len(cookies)])
+            started = time.perf_counter()
+            status = client.post(path).status_code
+            peak = max(peak, threading.active_count())
+            return time.perf_counter() - started, status
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            timings = list(pool.map(request, range(total)))
+        return self._summary('sync', timings, time.perf_counter() - started, peak)
+
+    def _run_async(self, path, cookies, total, concurrency):
+        peak = threading.active_count()
+
+        async def run():
+            nonlocal peak
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def request(i):
+                nonlocal peak
+                async with semaphore:
+                    client = self._client(AsyncClient, cookies[i % len(cookies)])
+                    started = time.perf_counter()
+                    status = (await client.post(path)).status_code
+                    peak = max(peak, threading.active_count())
+                    return time.perf_counter() - started, status
+
+            return await asyncio.gather(*(request(i) for i in range(total)))
+
+        started = time.perf_counter()
+        with override_settings(ROOT_URLCONF='socialapp.async_urls'):
+            timings = asyncio.run(run())
+        return self._summary('async', timings, time.perf_counter() - started, peak)
+
+    def _summary(self, mode, timings, elapsed, peak_threads):
+        latencies = sorted(duration * 1000 for duration, _ in timings)
+        percentiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+        return {
+            'mode': mode,
+            'requests': len(timings),
+            'errors': sum(1 for _, status in timings if status >= 400),
+            'seconds': round(elapsed, 3),
+            'requests_per_second': len(timings) / elapsed if elapsed else 0.0,
+            'p50_ms': percentiles[49],
+            'p95_ms': percentiles[94],
+            'p99_ms': percentiles[98],
+            'peak_threads': peak_threads,
+        }
@@ -0,0 +1,61 @@
+import time
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from socialapp.graph import SUGGESTION_LIMIT, FollowGraph, store_suggestions
+from socialapp.models import FollowChange
+
+CHANGE_BATCH_SIZE = 10000
+
+
+def _delete_changes(change_ids):
+    for start in range(0, len(change_ids), CHANGE_BATCH_SIZE):
+        FollowChange.objects.filter(id__in=change_ids[start:start + CHANGE_BATCH_SIZE]).delete()
+
+
+# Without --watch this is a full rebuild to run from cron. With --watch it keeps
+# the graph in memory, replays the FollowChange log every --interval seconds and
+# only recomputes the users those changes affect, reloading from scratch every
+# --reload seconds. Run a single watcher.
+#
+# Only the log rows that were actually read are deleted: ids are handed out
+# before transactions commit, so a row with a lower id can still show up after
+# a batch with higher ones was read. Everything left in the log has not been
+# applied yet.
+class Command(BaseCommand):
+    help = 'Compute "people you may know" suggestions from the follow graph.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=SUGGESTION_LIMIT, help='Suggestions stored per user.')
+        parser.add_argument('--watch', action='store_true', help='Keep running and apply follow changes incrementally.')
+        parser.add_argument('--interval', type=float, default=10, help='Seconds between change replays with --watch.')
+        parser.add_argument('--reload', type=float, default=3600, help='Seconds between full rebuilds with --watch.')
+
+    def handle(self, *args, **options):
+        graph = self._rebuild(options['limit'])
+        loaded_at = time.monotonic()
+        while options['watch']:
+            time.sleep(options['interval'])
+            if time.monotonic() - loaded_at >= options['reload']:
+                graph = self._rebuild(options['limit'])
+                loaded_at = time.monotonic()
+                continue
+            self._apply_pending(graph, options['limit'])
+
+    def _apply_pending(self, graph, limit):
+        changes = list(FollowChange.objects.order_by('id')[:CHANGE_BATCH_SIZE])
+        if changes:
+            affected = graph.apply_changes(changes)
+            stored = store_suggestions(graph, affected, limit)
+            _delete_changes([change.id for change in changes])
+            self.stdout.write(f'Applied {len(changes)} change(s), stored {stored} suggestion(s) for {len(affected)} user(s).')
+
+    def _rebuild(self, limit):
+        started = time.perf_counter()
+        # Changes committed before the load are part of the loaded graph, later
+        # ones stay in the log (replaying one the graph already holds is a no-op)
+        loaded_changes = list(FollowChange.objects.values_list('id', flat=True))
+        graph = FollowGraph.load()
+        stored = store_suggestions(graph, User.objects.values_list('id', flat=True), limit)
+        _delete_changes(loaded_changes)
+        self.stdout.write(self.style.SUCCESS(f'Stored {stored} suggestion(s) in {time.perf_counter() - started:.1f}s.'))
+        return graph
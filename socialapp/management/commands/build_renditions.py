@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from socialapp.models import Post, Profile
+from socialapp.renditions import build_renditions, is_stale
+
+
+class Command(BaseCommand):
+    help = 'Build resized JPEG/WebP renditions for post images and profile pictures that lack them.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Rebuild renditions that are already up to date.')
+
+    def handle(self, *args, **options):
+        for spec_name, model, image_field in (('post', Post, 'image'), ('profile', Profile, 'profile_pic')):
+            built = failed = 0
+            for instance in model._base_manager.exclude(**{image_field: ''}).exclude(**{f'{image_field}__isnull': True}).iterator():
+                if not options['force'] and not is_stale(instance, spec_name):
+                    continue
+                try:
+                    build_renditions(spec_name, instance.pk, getattr(instance, image_field).name)
+                    built += 1
+                except (OSError, ValueError) as exc:
+                    failed += 1
+                    self.stderr.write(f'{spec_name} {instance.pk}: {exc}')
+            self.stdout.write(self.style.SUCCESS(f'Built {spec_name} renditions for {built} row(s), {failed} failed.'))
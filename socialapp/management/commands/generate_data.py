@@ -0,0 +1,31 @@
+import time
+from django.core.management.base import BaseCommand
+from socialapp.synthetic import PASSWORD, PREFIX, clear, generate
+
+
+class Command(BaseCommand):
+    help = 'Bulk-generate a synthetic dataset (users, follows, posts, likes, comments, chats) for local benchmarking.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--follows', type=int, default=20, help='Mean number of people each user follows.')
+        parser.add_argument('--posts', type=int, default=5, help='Mean posts per user.')
+        parser.add_argument('--likes', type=int, default=10, help='Mean likes per post.')
+        parser.add_argument('--comments', type=int, default=3, help='Mean comments per post.')
+        parser.add_argument('--reply-ratio', type=float, default=0.3, help='Share of comments that are replies.')
+        parser.add_argument('--chats', type=int, help='Direct chats (default half the number of users).')
+        parser.add_argument('--messages', type=int, default=20, help='Mean messages per chat.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--prefix', default=PREFIX, help='Username prefix of the generated users.')
+        parser.add_argument('--clear', action='store_true', help='Delete the users with this prefix (and their data) first.')
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            self.stdout.write(f'Deleted {clear(options["prefix"])} row(s).')
+        started = time.perf_counter()
+        counts = generate(users=options['users'], follows=options['follows'], posts=options['posts'], likes=options['likes'],
+                          comments=options['comments'], reply_ratio=options['reply_ratio'], chats=options['chats'],
+                          messages=options['messages'], seed=options['seed'], prefix=options['prefix'])
+        summary = ', '.join(f'{count} {name}' for name, count in counts.items())
+        self.stdout.write(self.style.SUCCESS(f'Generated {summary} in {time.perf_counter() - started:.1f}s.'))
+        self.stdout.write(f'Sign in as {options["prefix"]}0 with password {PASSWORD}.')
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from socialapp.uploads import UPLOAD_SESSION_TTL_HOURS, purge_stale_sessions
+
+
+class Command(BaseCommand):
+    help = 'Delete resumable uploads that were abandoned, with their partial files.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=UPLOAD_SESSION_TTL_HOURS, help='Age of the last chunk after which an upload is abandoned.')
+
+    def handle(self, *args, **options):
+        purged = purge_stale_sessions(options['hours'])
+        self.stdout.write(self.style.SUCCESS(f'Purged {purged} abandoned upload(s).'))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from socialapp.hashtags import TRENDING_WINDOW_HOURS, prune_buckets, sync_post_hashtags
+from socialapp.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Re-index post hashtags from captions and prune expired trending buckets.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--prune-only', action='store_true', help='Only delete expired hourly buckets.')
+        parser.add_argument('--keep-hours', type=int, default=TRENDING_WINDOW_HOURS, help='Hours of buckets to keep.')
+
+    def handle(self, *args, **options):
+        if not options['prune_only']:
+            total = 0
+            for post in Post._base_manager.only('id', 'caption', 'created_at').iterator():
+                sync_post_hashtags(post)
+                total += 1
+            self.stdout.write(f'Indexed hashtags for {total} post(s).')
+        pruned = prune_buckets(options['keep_hours'])
+        self.stdout.write(self.style.SUCCESS(f'Pruned {pruned} expired bucket(s).'))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from socialapp import search
+from socialapp.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Recreate the full-text search index for posts (tsvector on PostgreSQL, FTS5 on SQLite).'
+
+    def handle(self, *args, **options):
+        backend = search.get_backend()
+        with connection.cursor() as cursor:
+            backend.uninstall(cursor)
+            backend.install(cursor)
+        total = search.rebuild_index(Post._base_manager.all())
+        self.stdout.write(self.style.SUCCESS(f'Indexed {total} post(s) with {type(backend).__name__}.'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from socialapp.counters import reconcile_post_counters, reconcile_profile_counters
+
+
+class Command(BaseCommand):
+    help = 'Recount denormalized like, comment, follower, following and post counters and repair any drift.'
+
+    def handle(self, *args, **options):
+        posts = reconcile_post_counters()
+        profiles = reconcile_profile_counters()
+        self.stdout.write(self.style.SUCCESS(f'Repaired {posts} post(s) and {profiles} profile(s).'))
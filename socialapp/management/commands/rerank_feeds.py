@@ -0,0 +1,17 @@
+import time
+from django.core.management.base import BaseCommand
+from socialapp.feed import rerank_recent_posts
+
+
+# Run from cron, e.g. daily: scores do not decay, so this only catches up
+# with follows that changed affinities and with repaired counters
+class Command(BaseCommand):
+    help = 'Recompute the ranked timeline scores of recent posts from their counters and follows.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Posts read and updated per batch.')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        posts = rerank_recent_posts(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Reranked the timeline entries of {posts} post(s) in {time.perf_counter() - started:.1f}s.'))
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from socialapp.cards import CARD_MODES, cache_stats, card_cache, card_key, render_card
+from socialapp.models import Post
+
+BATCH_SIZE = 200
+
+
+class Command(BaseCommand):
+    help = 'Render the most recent post cards into the card cache, or report its hit/miss counters.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=1000, help='Number of most recent posts to warm.')
+        parser.add_argument('--mode', choices=CARD_MODES, action='append', dest='modes', help='Card mode (repeatable, default all).')
+        parser.add_argument('--stats', action='store_true', help='Only print the hit/miss counters.')
+
+    def handle(self, *args, **options):
+        if not options['stats']:
+            modes = options['modes'] or CARD_MODES
+            post_ids = list(Post.objects.order_by('-created_at', '-id').values_list('id', flat=True)[:options['limit']])
+            rendered = 0
+            for start in range(0, len(post_ids), BATCH_SIZE):
+                posts = list(Post.objects.filter(id__in=post_ids[start:start + BATCH_SIZE]).select_related('user'))
+                for mode in modes:
+                    cached = card_cache().get_many([card_key(post, mode) for post in posts])
+                    for post in posts:
+                        if card_key(post, mode) not in cached:
+                            render_card(post, mode)
+                            rendered += 1
+            self.stdout.write(self.style.SUCCESS(f'Rendered {rendered} card(s) for {len(post_ids)} post(s).'))
+
+        stats = cache_stats()
+        lookups = stats['hits'] + stats['misses']
+        ratio = f'{stats["hits"] / lookups:.1%}' if lookups else 'n/a'
+        self.stdout.write(f'Card cache: {stats["hits"]} hit(s), {stats["misses"]} miss(es), hit ratio {ratio}.')
@@ -0,0 +1,113 @@
+import hashlib
+from pathlib import PurePosixPath
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils.deconstruct import deconstructible
+
+# Content-addressed media. Post.image, Post.video and Profile.profile_pic are
+# stored under the SHA-256 of their bytes,
+#
+#   <upload_to prefix>/<h[:2]>/<h[2:4]>/<h>.<ext>     e.g. posts/3f/a2/3fa2...c1.jpg
+#
+# so a file that is uploaded twice, by anyone, is written once. MediaBlob keeps
+# a reference count per stored name: the model signals acquire a reference
+# when a field starts pointing at a name and release it when the field changes
+# or the row is deleted, and the last release deletes the file after commit.
+# Files stored before this layout keep their names and are counted the same way.
+
+HASH_READ_SIZE = 64 * 1024
+
+
+class ContentAddressedMixin:
+    def _save(self, name, content):
+        digest = hashlib.sha256()
+        content.seek(0)
+        for chunk in content.chunks(HASH_READ_SIZE):
+            digest.update(chunk)
+        content.seek(0)
+        path = PurePosixPath(name)
+        prefix = path.parts[0] if len(path.parts) > 1 else 'media'
+        hexdigest = digest.hexdigest()
+        name = f'{prefix}/{hexdigest[:2]}/{hexdigest[2:4]}/{hexdigest}{path.suffix.lower()}'
+        if self.exists(name):
+            return name
+        # Two uploads of the same bytes may race to here, either write is the same file
+        return super()._save(name, content)
+
+
+@deconstructible(path='socialapp.media.ContentAddressedStorage')
+class ContentAddressedStorage(ContentAddressedMixin, FileSystemStorage):
+    pass
+
+
+media_storage = ContentAddressedStorage(allow_overwrite=True)
+
+
+# Storage callable for the media fields, keeps migrations free of settings
+def get_media_storage():
+    return media_storage
+
+
+def acquire(names):
+    from .models import MediaBlob
+    names = [name for name in names if name]
+    if not names:
+        return
+    MediaBlob.objects.bulk_create([MediaBlob(name=name) for name in names], ignore_conflicts=True)
+    for name in names:
+        MediaBlob.objects.filter(name=name).update(refcount=F('refcount') + 1)
+
+
+def release(names):
+    from .models import MediaBlob
+    names = [name for name in names if name]
+    if not names:
+        return
+    unreferenced = []
+    for name in names:
+        MediaBlob.objects.filter(name=name).update(refcount=Greatest(F('refcount') - 1, 0))
+        if MediaBlob.objects.filter(name=name, refcount=0).delete()[0]:
+            unreferenced.append(name)
+    if unreferenced:
+        transaction.on_commit(lambda: delete_unreferenced(unreferenced))
+
+
+# Delete the stored files no MediaBlob references
+def delete_unreferenced(names):
+    from .models import MediaBlob
+    # A concurrent upload of the same content may have re-acquired the name meanwhile
+    revived = set(MediaBlob.objects.filter(name__in=names).values_list('name', flat=True))
+    for name in names:
+        if name not in revived:
+            media_storage.delete(name)
+
+
+# Stored names of the loaded media fields, read without touching deferred ones
+def _names(instance, fields):
+    names = {}
+    for field in fields:
+        if field in instance.__dict__:
+            value = instance.__dict__[field]
+            names[field] = getattr(value, 'name', value) or ''
+    return names
+
+
+# Field values as loaded or last saved, to tell which references a save changed
+def snapshot(instance, fields):
+    instance._media_names = _names(instance, fields)
+
+
+# Acquire and release references for the fields changed since the snapshot.
+# A field that was deferred when the row was loaded is left alone.
+def sync_references(instance):
+    previous = getattr(instance, '_media_names', {})
+    current = _names(instance, previous)
+    acquire([name for field, name in current.items() if name != previous[field]])
+    release([name for field, name in previous.items() if name != current.get(field, name)])
+    instance._media_names = {**previous, **current}
+
+
+def release_references(instance, fields):
+    release(list(_names(instance, fields).values()))
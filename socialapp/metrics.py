@@ -0,0 +1,274 @@
+import fcntl
+import glob
+import json
+import math
+import mmap
+import os
+import struct
+import threading
+from bisect import bisect_left
+from django.conf import settings
+
+# Counters, gauges and histograms shared by all worker processes of a host,
+# served in the Prometheus text format by the metrics view (/metrics).
+#
+# Every process writes its own samples to a memory-mapped file in METRICS_DIR,
+# named after its pid, so recording a value is a write to shared memory with
+# no locking between processes. A scrape reads every file and adds them up:
+# counters and histograms over all files (a worker that restarted still counts),
+# gauges over the files of processes that are still running. The first worker
+# to start after a restart, when no process of the files is running any more,
+# empties the directory, so METRICS_DIR must belong to this deployment alone.
+#
+# File layout: an 8-byte header with the number of bytes in use, then entries of
+#
+#   key length (4 bytes), JSON key [metric, sample suffix, [[label, value]...]],
+#   padding to 8 bytes, value (8-byte double)
+#
+# Entries are only ever appended; the header is updated after the entry is
+# written, so readers never see half of one.
+
+INITIAL_FILE_SIZE = 64 * 1024
+HEADER = struct.Struct('q')
+KEY_LENGTH = struct.Struct('i')
+VALUE = struct.Struct('d')
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+
+def _entry_size(key_length):
+    return VALUE.size + (KEY_LENGTH.size + key_length + 7) // 8 * 8
+
+
+class MmapStore:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._offsets = {}  # key -> offset of its value
+        self._file = open(path, 'a+b')
+        if os.fstat(self._file.fileno()).st_size < INITIAL_FILE_SIZE:
+            self._file.truncate(INITIAL_FILE_SIZE)
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        self._used = HEADER.unpack_from(self._map)[0] or HEADER.size
+        for key, offset, _ in _entries(self._map, self._used):
+            self._offsets[key] = offset
+
+    def _offset(self, key):
+        offset = self._offsets.get(key)
+        if offset is None:
+            encoded = key.encode()
+            size = _entry_size(len(encoded))
+            while self._used + size > len(self._map):
+                self._map.close()
+                self._file.truncate(2 * os.fstat(self._file.fileno()).st_size)
+                self._map = mmap.mmap(self._file.fileno(), 0)
+            start = self._used
+            KEY_LENGTH.pack_into(self._map, start, len(encoded))
+            self._map[start + KEY_LENGTH.size:start + KEY_LENGTH.size + len(encoded)] = encoded
+            offset = start + size - VALUE.size
+            VALUE.pack_into(self._map, offset, 0.0)
+            self._used += size
+            HEADER.pack_into(self._map, 0, self._used)
+            self._offsets[key] = offset
+        return offset
+
+    def add(self, key, amount):
+        with self._lock:
+            offset = self._offset(key)
+            VALUE.pack_into(self._map, offset, VALUE.unpack_from(self._map, offset)[0] + amount)
+
+    def set(self, key, value):
+        with self._lock:
+            VALUE.pack_into(self._map, self._offset(key), value)
+
+
+# (key, value offset, value) of each entry in the first `used` bytes of a file
+def _entries(data, used):
+    position = HEADER.size
+    while position < used:
+        length = KEY_LENGTH.unpack_from(data, position)[0]
+        key = bytes(data[position + KEY_LENGTH.size:position + KEY_LENGTH.size + length]).decode()
+        offset = position + _entry_size(length) - VALUE.size
+        yield key, offset, VALUE.unpack_from(data, offset)[0]
+        position += _entry_size(length)
+
+
+def metrics_dir():
+    return getattr(settings, 'METRICS_DIR', None) or os.path.join(settings.BASE_DIR, 'metrics')
+
+
+_store = None
+_store_lock = threading.Lock()
+_opened_dirs = set()
+
+
+# This process's store, reopened after a fork (gunicorn --preload) or when
+# METRICS_DIR changes
+def store():
+    global _store
+    directory = metrics_dir()
+    path = os.path.join(directory, f'{os.getpid()}.db')
+    if _store is None or _store.path != path:
+        with _store_lock:
+            if _store is None or _store.path != path:
+                os.makedirs(directory, exist_ok=True)
+                if directory not in _opened_dirs:
+                    _clear_after_restart(directory)
+                    _opened_dirs.add(directory)
+                _store = MmapStore(path)
+    return _store
+
+
+# Files of a previous run of the server are removed, when this process first
+# opens the directory and none of their processes is running any more. The lock
+# keeps workers starting together from removing each other's new files.
+def _clear_after_restart(directory):
+    with open(os.path.join(directory, '.lock'), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            paths = glob.glob(os.path.join(directory, '*.db'))
+            pids = [os.path.splitext(os.path.basename(path))[0] for path in paths]
+            if any(pid.isdigit() and int(pid) != os.getpid() and _alive(int(pid)) for pid in pids):
+                return
+            for path in paths:
+                os.remove(path)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+REGISTRY = {}
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        REGISTRY[name] = self
+
+    def _key(self, suffix, labels, *extra):
+        if set(labels) != set(self.labels):
+            raise ValueError(f'{self.name} takes the labels {", ".join(self.labels) or "(none)"}')
+        return json.dumps([self.name, suffix, [[label, str(labels[label])] for label in self.labels] + list(extra)])
+
+    def _record(self, method, suffix, value, labels, *extra):
+        if getattr(settings, 'METRICS_ENABLED', False):
+            getattr(store(), method)(self._key(suffix, labels, *extra), value)
+
+    # Text format lines from {(suffix, ((label, value), ...)): value}
+    def samples(self, values):
+        return [(self.name + suffix, labels, value) for (suffix, labels), value in sorted(values.items())]
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        self._record('add', '_total', amount, labels)
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def inc(self, amount=1, **labels):
+        self._record('add', '', amount, labels)
+
+    def dec(self, amount=1, **labels):
+        self._record('add', '', -amount, labels)
+
+    def set(self, value, **labels):
+        self._record('set', '', value, labels)
+
+
+# Counts per bucket are stored as they fall and made cumulative when read
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets) + (math.inf,)
+
+    def observe(self, value, **labels):
+        bound = self.buckets[bisect_left(self.buckets, value)]
+        self._record('add', '_bucket', 1, labels, ['le', _format(bound)])
+        self._record('add', '_sum', value, labels)
+
+    def samples(self, values):
+        series = {}
+        for (suffix, labels), value in values.items():
+            if suffix == '_bucket':
+                *labels, (_, bound) = labels
+                series.setdefault(tuple(labels), {})[bound] = value
+        lines = []
+        for labels, counts in sorted(series.items()):
+            total = 0
+            for bound in self.buckets:
+                total += counts.get(_format(bound), 0)
+                lines.append((f'{self.name}_bucket', labels + (('le', _format(bound)),), total))
+            lines.append((f'{self.name}_count', labels, total))
+            lines.append((f'{self.name}_sum', labels, values.get(('_sum', labels), 0)))
+        return lines
+
+
+REQUESTS = Counter('socialapp_requests', 'Requests by view, method and status.', ('view', 'method', 'status'))
+REQUEST_LATENCY = Histogram('socialapp_request_duration_seconds', 'Time to respond, by view.', ('view',))
+REQUEST_QUERIES = Histogram('socialapp_request_queries', 'ORM queries per request, by view.', ('view',), QUERY_BUCKETS)
+REQUESTS_IN_PROGRESS = Gauge('socialapp_requests_in_progress', 'Requests being served.')
+RATE_LIMIT_CHECKS = Counter('socialapp_rate_limit_checks', 'Rate limit lookups by scope and outcome (allowed or blocked).', ('scope', 'outcome'))
+RATE_LIMIT_CACHE = Counter('socialapp_rate_limit_cache', 'Rate limit counter lookups that found a counter (hit) or none (miss).', ('scope', 'result'))
+CARD_CACHE = Counter('socialapp_post_card_cache', 'Post card fragment lookups by result (hit or miss).', ('result',))
+
+
+def _format(value):
+    if value == math.inf:
+        return '+Inf'
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _escape(value):
+    return value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+# {metric name: {(suffix, labels): value}} summed over the files of METRICS_DIR
+def collect():
+    totals = {}
+    for path in glob.glob(os.path.join(metrics_dir(), '*.db')):
+        pid = os.path.splitext(os.path.basename(path))[0]
+        alive = pid.isdigit() and _alive(int(pid))
+        with open(path, 'rb') as file:
+            data = file.read()
+        if len(data) < HEADER.size:
+            continue
+        for key, _, value in _entries(data, min(HEADER.unpack_from(data)[0], len(data))):
+            name, suffix, labels = json.loads(key)
+            metric = REGISTRY.get(name)
+            if metric is None or (metric.kind == 'gauge' and not alive):
+                continue
+            sample = (suffix, tuple(tuple(label) for label in labels))
+            values = totals.setdefault(name, {})
+            values[sample] = values.get(sample, 0) + value
+    return totals
+
+
+def exposition():
+    totals = collect()
+    lines = []
+    for name, metric in REGISTRY.items():
+        lines.append(f'# HELP {name} {metric.documentation}')
+        lines.append(f'# TYPE {name} {metric.kind}')
+        for sample, labels, value in metric.samples(totals.get(name, {})):
+            labels = ','.join(f'{label}="{_escape(value)}"' for label, value in labels)
+            lines.append(f'{sample}{{{labels}}} {_format(value)}' if labels else f'{sample} {_format(value)}')
+    return '\n'.join(lines) + '\n'
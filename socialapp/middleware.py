@@ -0,0 +1,262 @@
+import json
+import logging
+import time
+from collections import Counter
+from contextvars import ContextVar
+from functools import wraps
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.template.base import Template
+from whitenoise.middleware import WhiteNoiseMiddleware
+from . import metrics
+
+
+# WhiteNoise only ships a sync middleware, which would make Django run the
+# whole request (async views included) in a worker thread under ASGI. This one
+# is async-capable: only requests for static files go to a thread.
+class StaticFilesMiddleware(WhiteNoiseMiddleware):
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response, *args, **kwargs):
+        super().__init__(get_response, *args, **kwargs)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = await sync_to_async(self.find_file)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return await sync_to_async(self.serve)(static_file, request)
+        return await self.get_response(request)
+
+
+# Opt-in per-request profile (settings.REQUEST_PROFILING): SQL count and time,
+# the slowest statements, template render time and view time, sent back as a
+# Server-Timing header. Requests slower than PROFILING_SLOW_MS, or running the
+# same statement PROFILING_REPEAT_THRESHOLD times or more (the N+1 signature),
+# are logged to "socialapp.profiling" as one JSON object each.
+#
+# Statements are timed by an execute wrapper added to each database connection
+# as it is opened (connection_created) and templates by a wrapper around
+# Template._render. Both are installed when the middleware is, and record into
+# the profile of the current request through a context variable, which also
+# follows async views into their sync_to_async threads. MetricsMiddleware
+# counts queries through the same execute wrapper, but nothing else times
+# templates. Disabled, the middleware removes itself (MiddlewareNotUsed) and
+# costs nothing.
+class ProfilingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'REQUEST_PROFILING', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        _install_query_hook()
+        _install_template_hook()
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        profile, token = _enter_profile()
+        try:
+            response = self.get_response(request)
+        finally:
+            _exit_profile(token)
+        return profile.finish(request, response)
+
+    async def __acall__(self, request):
+        profile, token = _enter_profile()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _exit_profile(token)
+        return profile.finish(request, response)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        profile = _current_profile.get()
+        if profile is not None:
+            profile.view_started = time.perf_counter()
+
+
+# Request count, latency and query count per view for /metrics (socialapp/metrics.py),
+# when settings.METRICS_ENABLED is on. Requests no URL matched are counted
+# under view="unmatched".
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'METRICS_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        _install_query_hook()
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        profile, token = _enter_profile()
+        metrics.REQUESTS_IN_PROGRESS.inc()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.REQUESTS_IN_PROGRESS.dec()
+            _exit_profile(token)
+        self._observe(request, response, profile, started)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        profile, token = _enter_profile()
+        metrics.REQUESTS_IN_PROGRESS.inc()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.REQUESTS_IN_PROGRESS.dec()
+            _exit_profile(token)
+        self._observe(request, response, profile, started)
+        return response
+
+    @staticmethod
+    def _observe(request, response, profile, started):
+        match = getattr(request, 'resolver_match', None)
+        view = match.url_name if match and match.url_name else 'unmatched'
+        metrics.REQUESTS.inc(view=view, method=request.method, status=response.status_code)
+        metrics.REQUEST_LATENCY.observe(time.perf_counter() - started, view=view)
+        metrics.REQUEST_QUERIES.observe(len(profile.queries), view=view)
+
+
+class RequestProfile:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.view_started = None
+        self.queries = []  # (sql, seconds)
+        self.template_seconds = 0.0
+        self.template_depth = 0
+
+    def finish(self, request, response):
+        finished = time.perf_counter()
+        total_ms = (finished - self.started) * 1000
+        view_ms = (finished - self.view_started) * 1000 if self.view_started else 0.0
+        sql_ms = sum(seconds for _, seconds in self.queries) * 1000
+        template_ms = self.template_seconds * 1000
+        repeated = [(sql, count) for sql, count in Counter(sql for sql, _ in self.queries).most_common()
+                    if count >= getattr(settings, 'PROFILING_REPEAT_THRESHOLD', 3)]
+
+        metrics = [
+            f'sql;dur={sql_ms:.1f};desc="{len(self.queries)} queries"',
+            f'tpl;dur={template_ms:.1f}',
+            f'view;dur={view_ms:.1f}',
+            f'app;dur={max(view_ms - sql_ms - template_ms, 0):.1f}',
+            f'total;dur={total_ms:.1f}',
+        ]
+        if repeated:
+            metrics.append(f'nplusone;desc="{len(repeated)} repeated statements"')
+        response['Server-Timing'] = ', '.join(metrics)
+
+        if total_ms >= getattr(settings, 'PROFILING_SLOW_MS', 500) or repeated:
+            slowest = sorted(self.queries, key=lambda query: query[1], reverse=True)[:getattr(settings, 'PROFILING_SLOWEST_QUERIES', 5)]
+            profiling_logger.warning(json.dumps({
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+                'total_ms': round(total_ms, 1),
+                'view_ms': round(view_ms, 1),
+                'sql_ms': round(sql_ms, 1),
+                'template_ms': round(template_ms, 1),
+                'queries': len(self.queries),
+                'slowest_queries': [{'sql': sql, 'ms': round(seconds * 1000, 2)} for sql, seconds in slowest],
+                'repeated_queries': [{'sql': sql, 'count': count} for sql, count in repeated],
+            }))
+        return response
+
+
+profiling_logger = logging.getLogger('socialapp.profiling')
+_current_profile = ContextVar('request_profile', default=None)
+_query_hook_installed = False
+_template_hook_installed = False
+
+
+# The profile of the current request, started here unless an outer middleware did
+def _enter_profile():
+    profile = _current_profile.get()
+    if profile is not None:
+        return profile, None
+    profile = RequestProfile()
+    return profile, _current_profile.set(profile)
+
+
+def _exit_profile(token):
+    if token is not None:
+        _current_profile.reset(token)
+
+
+# Parameters are left out, so the same statement with other values counts as repeated
+def _record_query(execute, sql, params, many, context):
+    profile = _current_profile.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        profile.queries.append((sql, time.perf_counter() - started))
+
+
+# First in the list, as connection.execute_wrapper() pops the last one when it exits
+def _watch_connection(connection, **kwargs):
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _record_query)
+
+
+# Connections are per thread: the ones this thread already has open are wrapped
+# now, every other one when it connects
+def _install_query_hook():
+    global _query_hook_installed
+    if _query_hook_installed:
+        return
+    _query_hook_installed = True
+    connection_created.connect(_watch_connection, dispatch_uid='socialapp.middleware.record_query')
+    for connection in connections.all(initialized_only=True):
+        _watch_connection(connection)
+
+
+def _install_template_hook():
+    global _template_hook_installed
+    if _template_hook_installed:
+        return
+    _template_hook_installed = True
+    render = Template._render
+
+    # Only the outermost template is timed, {% include %}d ones render inside it
+    @wraps(render)
+    def timed_render(self, context):
+        profile = _current_profile.get()
+        if profile is None:
+            return render(self, context)
+        profile.template_depth += 1
+        started = time.perf_counter()
+        try:
+            return render(self, context)
+        finally:
+            profile.template_depth -= 1
+            if not profile.template_depth:
+                profile.template_seconds += time.perf_counter() - started
+
+    Template._render = timed_render
@@ -0,0 +1,59 @@
+# Generated by Django 5.1.4 on 2026-10-18 17:53
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def _count(model, column, outer='pk'):
+    counted = (model._base_manager.filter(**{column: OuterRef(outer)}).order_by()
+               .values(column).annotate(total=Count('pk')).values('total'))
+    return Coalesce(Subquery(counted, output_field=IntegerField()), Value(0))
+
+
+def populate_counters(apps, schema_editor):
+    Post = apps.get_model('socialapp', 'Post')
+    Profile = apps.get_model('socialapp', 'Profile')
+    LikePost = apps.get_model('socialapp', 'LikePost')
+    Comment = apps.get_model('socialapp', 'Comment')
+    Follow = apps.get_model('socialapp', 'Follow')
+    Post._base_manager.update(likes_count=_count(LikePost, 'post'), comments_count=_count(Comment, 'post'))
+    Profile._base_manager.update(followers_count=_count(Follow, 'followed', 'user_id'),
+                                 following_count=_count(Follow, 'follower', 'user_id'),
+                                 posts_count=_count(Post, 'user', 'user_id'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('socialapp', '0002_feedentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='comments_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='likes_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='followers_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='following_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='posts_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+from django.db import migrations
+from socialapp import search
+
+
+def install_search_index(apps, schema_editor):
+    Post = apps.get_model('socialapp', 'Post')
+    backend = search.get_backend(schema_editor.connection)
+    with schema_editor.connection.cursor() as cursor:
+        backend.install(cursor)
+        for post_id, caption, username in Post._base_manager.values_list('id', 'caption', 'user__username').iterator():
+            backend.index(cursor, post_id, caption, username)
+
+
+def uninstall_search_index(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        search.get_backend(schema_editor.connection).uninstall(cursor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('socialapp', '0003_engagement_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(install_search_index, uninstall_search_index),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.1.4 on 2026-10-18 17:58
+
+import django.db.models.deletion
+import re
+from django.db import migrations, models
+
+
+def index_existing_hashtags(apps, schema_editor):
+    Post = apps.get_model('socialapp', 'Post')
+    Hashtag = apps.get_model('socialapp', 'Hashtag')
+    PostHashtag = apps.get_model('socialapp', 'PostHashtag')
+    for post in Post._base_manager.only('id', 'caption', 'created_at').iterator():
+        names = {tag[1:].lower()[:100] for tag in re.findall(r"#\w+", post.caption)}
+        if not names:
+            continue
+        Hashtag.objects.bulk_create([Hashtag(name=name) for name in names], ignore_conflicts=True)
+        PostHashtag.objects.bulk_create([PostHashtag(post_id=post.id, hashtag=hashtag, created_at=post.created_at)
+                                         for hashtag in Hashtag.objects.filter(name__in=names)], ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('socialapp', '0004_post_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Hashtag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='HashtagBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket_start', models.DateTimeField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('hashtag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='buckets', to='socialapp.hashtag')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['bucket_start'], name='hashtagbucket_start_idx')],
+                'unique_together': {('hashtag', 'bucket_start')},
+            },
+        ),
+        migrations.CreateModel(
+            name='PostHashtag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField()),
+                ('hashtag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='post_links', to='socialapp.hashtag')),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='post_hashtags', to='socialapp.post')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['hashtag', '-created_at', '-post'], name='posthashtag_timeline_idx')],
+                'unique_together': {('hashtag', 'post')},
+            },
+        ),
+        migrations.RunPython(index_existing_hashtags, migrations.RunPython.noop),
+    ]
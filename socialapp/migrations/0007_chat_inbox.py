@@ -0,0 +1,65 @@
+# Generated by Django 5.1.4 on 2026-10-18 18:04
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def populate_chat_inbox(apps, schema_editor):
+    Chat = apps.get_model('socialapp', 'Chat')
+    Message = apps.get_model('socialapp', 'Message')
+    ChatReadMarker = apps.get_model('socialapp', 'ChatReadMarker')
+    for chat in Chat.objects.prefetch_related('participants').iterator(chunk_size=500):
+        last_message = Message.objects.filter(chat_id=chat.id).order_by('-timestamp', '-id').first()
+        if last_message:
+            chat.last_message = last_message
+            chat.last_message_at = last_message.timestamp
+            chat.save(update_fields=['last_message', 'last_message_at'])
+        member_ids = {user.id for user in chat.participants.all()}
+        markers = []
+        for user_id in member_ids:
+            others = member_ids - {user_id}
+            # No read state existed before, so existing conversations start out read
+            markers.append(ChatReadMarker(chat_id=chat.id, user_id=user_id,
+                                          counterpart_id=others.pop() if len(others) == 1 else None,
+                                          last_read_at=chat.last_message_at,
+                                          last_activity_at=chat.last_message_at or chat.created_at))
+        ChatReadMarker.objects.bulk_create(markers, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('socialapp', '0006_message_timeline_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chat',
+            name='last_message',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='socialapp.message'),
+        ),
+        migrations.AddField(
+            model_name='chat',
+            name='last_message_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='ChatReadMarker',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_read_at', models.DateTimeField(blank=True, null=True)),
+                ('unread_count', models.PositiveIntegerField(default=0)),
+                ('last_activity_at', models.DateTimeField()),
+                ('chat', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='read_markers', to='socialapp.chat')),
+                ('counterpart', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chat_read_markers', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', '-last_activity_at', '-id'], name='chat_marker_inbox_idx')],
+                'unique_together': {('chat', 'user')},
+            },
+        ),
+        migrations.RunPython(populate_chat_inbox, migrations.RunPython.noop),
+    ]
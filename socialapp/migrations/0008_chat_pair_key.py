@@ -0,0 +1,58 @@
+# Generated by Django 5.1.4 on 2026-10-18 18:05
+
+from collections import defaultdict
+from django.db import migrations, models
+
+
+# Give every one-to-one chat its pair key, folding duplicate chats of the same
+# pair into the oldest one first: messages move over, read markers are merged.
+def merge_direct_chats(apps, schema_editor):
+    Chat = apps.get_model('socialapp', 'Chat')
+    Message = apps.get_model('socialapp', 'Message')
+    ChatReadMarker = apps.get_model('socialapp', 'ChatReadMarker')
+
+    pairs = defaultdict(list)
+    for chat in Chat.objects.prefetch_related('participants').order_by('id').iterator(chunk_size=500):
+        member_ids = sorted(user.id for user in chat.participants.all())
+        if len(member_ids) == 2:
+            pairs[f'{member_ids[0]}:{member_ids[1]}'].append(chat.id)
+        elif len(member_ids) == 1:
+            pairs[f'{member_ids[0]}:{member_ids[0]}'].append(chat.id)
+
+    for pair_key, chat_ids in pairs.items():
+        keep_id, duplicate_ids = chat_ids[0], chat_ids[1:]
+        if duplicate_ids:
+            Message.objects.filter(chat_id__in=duplicate_ids).update(chat_id=keep_id)
+            merged = {}
+            for marker in ChatReadMarker.objects.filter(chat_id__in=chat_ids):
+                current = merged.setdefault(marker.user_id, {'unread_count': 0, 'last_read_at': None})
+                current['unread_count'] += marker.unread_count
+                if marker.last_read_at and (current['last_read_at'] is None or marker.last_read_at > current['last_read_at']):
+                    current['last_read_at'] = marker.last_read_at
+            Chat.objects.filter(id__in=duplicate_ids).delete()
+
+            keep = Chat.objects.get(id=keep_id)
+            last_message = Message.objects.filter(chat_id=keep_id).order_by('-timestamp', '-id').first()
+            keep.last_message = last_message
+            keep.last_message_at = last_message.timestamp if last_message else None
+            keep.save(update_fields=['last_message', 'last_message_at'])
+            for user_id, state in merged.items():
+                ChatReadMarker.objects.filter(chat_id=keep_id, user_id=user_id).update(
+                    last_activity_at=keep.last_message_at or keep.created_at, **state)
+        Chat.objects.filter(id=keep_id).update(pair_key=pair_key)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('socialapp', '0007_chat_inbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chat',
+            name='pair_key',
+            field=models.CharField(blank=True, max_length=41, null=True, unique=True),
+        ),
+        migrations.RunPython(merge_direct_chats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.4 on 2026-10-18 18:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('socialapp', '0008_chat_pair_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='image_renditions',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='profile_pic_renditions',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.1.4 on 2026-10-18 18:14
+
+import socialapp.media
+import socialapp.models
+from collections import Counter
+from django.db import migrations, models
+
+
+def count_media_references(apps, schema_editor):
+    Post = apps.get_model('socialapp', 'Post')
+    Profile = apps.get_model('socialapp', 'Profile')
+    MediaBlob = apps.get_model('socialapp', 'MediaBlob')
+    # Files stored before content addressing keep their names and get counted like the rest
+    references = Counter()
+    for model, fields in ((Post, ('image', 'video')), (Profile, ('profile_pic',))):
+        for field in fields:
+            references.update(model.objects.exclude(**{field: ''}).exclude(**{f'{field}__isnull': True})
+                              .values_list(field, flat=True).iterator(chunk_size=2000))
+    MediaBlob.objects.bulk_create([MediaBlob(name=name, refcount=count) for name, count in references.items()],
+                                  batch_size=1000, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('socialapp', '0010_upload_session'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('refcount', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='image',
+            field=models.ImageField(blank=True, null=True, storage=socialapp.media.get_media_storage, upload_to=socialapp.models.post_media_path),
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='video',
+            field=models.FileField(blank=True, null=True, storage=socialapp.media.get_media_storage, upload_to=socialapp.models.post_media_path),
+        ),
+        migrations.AlterField(
+            model_name='profile',
+            name='profile_pic',
+            field=models.ImageField(blank=True, null=True, storage=socialapp.media.get_media_storage, upload_to=socialapp.models.profile_pic_path),
+        ),
+        migrations.RunPython(count_media_references, migrations.RunPython.noop),
+    ]
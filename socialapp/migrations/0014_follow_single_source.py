@@ -0,0 +1,58 @@
+# Generated by Django 5.1.4 on 2026-10-18 18:29
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+# Profile.followers holds the profiles following this one, Profile.following
+# the ones it follows; both become Follow rows and the counters are recounted
+def copy_profile_follows(apps, schema_editor):
+    Profile = apps.get_model('socialapp', 'Profile')
+    Follow = apps.get_model('socialapp', 'Follow')
+    pairs = set()
+    for field, reverse in (('followers', True), ('following', False)):
+        through = Profile._meta.get_field(field).remote_field.through
+        for source, target in through.objects.values_list('from_profile__user_id', 'to_profile__user_id').iterator(chunk_size=2000):
+            pairs.add((target, source) if reverse else (source, target))
+    pairs = [(follower, followed) for follower, followed in pairs if follower != followed]
+    if not pairs:
+        return
+    Follow.objects.bulk_create([Follow(follower_id=follower, followed_id=followed) for follower, followed in pairs],
+                               batch_size=1000, ignore_conflicts=True)
+
+    def count(column):
+        counted = (Follow.objects.filter(**{column: OuterRef('user_id')}).order_by()
+                   .values(column).annotate(total=Count('pk')).values('total'))
+        return Coalesce(Subquery(counted, output_field=IntegerField()), Value(0))
+
+    Profile.objects.update(followers_count=count('followed'), following_count=count('follower'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('socialapp', '0013_follow_suggestions'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(copy_profile_follows, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='profile',
+            name='followers',
+        ),
+        migrations.RemoveField(
+            model_name='profile',
+            name='following',
+        ),
+        migrations.AddIndex(
+            model_name='follow',
+            index=models.Index(fields=['follower', '-created_at', '-id', 'followed'], name='follow_following_list_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='follow',
+            index=models.Index(fields=['followed', '-created_at', '-id', 'follower'], name='follow_followers_list_idx'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.1.4 on 2026-10-18 18:46
+
+from django.conf import settings
+from django.db import migrations, models
+
+PATH_SEGMENT_LENGTH = 12
+
+
+# Replies are always newer than what they reply to, so in id order every
+# parent's path is known before its replies come up
+def fill_comment_paths(apps, schema_editor):
+    Comment = apps.get_model('socialapp', 'Comment')
+    paths, batch = {}, []
+    for comment in Comment.objects.only('id', 'parent_id').order_by('id').iterator(chunk_size=2000):
+        comment.path = paths.get(comment.parent_id, '') + f'{comment.id:0{PATH_SEGMENT_LENGTH}d}'
+        paths[comment.id] = comment.path
+        batch.append(comment)
+        if len(batch) >= 1000:
+            Comment.objects.bulk_update(batch, ['path'])
+            batch = []
+    Comment.objects.bulk_update(batch, ['path'])
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('socialapp', '0015_hot_path_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='comment',
+            name='comment_post_thread_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='comment',
+            name='comment_replies_idx',
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='path',
+            field=models.CharField(blank=True, editable=False, max_length=120),
+        ),
+        migrations.RunPython(fill_comment_paths, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'path'], name='comment_post_path_idx'),
+        ),
+    ]
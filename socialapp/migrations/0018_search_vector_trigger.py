@@ -0,0 +1,25 @@
+from django.db import migrations
+from socialapp import search
+
+
+# Installs the trigger that fills in search_vector as posts are written (on
+# PostgreSQL, the other backends already have what they need) and refreshes
+# every post, whose vectors may hold usernames that have changed since
+def install_search_trigger(apps, schema_editor):
+    Post = apps.get_model('socialapp', 'Post')
+    backend = search.get_backend(schema_editor.connection)
+    with schema_editor.connection.cursor() as cursor:
+        backend.install(cursor)
+        for post_id, caption, username in Post._base_manager.values_list('id', 'caption', 'user__username').iterator():
+            backend.index(cursor, post_id, caption, username)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('socialapp', '0017_ranked_feed'),
+    ]
+
+    operations = [
+        migrations.RunPython(install_search_trigger, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.4 on 2026-10-18 19:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('socialapp', '0018_search_vector_trigger'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='followchange',
+            name='followed_id',
+            field=models.BigIntegerField(),
+        ),
+        migrations.AlterField(
+            model_name='followchange',
+            name='follower_id',
+            field=models.BigIntegerField(),
+        ),
+    ]
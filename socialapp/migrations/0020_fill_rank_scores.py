@@ -0,0 +1,34 @@
+from django.db import migrations
+from django.db.models import Case, Exists, F, FloatField, OuterRef, Value, When
+from django.db.models.functions import Log
+from socialapp.feed import MUTUAL_AFFINITY, rank_score
+
+
+# 0017 added affinity and rank_score with constant defaults, so every entry made
+# before it ranked as a new post of nobody; rerank_feeds only reaches the last
+# FEED_RANK_HORIZON. Scores are computed once here for every retained entry.
+def fill_rank_scores(apps, schema_editor):
+    Post = apps.get_model('socialapp', 'Post')
+    FeedEntry = apps.get_model('socialapp', 'FeedEntry')
+    Follow = apps.get_model('socialapp', 'Follow')
+    mutual = Exists(Follow.objects.filter(follower_id=OuterRef('author_id'), followed_id=OuterRef('owner_id')))
+    posts = (Post.objects.filter(id__in=FeedEntry.objects.values('post_id'))
+             .only('id', 'created_at', 'likes_count', 'comments_count').order_by('id'))
+    batch = list(posts[:500])
+    while batch:
+        entries = FeedEntry.objects.filter(post_id__in=[post.id for post in batch])
+        entries.update(affinity=Case(When(mutual, then=Value(MUTUAL_AFFINITY)), default=Value(1.0)))
+        entries.update(rank_score=Log(2.0, F('affinity')) + Case(*[When(post_id=post.id, then=Value(rank_score(post))) for post in batch],
+                                                                 output_field=FloatField()))
+        batch = list(posts.filter(id__gt=batch[-1].id)[:500])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('socialapp', '0019_follow_change_big_ids'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_rank_scores, migrations.RunPython.noop),
+    ]
@@ -1,19 +1,24 @@
 from django.contrib.auth.models import User
 from django.db import models
 from django.contrib.auth import get_user_model
-from django.db.models.signals import post_save
+from django.db.models.signals import m2m_changed, post_init, post_save, post_delete, pre_delete
 from django.dispatch import receiver
 from django.utils import timezone
+import re
+import uuid
+from .media import get_media_storage, release_references, snapshot, sync_references
 
 User = get_user_model()
 
+HASHTAG_RE = re.compile(r"#\w+")
+
 # Utility methods
+# Media is stored content-addressed below these prefixes, see socialapp/media.py
 def profile_pic_path(instance, filename):
-    return f'profile_pics/user_{instance.user.id}/{filename}'
+    return f'profile_pics/{filename}'
 
 def post_media_path(instance, filename):
-    post_count = instance.user.posts.count() + 1
-    return f'posts/user_{instance.user.id}/post_{post_count}/{filename}'
+    return f'posts/{filename}'
 
 
 # Adding manager for custom queries
@@ -35,11 +40,13 @@ class CommentManager(models.Manager):
 # Profile model
 class Profile(models.Model):
     user = models.OneToOneField(User, related_name='profile', on_delete=models.CASCADE)
-    profile_pic = models.ImageField(blank=True, null=True, upload_to=profile_pic_path)
+    profile_pic = models.ImageField(blank=True, null=True, upload_to=profile_pic_path, storage=get_media_storage)
+    profile_pic_renditions = models.JSONField(default=dict, blank=True, editable=False)
     bio = models.TextField(max_length=500,blank=True)
     location = models.CharField(max_length=100, blank=True)
-    followers=models.ManyToManyField('self',symmetrical=False,related_name='followed_by',blank=True)
-    following=models.ManyToManyField('self',symmetrical=False,related_name='follows_to',blank=True)
+    followers_count = models.PositiveIntegerField(default=0)
+    following_count = models.PositiveIntegerField(default=0)
+    posts_count = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     objects = ProfileManager()
@@ -51,10 +58,10 @@ class Profile(models.Model):
         return Follow.objects.filter(follower=self.user).select_related('followed')
     
     def get_followers_count(self):
-        return self.followers.count()
+        return self.followers_count
 
     def get_following_count(self):
-        return self.following.count()
+        return self.following_count
     
     def __str__(self):
         return f'{self.user.username}'
@@ -63,22 +70,36 @@ class Profile(models.Model):
 # Post model
 class Post(models.Model):
     user = models.ForeignKey(User, related_name="posts", on_delete=models.CASCADE)
-    image = models.ImageField(blank=True, null=True, upload_to=post_media_path)
-    video = models.FileField(blank=True, null=True, upload_to=post_media_path)
+    image = models.ImageField(blank=True, null=True, upload_to=post_media_path, storage=get_media_storage)
+    image_renditions = models.JSONField(default=dict, blank=True, editable=False)
+    video = models.FileField(blank=True, null=True, upload_to=post_media_path, storage=get_media_storage)
     caption = models.TextField(max_length=300,blank=True)
+    likes_count = models.PositiveIntegerField(default=0)
+    comments_count = models.PositiveIntegerField(default=0)
+    # Bumped by every change a rendered card shows, keys the card cache (see cards.py)
+    card_version = models.PositiveIntegerField(default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     objects = PostManager() 
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-id'], name='post_user_timeline_idx'),
+            # Recent posts, for warm_post_cards and rerank_feeds
+            models.Index(fields=['-created_at', '-id'], name='post_recent_idx'),
+        ]
     
     def __str__(self):
         return f'{self.user.username} - {self.caption[:20]}'
 
     def total_likes(self):
-        return self.likes.count()
+        return self.likes_count
 
     def extract_hashtags(self):
-        import re
-        return re.findall(r"#\w+", self.caption)
+        return HASHTAG_RE.findall(self.caption)
+
+    def hashtag_names(self):
+        return {tag[1:].lower()[:Hashtag.MAX_LENGTH] for tag in self.extract_hashtags()}
     
 # LikePost model
 class LikePost(models.Model):
@@ -89,23 +110,47 @@ class LikePost(models.Model):
     
     class Meta:
         unique_together = ('post', 'user')
+        # "Which of these posts has the viewer liked", answered from the index alone
+        indexes = [
+            models.Index(fields=['user', 'post'], name='likepost_user_post_idx'),
+        ]
     
     def __str__(self):
         return f'{self.user.username} likes {self.post.id}'
 
-# Comment model
+# Comment model. `path` is the materialized path of the comment in its post's
+# thread: the zero-padded ids of its ancestors and itself, so ordering a post's
+# comments by path lists every thread depth-first and a subtree is one range.
 class Comment(models.Model):
+    PATH_SEGMENT_LENGTH = 12
+    MAX_DEPTH = 10
+
     post = models.ForeignKey(Post, on_delete=models.CASCADE,related_name='comments')
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     text = models.TextField(max_length=300)
     parent = models.ForeignKey('self', null=True, blank=True, related_name='replies', on_delete=models.CASCADE)
+    path = models.CharField(max_length=PATH_SEGMENT_LENGTH * MAX_DEPTH, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     objects = CommentManager()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['post', 'path'], name='comment_post_path_idx'),
+        ]
+
+    @classmethod
+    def path_for(cls, comment_id, parent_path=''):
+        return f'{parent_path}{comment_id:0{cls.PATH_SEGMENT_LENGTH}d}'
+
+    # 0 for a comment on the post, 1 for a reply to it, ...
+    @property
+    def depth(self):
+        return len(self.path) // self.PATH_SEGMENT_LENGTH - 1
+
     def __str__(self):
         return f'Comment by {self.user.username} on {self.post.id}'
 
-# Follow model
+# Follow model (the only record of who follows whom, Profile keeps just the counts)
 class Follow(models.Model):
     follower = models.ForeignKey(User, on_delete=models.CASCADE, related_name='following')
     followed = models.ForeignKey(User, on_delete=models.CASCADE, related_name='followers')
@@ -113,26 +158,175 @@ class Follow(models.Model):
     
     class Meta:
         unique_together = ('follower', 'followed')
+        # Newest-first follower/following list pages, with the other side in the key so they are index-only reads
+        indexes = [
+            models.Index(fields=['follower', '-created_at', '-id', 'followed'], name='follow_following_list_idx'),
+            models.Index(fields=['followed', '-created_at', '-id', 'follower'], name='follow_followers_list_idx'),
+        ]
     
     def __str__(self):
         return f'{self.follower.username} follows {self.followed.username}'
+
+# Hashtag model
+class Hashtag(models.Model):
+    MAX_LENGTH = 100
+    name = models.CharField(max_length=MAX_LENGTH, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'#{self.name}'
+
+# PostHashtag model (hashtag index, ordered like the feed so a tag page is one range read)
+class PostHashtag(models.Model):
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='post_hashtags')
+    hashtag = models.ForeignKey(Hashtag, on_delete=models.CASCADE, related_name='post_links')
+    created_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('hashtag', 'post')
+        indexes = [
+            models.Index(fields=['hashtag', '-created_at', '-post'], name='posthashtag_timeline_idx'),
+        ]
+
+    def __str__(self):
+        return f'Post {self.post_id} tagged #{self.hashtag_id}'
+
+# HashtagBucket model (hourly usage counts behind trending hashtags)
+class HashtagBucket(models.Model):
+    hashtag = models.ForeignKey(Hashtag, on_delete=models.CASCADE, related_name='buckets')
+    bucket_start = models.DateTimeField()
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('hashtag', 'bucket_start')
+        indexes = [
+            models.Index(fields=['bucket_start'], name='hashtagbucket_start_idx'),
+        ]
+
+    def __str__(self):
+        return f'#{self.hashtag_id} x{self.count} at {self.bucket_start}'
+
+# FeedEntry model (materialized home timeline, one row per post per reader)
+class FeedEntry(models.Model):
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='feed_entries')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='feed_entries')
+    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    created_at = models.DateTimeField()
+    # The ranked timeline's order and the owner's affinity for the author, see feed.py
+    affinity = models.FloatField(default=1.0)
+    rank_score = models.FloatField(default=0.0)
+
+    class Meta:
+        unique_together = ('owner', 'post')
+        indexes = [
+            models.Index(fields=['owner', '-created_at', '-post'], name='feed_owner_timeline_idx'),
+            models.Index(fields=['owner', '-rank_score', '-post'], name='feed_owner_rank_idx'),
+            models.Index(fields=['owner', 'author'], name='feed_owner_author_idx'),
+        ]
+
+    def __str__(self):
+        return f'Post {self.post_id} in feed of user {self.owner_id}'
     
 class Chat(models.Model):
     participants = models.ManyToManyField(User, related_name='chats')
     created_at = models.DateTimeField(auto_now_add=True)
+    # "<lower user id>:<higher user id>" for one-to-one chats, NULL for group chats
+    pair_key = models.CharField(max_length=41, unique=True, null=True, blank=True)
+    # Denormalized for the inbox, maintained by chats.record_message()
+    last_message = models.ForeignKey('Message', null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+    last_message_at = models.DateTimeField(null=True, blank=True)
+
+    @staticmethod
+    def pair_key_for(user_id, other_id):
+        return ':'.join(str(pk) for pk in sorted((user_id, other_id)))
 
     def __str__(self):
         return f"Chat between {', '.join([user.username for user in self.participants.all()])}"
 
+# Inbox row of one participant: read state of the chat and who it is with
+class ChatReadMarker(models.Model):
+    chat = models.ForeignKey(Chat, on_delete=models.CASCADE, related_name='read_markers')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='chat_read_markers')
+    counterpart = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+    last_read_at = models.DateTimeField(null=True, blank=True)
+    unread_count = models.PositiveIntegerField(default=0)
+    last_activity_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('chat', 'user')
+        indexes = [
+            models.Index(fields=['user', '-last_activity_at', '-id'], name='chat_marker_inbox_idx'),
+        ]
+
+    def __str__(self):
+        return f'Chat {self.chat_id} read marker of user {self.user_id}'
+
 class Message(models.Model):
     chat = models.ForeignKey(Chat, related_name='messages', on_delete=models.CASCADE)
     sender = models.ForeignKey(User, on_delete=models.CASCADE)
     content = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['chat', 'timestamp', 'id'], name='message_chat_timeline_idx'),
+        ]
+
     def __str__(self):
         return f"Message from {self.sender.username} at {self.timestamp}"
 
+# Resumable upload in progress, see socialapp/uploads.py
+class UploadSession(models.Model):
+    KIND_CHOICES = [('image', 'Image'), ('video', 'Video')]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='upload_sessions')
+    kind = models.CharField(max_length=5, choices=KIND_CHOICES)
+    filename = models.CharField(max_length=100)
+    content_type = models.CharField(max_length=100)
+    size = models.PositiveBigIntegerField()
+    received = models.PositiveBigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'Upload {self.id} by user {self.user_id} ({self.received}/{self.size} bytes)'
+
+# Reference count of a stored media file, shared by every row that points at it
+class MediaBlob(models.Model):
+    name = models.CharField(max_length=255, unique=True)
+    refcount = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.name} ({self.refcount} references)'
+
+# "People you may know" row, computed in batch from the follow graph (see socialapp/graph.py)
+class FollowSuggestion(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='follow_suggestions')
+    suggested = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    # How many of the people `user` follows also follow `suggested`
+    mutual_count = models.PositiveIntegerField(default=0)
+    follows_you = models.BooleanField(default=False)
+    score = models.FloatField(default=0)
+
+    class Meta:
+        unique_together = ('user', 'suggested')
+        indexes = [models.Index(fields=['user', '-score'], name='suggestion_user_rank_idx')]
+
+    def __str__(self):
+        return f'Suggest user {self.suggested_id} to user {self.user_id} ({self.mutual_count} mutual)'
+
+# Follow/unfollow log written by toggle_follow, replayed into the follow graph
+class FollowChange(models.Model):
+    follower_id = models.BigIntegerField()
+    followed_id = models.BigIntegerField()
+    following = models.BooleanField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'User {self.follower_id} {"followed" if self.following else "unfollowed"} user {self.followed_id}'
+
 # Signal receivers to create and save user profile
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
@@ -142,3 +336,113 @@ def create_user_profile(sender, instance, created, **kwargs):
 @receiver(post_save, sender=User)
 def save_user_profile(sender, instance, **kwargs):
     instance.profile.save()
+
+# The path needs the id, so it is filled in right after the insert
+@receiver(post_save, sender=Comment)
+def set_comment_path(sender, instance, created, **kwargs):
+    if created and not instance.path:
+        instance.path = Comment.path_for(instance.pk, instance.parent.path if instance.parent_id else '')
+        Comment.objects.filter(pk=instance.pk).update(path=instance.path)
+
+# Signal receivers to queue resized renditions of new uploads
+@receiver(post_save, sender=Post)
+def queue_post_image_renditions(sender, instance, **kwargs):
+    from .renditions import schedule_renditions
+    schedule_renditions(instance, 'post')
+
+@receiver(post_save, sender=Profile)
+def queue_profile_pic_renditions(sender, instance, **kwargs):
+    from .renditions import schedule_renditions
+    schedule_renditions(instance, 'profile')
+
+# Signal receivers to reference count content-addressed media
+POST_MEDIA_FIELDS = ('image', 'video')
+PROFILE_MEDIA_FIELDS = ('profile_pic',)
+
+@receiver(post_init, sender=Post)
+def remember_post_media(sender, instance, **kwargs):
+    snapshot(instance, POST_MEDIA_FIELDS)
+
+@receiver(post_init, sender=Profile)
+def remember_profile_media(sender, instance, **kwargs):
+    snapshot(instance, PROFILE_MEDIA_FIELDS)
+
+@receiver(post_save, sender=Post)
+@receiver(post_save, sender=Profile)
+def sync_media_references(sender, instance, **kwargs):
+    sync_references(instance)
+
+@receiver(post_delete, sender=Post)
+def release_post_media(sender, instance, **kwargs):
+    from .renditions import discard_renditions
+    release_references(instance, POST_MEDIA_FIELDS)
+    discard_renditions(instance.__dict__.get('image_renditions'))
+
+@receiver(post_delete, sender=Profile)
+def release_profile_media(sender, instance, **kwargs):
+    from .renditions import discard_renditions
+    release_references(instance, PROFILE_MEDIA_FIELDS)
+    discard_renditions(instance.__dict__.get('profile_pic_renditions'))
+
+# Signal receivers to keep the full-text search index in step with posts
+@receiver(post_save, sender=Post)
+def index_post_for_search(sender, instance, **kwargs):
+    from .search import index_post
+    index_post(instance)
+
+@receiver(post_delete, sender=Post)
+def remove_post_from_search(sender, instance, **kwargs):
+    from .search import remove_post
+    remove_post(instance.pk)
+
+# A username is indexed with every post of its user and shown on its cached
+# cards, which a rename moves to a new card_version
+@receiver(post_init, sender=User)
+def remember_indexed_username(sender, instance, **kwargs):
+    instance._indexed_username = instance.__dict__.get('username')
+
+@receiver(post_save, sender=User)
+def reindex_renamed_author(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_indexed_username', None)
+    if not created and previous is not None and previous != instance.username:
+        from .search import reindex_author
+        reindex_author(instance)
+        Post._base_manager.filter(user=instance).update(card_version=models.F('card_version') + 1)
+    instance._indexed_username = instance.username
+
+# Signal receiver to drop the cached cards of a deleted post
+@receiver(post_delete, sender=Post)
+def evict_post_cards(sender, instance, **kwargs):
+    from .cards import evict_cards
+    evict_cards(instance)
+
+# Signal receivers to keep the hashtag index in step with captions
+@receiver(post_save, sender=Post)
+def index_post_hashtags(sender, instance, **kwargs):
+    from .hashtags import sync_post_hashtags
+    sync_post_hashtags(instance)
+
+@receiver(pre_delete, sender=Post)
+def release_post_hashtags(sender, instance, **kwargs):
+    from .hashtags import release_post_hashtags
+    release_post_hashtags(instance)
+
+# Signal receivers to keep the chat inbox read model in step with chats
+@receiver(m2m_changed, sender=Chat.participants.through)
+def sync_chat_read_markers(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    from .chats import sync_read_markers
+    if not reverse:
+        sync_read_markers(instance.pk)
+    elif action == 'post_clear':
+        ChatReadMarker.objects.filter(user=instance).delete()
+    else:
+        for chat_id in pk_set:
+            sync_read_markers(chat_id)
+
+@receiver(post_save, sender=Message)
+def record_chat_message(sender, instance, created, **kwargs):
+    if created:
+        from .chats import record_message
+        record_message(instance)
@@ -0,0 +1,65 @@
+import base64
+import json
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+# Keyset (cursor) pagination. Pages are always ordered newest-first on a
+# tuple of keys such as (created_at, id); the cursor carries the key values
+# of the last row served, so the next page is an indexed range read instead
+# of an OFFSET scan and rows inserted mid-scroll never shift later pages.
+
+DEFAULT_KEYS = ('created_at', 'id')
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(values):
+    payload = json.dumps([value.isoformat() if hasattr(value, 'isoformat') else value for value in values])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+# Raw JSON values of a cursor, for keys that are not model fields (e.g. a search rank)
+def decode_raw_cursor(cursor, length):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        raw = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except ValueError as exc:
+        raise InvalidCursor(cursor) from exc
+    if not isinstance(raw, list) or len(raw) != length:
+        raise InvalidCursor(cursor)
+    return raw
+
+
+def decode_cursor(cursor, model, keys=DEFAULT_KEYS):
+    raw = decode_raw_cursor(cursor, len(keys))
+    try:
+        return [model._meta.get_field(key).to_python(value) for key, value in zip(keys, raw)]
+    except (ValueError, TypeError, ValidationError) as exc:
+        raise InvalidCursor(cursor) from exc
+
+
+# Rows strictly "after" the cursor in descending key order (ascending with lookup='gt')
+def keyset_filter(keys, values, lookup='lt'):
+    condition = Q()
+    for index, key in enumerate(keys):
+        step = Q(**{f'{key}__{lookup}': values[index]})
+        for prior_key, prior_value in zip(keys[:index], values[:index]):
+            step &= Q(**{prior_key: prior_value})
+        condition |= step
+    return condition
+
+
+# Returns (items, next_cursor); next_cursor is None on the last page
+def keyset_page(queryset, cursor=None, page_size=20, keys=DEFAULT_KEYS):
+    queryset = queryset.order_by(*[f'-{key}' for key in keys])
+    if cursor:
+        queryset = queryset.filter(keyset_filter(keys, decode_cursor(cursor, queryset.model, keys)))
+
+    items = list(queryset[:page_size + 1])
+    next_cursor = None
+    if len(items) > page_size:
+        items = items[:page_size]
+        next_cursor = encode_cursor([getattr(items[-1], key) for key in keys])
+    return items, next_cursor
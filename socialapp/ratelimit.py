@@ -0,0 +1,227 @@
+import math
+import os
+import time
+from contextlib import contextmanager
+from functools import wraps
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib import messages
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.cache.backends.redis import RedisCache
+from django.core.files import locks
+from django.http import JsonResponse
+from django.shortcuts import render
+from . import metrics
+
+# Sliding-window rate limits kept in a shared cache.
+#
+# Each limit counts requests per identity (user, client IP or a value such as
+# the username being signed in to) in fixed windows and estimates the sliding
+# window from the current and previous one:
+#
+#   estimate = previous * (1 - elapsed / period) + current
+#
+# Counters live in the RATELIMIT_CACHE alias, which must be shared by every
+# worker process for the limits to hold. A request is counted first and then
+# judged on the count the increment returned, so concurrent requests each see
+# their own count and a burst cannot slip past the limit between a check and
+# its increment; a blocked request is taken back off. On Redis the increment
+# is an atomic INCR + EXPIRE. Every other cache falls back to add() + incr():
+# LockedFileBasedCache (the default) makes those atomic for every process of
+# a host with file locks; with LocMemCache they only hold within one process,
+# and FileBasedCache or DatabaseCache lose counts under concurrent requests.
+# A blocked request gets a 429 with Retry-After straight away; nothing sleeps.
+#
+# Rates look like '10/m', '5/5m' or '100/h' and can be overridden per scope in
+# settings.RATE_LIMITS.
+
+RATELIMIT_CACHE = getattr(settings, 'RATELIMIT_CACHE', 'ratelimit')
+UNITS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}
+
+DEFAULT_RATES = {
+    'sign_in': '20/m',  # per IP
+    'sign_in_failures': '5/5m',  # per username
+    'sign_up': '5/h',
+    'send_message': '30/m',
+    'add_comment': '10/m',
+    'like_post': '60/m',
+    'toggle_follow': '30/m',
+    'start_upload': '30/h',
+}
+
+
+def parse_rate(rate):
+    count, _, period = rate.partition('/')
+    multiplier = period[:-1] or '1'
+    return int(count), int(multiplier) * UNITS[period[-1]]
+
+
+def client_ip(request):
+    header = getattr(settings, 'RATELIMIT_IP_HEADER', None)
+    if header and request.META.get(header):
+        # e.g. HTTP_X_FORWARDED_FOR behind a proxy that sets it, the client is the first hop
+        return request.META[header].split(',')[0].strip()
+    return request.META.get('REMOTE_ADDR', '')
+
+
+# Identity functions for the `key` argument of rate_limit(), called with the
+# request and its user (resolved with auser() in async views)
+def by_ip(request, user=None):
+    return f'ip:{client_ip(request)}'
+
+
+def by_user(request, user):
+    if user.is_authenticated:
+        return f'user:{user.pk}'
+    return by_ip(request)
+
+
+class RateLimit:
+    def __init__(self, scope, rate=None):
+        self.scope = scope
+        self.rate = rate
+
+    def _window(self, identity):
+        limit, period = parse_rate(self.rate or getattr(settings, 'RATE_LIMITS', {}).get(self.scope, DEFAULT_RATES[self.scope]))
+        now = time.time()
+        window = int(now // period)
+        keys = [f'rl:{self.scope}:{identity}:{window}', f'rl:{self.scope}:{identity}:{window - 1}']
+        return limit, period, now - window * period, keys
+
+    # Seconds to wait before `identity` may make another request, 0 when allowed
+    def retry_after(self, identity):
+        limit, period, elapsed, keys = self._window(identity)
+        return self._wait(limit, period, elapsed, keys, caches[RATELIMIT_CACHE].get_many(keys))
+
+    async def aretry_after(self, identity):
+        limit, period, elapsed, keys = self._window(identity)
+        return self._wait(limit, period, elapsed, keys, await caches[RATELIMIT_CACHE].aget_many(keys))
+
+    def _wait(self, limit, period, elapsed, keys, counts):
+        wait = self._estimate_wait(limit, period, elapsed, keys, counts)
+        metrics.RATE_LIMIT_CACHE.inc(scope=self.scope, result='hit' if counts else 'miss')
+        metrics.RATE_LIMIT_CHECKS.inc(scope=self.scope, outcome='blocked' if wait else 'allowed')
+        return wait
+
+    @staticmethod
+    def _estimate_wait(limit, period, elapsed, keys, counts):
+        current, previous = counts.get(keys[0], 0), counts.get(keys[1], 0)
+        if previous * (1 - elapsed / period) + current < limit:
+            return 0
+        if current >= limit or not previous:
+            return max(1, math.ceil(period - elapsed))
+        # Until the previous window's weight has decayed enough
+        return max(1, math.ceil(period - (limit - current) * period / previous - elapsed))
+
+    def count(self, identity):
+        _, period, _, (current_key, _) = self._window(identity)
+        return _increment(caches[RATELIMIT_CACHE], current_key, 2 * period)
+
+    # Count one request unless the limit is reached, returns retry_after()
+    def hit(self, identity):
+        limit, period, elapsed, keys = self._window(identity)
+        cache = caches[RATELIMIT_CACHE]
+        current = _increment(cache, keys[0], 2 * period)
+        counts = {key: count for key, count in ((keys[0], current - 1), (keys[1], cache.get(keys[1], 0))) if count}
+        wait = self._wait(limit, period, elapsed, keys, counts)
+        if wait:
+            _decrement(cache, keys[0])
+        return wait
+
+    async def ahit(self, identity):
+        return await sync_to_async(self.hit)(identity)
+
+
+# FileBasedCache whose add() and incr()/decr() hold an exclusive lock while
+# they read and write the entry, so every worker process of a host counts
+# each request. Keys share LOCK_STRIPES lock files in the cache directory.
+class LockedFileBasedCache(FileBasedCache):
+    LOCK_STRIPES = 64
+
+    @contextmanager
+    def _locked(self, key, version):
+        stripe = int(os.path.basename(self._key_to_file(key, version))[:8], 16) % self.LOCK_STRIPES
+        self._createdir()
+        with open(os.path.join(self._dir, f'lock-{stripe}'), 'a') as lock:
+            locks.lock(lock, locks.LOCK_EX)
+            try:
+                yield
+            finally:
+                locks.unlock(lock)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        with self._locked(key, version):
+            return super().add(key, value, timeout, version)
+
+    def incr(self, key, delta=1, version=None):
+        with self._locked(key, version):
+            return super().incr(key, delta, version)
+
+
+# Add one to a counter and return the new value, creating it with `timeout`
+def _increment(cache, key, timeout):
+    if isinstance(cache, RedisCache):
+        key = cache.make_and_validate_key(key)
+        with cache._cache.get_client(key, write=True).pipeline() as pipeline:  # MULTI/EXEC
+            pipeline.incr(key)
+            pipeline.expire(key, timeout)
+            return pipeline.execute()[0]
+    cache.add(key, 0, timeout=timeout)
+    try:
+        return cache.incr(key)
+    except ValueError:  # expired between add() and incr()
+        cache.add(key, 1, timeout=timeout)
+        return 1
+
+
+def _decrement(cache, key):
+    try:
+        cache.decr(key)
+    except ValueError:
+        pass
+
+
+def retry_message(retry_after):
+    return f'Too many requests. Please try again in {retry_after} second{"s" if retry_after != 1 else ""}.'
+
+
+def too_many_requests(request, retry_after, template=None, context=None):
+    message = retry_message(retry_after)
+    if template:
+        messages.error(request, message)
+        response = render(request, template, context or {}, status=429)
+    else:
+        response = JsonResponse({'error': message, 'retry_after': retry_after}, status=429)
+    response['Retry-After'] = str(retry_after)
+    return response
+
+
+# Limit a view per identity, counting requests of the given methods (default
+# all). Page views pass the template (and a context function of the request)
+# to re-render with an error instead of a JSON body.
+#   @rate_limit('add_comment', key=by_user)
+def rate_limit(scope, key=by_user, rate=None, methods=None, template=None, context=None):
+    limit = RateLimit(scope, rate)
+
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                if methods is None or request.method in methods:
+                    wait = await limit.ahit(key(request, await request.auser()))
+                    if wait:
+                        return too_many_requests(request, wait, template, context(request) if context else None)
+                return await view(request, *args, **kwargs)
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if methods is None or request.method in methods:
+                wait = limit.hit(key(request, request.user))
+                if wait:
+                    return too_many_requests(request, wait, template, context(request) if context else None)
+            return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,218 @@
+import asyncio
+import json
+import re
+import threading
+from http.cookies import SimpleCookie
+from importlib import import_module
+from urllib.parse import urlparse
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+from .ratelimit import RateLimit, by_user, retry_message
+
+# Real-time chat over WebSockets, served by socialmedia/asgi.py next to the
+# Django HTTP application.
+#
+#   ws(s)://<host>/ws/chat/<chat_id>/
+#
+# The socket pushes every new Message of the chat as JSON and accepts
+# {"content": "..."} frames to send one. Messages reach connected sockets
+# through a broadcast layer: InProcessBroadcast (default) only reaches sockets
+# of the same process, RedisBroadcast fans out across processes and hosts.
+# Sending over the socket is rate limited like the send_message view, per user
+# and in the same counters.
+#
+# The handshake must come from a page of the same host: browsers always send
+# Origin for WebSockets, so one without it is refused unless its Host is in
+# CHAT_SOCKET_ORIGINLESS_HOSTS (for non-browser clients you trust).
+
+CHAT_SOCKET_PATH = re.compile(r'^/ws/chat/(?P<chat_id>\d+)/$')
+SUBSCRIBER_QUEUE_SIZE = getattr(settings, 'CHAT_SUBSCRIBER_QUEUE_SIZE', 100)
+CHAT_SOCKET_ORIGINLESS_HOSTS = getattr(settings, 'CHAT_SOCKET_ORIGINLESS_HOSTS', ())
+
+
+def chat_group(chat_id):
+    return f'chat.{chat_id}'
+
+
+class InProcessBroadcast:
+    # publish() is thread-safe so sync views running in worker threads can call it
+    def __init__(self, **options):
+        self._groups = {}
+        self._lock = threading.Lock()
+
+    def publish(self, group, message):
+        with self._lock:
+            subscribers = list(self._groups.get(group, ()))
+        for loop, queue in subscribers:
+            loop.call_soon_threadsafe(self._deliver, queue, message)
+
+    @staticmethod
+    def _deliver(queue, message):
+        if not queue.full():  # a stalled socket drops messages, it can resync over HTTP
+            queue.put_nowait(message)
+
+    async def subscribe(self, group):
+        subscriber = (asyncio.get_running_loop(), asyncio.Queue(SUBSCRIBER_QUEUE_SIZE))
+        with self._lock:
+            self._groups.setdefault(group, set()).add(subscriber)
+        return subscriber
+
+    async def receive(self, subscription):
+        return await subscription[1].get()
+
+    async def unsubscribe(self, group, subscription):
+        with self._lock:
+            subscribers = self._groups.get(group, set())
+            subscribers.discard(subscription)
+            if not subscribers:
+                self._groups.pop(group, None)
+
+
+class RedisBroadcast:
+    # Optional backend for multi-process deployments, needs the `redis` package
+    def __init__(self, url='redis://localhost:6379/0', prefix='socialapp', **options):
+        try:
+            import redis
+            import redis.asyncio
+        except ImportError as exc:
+            raise ImproperlyConfigured('RedisBroadcast requires the "redis" package.') from exc
+        self.url = url
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url)
+        self._async_client = redis.asyncio.Redis.from_url(url)
+
+    def publish(self, group, message):
+        self._client.publish(f'{self.prefix}:{group}', json.dumps(message))
+
+    async def subscribe(self, group):
+        pubsub = self._async_client.pubsub(ignore_subscribe_messages=True)
+        await pubsub.subscribe(f'{self.prefix}:{group}')
+        return pubsub
+
+    async def receive(self, subscription):
+        while True:
+            message = await subscription.get_message(timeout=None)
+            if message is not None:
+                return json.loads(message['data'])
+
+    async def unsubscribe(self, group, subscription):
+        await subscription.unsubscribe()
+        await subscription.aclose()
+
+
+_broadcast = None
+_broadcast_lock = threading.Lock()
+
+
+def get_broadcast():
+    global _broadcast
+    if _broadcast is None:
+        with _broadcast_lock:
+            if _broadcast is None:
+                config = getattr(settings, 'CHAT_BROADCAST', {})
+                backend = import_string(config.get('BACKEND', 'socialapp.realtime.InProcessBroadcast'))
+                _broadcast = backend(**config.get('OPTIONS', {}))
+    return _broadcast
+
+
+def _headers(scope):
+    return {name.decode('latin1').lower(): value.decode('latin1') for name, value in scope.get('headers', [])}
+
+
+# Resolve the signed-in user from the session cookie of the handshake
+def _authenticate(headers):
+    from django.contrib.auth import get_user
+
+    class HandshakeRequest:
+        pass
+
+    cookie = SimpleCookie()
+    cookie.load(headers.get('cookie', ''))
+    morsel = cookie.get(settings.SESSION_COOKIE_NAME)
+    request = HandshakeRequest()
+    request.session = import_module(settings.SESSION_ENGINE).SessionStore(morsel.value if morsel else None)
+    return get_user(request)
+
+
+def _same_origin(headers):
+    origin = headers.get('origin')
+    if origin is None:
+        return headers.get('host') in CHAT_SOCKET_ORIGINLESS_HOSTS
+    return urlparse(origin).netloc == headers.get('host')
+
+
+def _is_participant(chat_id, user):
+    from .models import Chat
+    return Chat.objects.filter(id=chat_id, participants=user).exists()
+
+
+def _mark_read(chat_id, user):
+    from .chats import mark_read
+    mark_read(chat_id, user)
+
+
+def _post_message(chat_id, user, content):
+    from .chats import post_message
+    from .models import Chat
+    return post_message(Chat.objects.get(id=chat_id), user, content)
+
+
+async def chat_socket(scope, receive, send, chat_id):
+    event = await receive()
+    if event['type'] != 'websocket.connect':
+        return
+
+    headers = _headers(scope)
+    user = await sync_to_async(_authenticate)(headers)
+    if not _same_origin(headers) or not user.is_authenticated or not await sync_to_async(_is_participant)(chat_id, user):
+        await send({'type': 'websocket.close', 'code': 4403})
+        return
+
+    broadcast = get_broadcast()
+    group = chat_group(chat_id)
+    subscription = await broadcast.subscribe(group)
+    await send({'type': 'websocket.accept'})
+
+    async def forward():
+        while True:
+            message = await broadcast.receive(subscription)
+            await send({'type': 'websocket.send', 'text': json.dumps(message, separators=(',', ':'))})
+            if message.get('sender__username') != user.username:
+                await sync_to_async(_mark_read)(chat_id, user)  # the chat is open on this socket
+
+    limit = RateLimit('send_message')
+    forwarder = asyncio.create_task(forward())
+    try:
+        while True:
+            event = await receive()
+            if event['type'] == 'websocket.disconnect':
+                break
+            if event['type'] != 'websocket.receive':
+                continue
+            try:
+                content = str(json.loads(event.get('text') or '{}').get('content', '')).strip()
+            except (ValueError, AttributeError):
+                content = ''
+            if not content:
+                continue
+            wait = await limit.ahit(by_user(None, user))
+            if wait:
+                await send({'type': 'websocket.send', 'text': json.dumps({'error': retry_message(wait), 'retry_after': wait})})
+                continue
+            # The new message comes back to this socket through the broadcast
+            await sync_to_async(_post_message)(chat_id, user, content)
+    finally:
+        forwarder.cancel()
+        await broadcast.unsubscribe(group, subscription)
+
+
+# ASGI application for every websocket scope
+async def websocket_application(scope, receive, send):
+    match = CHAT_SOCKET_PATH.match(scope['path'])
+    if match is None:
+        await receive()
+        await send({'type': 'websocket.close', 'code': 4404})
+        return
+    await chat_socket(scope, receive, send, int(match['chat_id']))
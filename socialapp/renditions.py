@@ -0,0 +1,146 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import PurePosixPath
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from PIL import Image, ImageOps, features
+
+# Resized renditions of uploaded images. When a Post.image or Profile.profile_pic
+# changes, the original is kept as uploaded and a worker pool writes JPEG and
+# WebP copies at a few widths next to it, recording them in a JSON field:
+#
+#   {"source": "<image name>", "width": 1080, "height": 720,
+#    "jpeg": {"320": "<name>", ...}, "webp": {"320": "<name>", ...}}
+#
+# "source" ties the renditions to the file they were made from, so templates
+# fall back to the original until a new upload has been processed (see the
+# responsive_image tag). Work is queued after the transaction commits and never
+# runs on the request path unless IMAGE_RENDITIONS_ASYNC is off.
+
+logger = logging.getLogger(__name__)
+
+IMAGE_RENDITIONS_ASYNC = getattr(settings, 'IMAGE_RENDITIONS_ASYNC', True)
+IMAGE_RENDITION_WORKERS = getattr(settings, 'IMAGE_RENDITION_WORKERS', 2)
+
+# name: (model, image field, renditions field, widths)
+SPECS = {
+    'post': ('socialapp.Post', 'image', 'image_renditions', getattr(settings, 'POST_IMAGE_WIDTHS', (320, 640, 1080))),
+    'profile': ('socialapp.Profile', 'profile_pic', 'profile_pic_renditions', getattr(settings, 'PROFILE_PIC_WIDTHS', (64, 128, 256))),
+}
+
+FORMATS = [('jpeg', 'JPEG', 'jpg', {'quality': 82, 'optimize': True, 'progressive': True})]
+if features.check('webp'):
+    FORMATS.append(('webp', 'WEBP', 'webp', {'quality': 80, 'method': 4}))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=IMAGE_RENDITION_WORKERS, thread_name_prefix='renditions')
+    return _executor
+
+
+# True when the instance's image has no renditions made from it yet
+def is_stale(instance, spec_name):
+    _, image_field, renditions_field, _ = SPECS[spec_name]
+    image = getattr(instance, image_field)
+    return bool(image) and (getattr(instance, renditions_field) or {}).get('source') != image.name
+
+
+# Queue renditions of the instance's current image, called from post_save signals
+def schedule_renditions(instance, spec_name):
+    if not is_stale(instance, spec_name):
+        return
+    source_name = getattr(instance, SPECS[spec_name][1]).name
+    if IMAGE_RENDITIONS_ASYNC:
+        transaction.on_commit(lambda: _get_executor().submit(_run, spec_name, instance.pk, source_name))
+    else:
+        transaction.on_commit(lambda: build_renditions(spec_name, instance.pk, source_name))
+
+
+def _run(spec_name, pk, source_name):
+    close_old_connections()
+    try:
+        build_renditions(spec_name, pk, source_name)
+    except Exception:
+        logger.exception('Building %s renditions of %s failed', spec_name, source_name)
+    finally:
+        close_old_connections()
+
+
+def _flatten(image):
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def _write(image, storage, source_name, spec_widths):
+    path = PurePosixPath(source_name)
+    data = {'source': source_name, 'width': image.width, 'height': image.height}
+    for width in sorted({min(width, image.width) for width in spec_widths}):
+        resized = image if width == image.width else image.resize(
+            (width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+        for key, pil_format, extension, options in FORMATS:
+            buffer = BytesIO()
+            resized.save(buffer, pil_format, **options)
+            name = storage.save(str(path.parent / 'renditions' / f'{path.stem}_{width}w.{extension}'), ContentFile(buffer.getvalue()))
+            data.setdefault(key, {})[str(width)] = name
+    return data
+
+
+def rendition_names(data):
+    return [name for key, *_ in FORMATS for name in (data or {}).get(key, {}).values()]
+
+
+# Delete the renditions of a row that is going away, once that is committed
+def discard_renditions(data):
+    names = rendition_names(data)
+    if names:
+        transaction.on_commit(lambda: [default_storage.delete(name) for name in names])
+
+
+# Make and record the renditions of `source_name`, unless the row has moved on
+# to another image in the meantime. Returns the recorded data, or None.
+def build_renditions(spec_name, pk, source_name):
+    model_label, image_field, renditions_field, widths = SPECS[spec_name]
+    model = apps.get_model(model_label)
+    instance = model._base_manager.filter(pk=pk).only(image_field, renditions_field).first()
+    if instance is None or getattr(instance, image_field).name != source_name:
+        return None
+
+    # Sources are content-addressed and may be shared between rows, renditions
+    # belong to one row and go to plain storage
+    storage = default_storage
+    with getattr(instance, image_field).storage.open(source_name, 'rb') as source:
+        image = Image.open(source)
+        animated = getattr(image, 'is_animated', False)
+        if not animated:
+            image = _flatten(ImageOps.exif_transpose(image))
+    # Animations would be flattened to one frame, keep serving the original
+    data = {'source': source_name, 'animated': True} if animated else _write(image, storage, source_name, widths)
+
+    changes = {renditions_field: data}
+    if spec_name == 'post':
+        changes['card_version'] = F('card_version') + 1  # cached cards still point at the original
+    updated = model._base_manager.filter(pk=pk, **{image_field: source_name}).update(**changes)
+    if updated:
+        unused = set(rendition_names(getattr(instance, renditions_field))) - set(rendition_names(data))
+    else:
+        unused = set(rendition_names(data))
+    for name in unused:
+        storage.delete(name)
+    return data if updated else None
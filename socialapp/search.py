@@ -0,0 +1,220 @@
+import re
+from django.conf import settings
+from django.db import connection
+from .pagination import InvalidCursor, decode_raw_cursor, encode_cursor
+
+# Full-text post search. Each post's caption, hashtags and author username are
+# indexed when the post is saved and dropped when it is deleted, the posts of a
+# user are reindexed when the username changes, and results come back
+# relevance-ranked, paginated on (score, id).
+#
+#   PostgreSQL: a tsvector column on socialapp_post with a GIN index, kept up
+#               to date by a trigger in the same write as the post row.
+#   SQLite:     an FTS5 shadow table keyed by post id, ranked with bm25().
+#   Others:     a plain icontains scan, unranked, so the code path still works.
+#
+# This module must not import models at load time, migrations use it too.
+
+SEARCH_PAGE_SIZE = getattr(settings, 'SEARCH_PAGE_SIZE', 20)
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+FTS_TABLE = 'socialapp_post_fts'
+
+
+def _tokens(text):
+    return TOKEN_RE.findall((text or '').lower())
+
+
+def _hashtag_text(caption):
+    return ' '.join(tag.lstrip('#') for tag in re.findall(r'#\w+', caption or ''))
+
+
+# The vector is computed by the database as the row is written, same weights
+# and tokens as _hashtag_text(); 'simple' config on both sides so usernames
+# and hashtags are not stemmed away
+POSTGRES_VECTOR_FUNCTION = r"""
+CREATE OR REPLACE FUNCTION socialapp_post_search_vector() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('simple', coalesce((SELECT username FROM auth_user WHERE id = NEW.user_id), '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce((SELECT string_agg(tag[1], ' ')
+                                                  FROM regexp_matches(NEW.caption, '#(\w+)', 'g') AS tag), '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(NEW.caption, '')), 'B');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql
+"""
+
+
+class PostgresSearchBackend:
+    indexed_on_write = True
+
+    def install(self, cursor):
+        cursor.execute('ALTER TABLE socialapp_post ADD COLUMN IF NOT EXISTS search_vector tsvector')
+        cursor.execute('CREATE INDEX IF NOT EXISTS socialapp_post_search_idx ON socialapp_post USING GIN (search_vector)')
+        cursor.execute(POSTGRES_VECTOR_FUNCTION)
+        cursor.execute('DROP TRIGGER IF EXISTS socialapp_post_search_vector ON socialapp_post')
+        cursor.execute('CREATE TRIGGER socialapp_post_search_vector BEFORE INSERT OR UPDATE OF caption, user_id '
+                       'ON socialapp_post FOR EACH ROW EXECUTE FUNCTION socialapp_post_search_vector()')
+
+    def uninstall(self, cursor):
+        cursor.execute('DROP TRIGGER IF EXISTS socialapp_post_search_vector ON socialapp_post')
+        cursor.execute('DROP FUNCTION IF EXISTS socialapp_post_search_vector()')
+        cursor.execute('DROP INDEX IF EXISTS socialapp_post_search_idx')
+        cursor.execute('ALTER TABLE socialapp_post DROP COLUMN IF EXISTS search_vector')
+
+    # Saving a post already ran the trigger, this only refreshes rows written before it existed
+    def index(self, cursor, post_id, caption, username):
+        cursor.execute('UPDATE socialapp_post SET caption = caption WHERE id = %s', [post_id])
+
+    def reindex_author(self, cursor, user_id, username):
+        cursor.execute('UPDATE socialapp_post SET user_id = user_id WHERE user_id = %s', [user_id])
+
+    def remove(self, cursor, post_id):
+        pass  # the vector lives on the post row itself
+
+    def search(self, cursor, tokens, after, limit):
+        query = ' & '.join(f'{token}:*' for token in tokens)
+        sql = ("SELECT id, score FROM ("
+               "SELECT p.id, ts_rank(p.search_vector, q)::float8 AS score "
+               "FROM socialapp_post p, to_tsquery('simple', %s) q WHERE p.search_vector @@ q"
+               ") ranked")
+        params = [query]
+        if after:
+            sql += ' WHERE score < %s OR (score = %s AND id < %s)'
+            params += [after[0], after[0], after[1]]
+        cursor.execute(sql + ' ORDER BY score DESC, id DESC LIMIT %s', params + [limit])
+        return cursor.fetchall()
+
+
+class SQLiteSearchBackend:
+    indexed_on_write = False
+
+    def install(self, cursor):
+        cursor.execute(f'CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(caption, hashtags, username)')
+
+    def uninstall(self, cursor):
+        cursor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+    def index(self, cursor, post_id, caption, username):
+        self.remove(cursor, post_id)
+        cursor.execute(f'INSERT INTO {FTS_TABLE} (rowid, caption, hashtags, username) VALUES (%s, %s, %s, %s)',
+                       [post_id, caption, _hashtag_text(caption), username])
+
+    def reindex_author(self, cursor, user_id, username):
+        cursor.execute(f'UPDATE {FTS_TABLE} SET username = %s WHERE rowid IN (SELECT id FROM socialapp_post WHERE user_id = %s)',
+                       [username, user_id])
+
+    def remove(self, cursor, post_id):
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [post_id])
+
+    def search(self, cursor, tokens, after, limit):
+        # Quoted prefix terms, implicitly AND-ed; bm25 is lower-is-better so it is negated
+        match = ' '.join(f'"{token}"*' for token in tokens)
+        sql = (f"SELECT id, score FROM ("
+               f"SELECT rowid AS id, -bm25({FTS_TABLE}, 1.0, 2.0, 2.0) AS score "
+               f"FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s"
+               f") ranked")
+        params = [match]
+        if after:
+            sql += ' WHERE score < %s OR (score = %s AND id < %s)'
+            params += [after[0], after[0], after[1]]
+        cursor.execute(sql + ' ORDER BY score DESC, id DESC LIMIT %s', params + [limit])
+        return cursor.fetchall()
+
+
+class ScanSearchBackend:
+    indexed_on_write = True  # the username is joined at query time
+
+    def install(self, cursor):
+        pass
+
+    def uninstall(self, cursor):
+        pass
+
+    def index(self, cursor, post_id, caption, username):
+        pass
+
+    def reindex_author(self, cursor, user_id, username):
+        pass
+
+    def remove(self, cursor, post_id):
+        pass
+
+    def search(self, cursor, tokens, after, limit):
+        from django.db.models import Q
+        from .models import Post
+        condition = Q()
+        for token in tokens:
+            condition &= Q(caption__icontains=token) | Q(user__username__icontains=token)
+        posts = Post.objects.filter(condition)
+        if after:
+            posts = posts.filter(id__lt=after[1])
+        return [(post_id, 0.0) for post_id in posts.order_by('-id').values_list('id', flat=True)[:limit]]
+
+
+def get_backend(using=None):
+    vendor = (using or connection).vendor
+    if vendor == 'postgresql':
+        return PostgresSearchBackend()
+    if vendor == 'sqlite':
+        return SQLiteSearchBackend()
+    return ScanSearchBackend()
+
+
+# Keep the index in step with a post, called from the Post save/delete signals
+def index_post(post):
+    backend = get_backend()
+    if backend.indexed_on_write:
+        return
+    with connection.cursor() as cursor:
+        backend.index(cursor, post.id, post.caption, post.user.username)
+
+
+# Called from the User save signal when the username changed
+def reindex_author(user):
+    with connection.cursor() as cursor:
+        get_backend().reindex_author(cursor, user.id, user.username)
+
+
+def remove_post(post_id):
+    with connection.cursor() as cursor:
+        get_backend().remove(cursor, post_id)
+
+
+# Re-index every post, returns the number indexed
+def rebuild_index(posts):
+    backend = get_backend()
+    total = 0
+    with connection.cursor() as cursor:
+        for post_id, caption, username in posts.values_list('id', 'caption', 'user__username').iterator():
+            backend.index(cursor, post_id, caption, username)
+            total += 1
+    return total
+
+
+# One ranked page of posts matching `query`, returns (posts, next_cursor)
+def search_page(query, cursor=None, page_size=SEARCH_PAGE_SIZE):
+    from .models import Post
+    tokens = _tokens(query)
+    if not tokens:
+        return [], None
+
+    after = None
+    if cursor:
+        score, post_id = decode_raw_cursor(cursor, 2)
+        try:
+            after = (float(score), int(post_id))
+        except (TypeError, ValueError) as exc:
+            raise InvalidCursor(cursor) from exc
+
+    with connection.cursor() as db_cursor:
+        rows = get_backend().search(db_cursor, tokens, after, page_size + 1)
+
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last_id, last_score = rows[-1]
+        next_cursor = encode_cursor([last_score, last_id])
+    posts = Post.objects.select_related('user').in_bulk([post_id for post_id, score in rows])
+    return [posts[post_id] for post_id, score in rows if post_id in posts], next_cursor
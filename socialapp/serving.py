@@ -0,0 +1,123 @@
+import mimetypes
+import os
+import re
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+
+# Media file responses for serve_media, in place of the development-only
+# static() helper:
+#
+#   - strong ETag and Last-Modified, with 304/412 for conditional requests
+#   - single byte ranges (Range, If-Range) as 206, so <video> can seek
+#   - MEDIA_ACCEL = 'x-accel-redirect' (nginx) or 'x-sendfile' (Apache,
+#     lighttpd) hands the transfer to the front-end server, which then does
+#     the range handling itself; Python only checks the path and headers.
+#
+# Content-addressed names (see socialapp/media.py) never change content and
+# are cached as immutable; everything else for MEDIA_MAX_AGE seconds.
+
+MEDIA_MAX_AGE = getattr(settings, 'MEDIA_MAX_AGE', 60 * 60)
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+CONTENT_ADDRESSED_RE = re.compile(r'^[^/]+/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}(\.\w+)?$')
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+READ_SIZE = 64 * 1024
+
+
+# Absolute path of a media file, Http404 for anything outside MEDIA_ROOT or missing
+def media_file(name):
+    try:
+        path = safe_join(settings.MEDIA_ROOT, name)
+    except SuspiciousFileOperation:
+        raise Http404('Media file not found.')
+    if not os.path.isfile(path):
+        raise Http404('Media file not found.')
+    return path
+
+
+# (start, end) of a single satisfiable byte range, None to send the whole file,
+# False when the range cannot be satisfied
+def parse_range(header, size):
+    match = RANGE_RE.match((header or '').strip())
+    if match is None or match.group(1) == match.group(2) == '':
+        return None  # absent, malformed or several ranges: a full 200 is allowed
+    first, last = match.groups()
+    if first == '':
+        length = int(last)
+        if length == 0:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        return False
+    return start, end
+
+
+# Ranges only apply while the validator in If-Range still matches
+def _if_range_matches(request, etag, last_modified):
+    if_range = request.headers.get('If-Range')
+    if not if_range:
+        return True
+    if if_range.startswith(('"', 'W/')):
+        return if_range == etag
+    return parse_http_date_safe(if_range) == last_modified
+
+
+def _read_range(path, start, length):
+    with open(path, 'rb') as source:
+        source.seek(start)
+        while length > 0:
+            data = source.read(min(READ_SIZE, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+
+
+def media_response(request, name):
+    path = media_file(name)
+    stat = os.stat(path)
+    size = stat.st_size
+    last_modified = int(stat.st_mtime)
+    etag = quote_etag(f'{stat.st_mtime_ns:x}-{size:x}')
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        byte_range = None
+        if request.method == 'GET' and _if_range_matches(request, etag, last_modified):
+            byte_range = parse_range(request.headers.get('Range'), size)
+        content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        accel = getattr(settings, 'MEDIA_ACCEL', None)
+
+        if byte_range is False:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+        elif accel == 'x-accel-redirect':
+            response = HttpResponse(content_type=content_type)
+            response['X-Accel-Redirect'] = getattr(settings, 'MEDIA_ACCEL_PREFIX', '/protected-media/') + name.lstrip('/')
+        elif accel == 'x-sendfile':
+            response = HttpResponse(content_type=content_type)
+            response['X-Sendfile'] = path
+        elif byte_range is not None:
+            start, end = byte_range
+            response = StreamingHttpResponse(_read_range(path, start, end - start + 1), status=206, content_type=content_type)
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+            response['Content-Length'] = str(end - start + 1)
+        else:
+            response = FileResponse(open(path, 'rb'), content_type=content_type)
+
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    if response.status_code not in (200, 206, 304):
+        return response
+    if CONTENT_ADDRESSED_RE.match(name):
+        patch_cache_control(response, public=True, max_age=IMMUTABLE_MAX_AGE, immutable=True)
+    else:
+        patch_cache_control(response, public=True, max_age=MEDIA_MAX_AGE)
+    return response
@@ -0,0 +1,105 @@
+// Resumable chunked uploads (see socialapp/uploads.py).
+// uploadFile(file) resolves to an upload_id the post forms accept in place of
+// a file field. Each chunk is a PUT with a Content-Range header; after a
+// network error the uploader asks the server how much arrived (HEAD) and
+// carries on from there.
+const UPLOAD_MAX_RETRIES = 5;
+
+function uploadCsrfToken() {
+    return document.getElementsByName('csrfmiddlewaretoken')[0].value;
+}
+
+async function uploadOffset(url) {
+    const response = await fetch(url, { method: 'HEAD' });
+    if (!response.ok) {
+        throw new Error('Upload not found.');
+    }
+    return parseInt(response.headers.get('Upload-Offset'), 10);
+}
+
+async function uploadFile(file, onProgress) {
+    const startResponse = await fetch('/uploads/', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/x-www-form-urlencoded',
+            'X-CSRFToken': uploadCsrfToken(),
+        },
+        body: new URLSearchParams({ filename: file.name || 'upload', content_type: file.type, size: file.size }),
+    });
+    const upload = await startResponse.json();
+    if (!startResponse.ok) {
+        throw new Error(upload.error || 'Upload rejected.');
+    }
+
+    let offset = upload.offset;
+    let retries = 0;
+    while (offset < file.size) {
+        const end = Math.min(offset + upload.chunk_size, file.size);
+        try {
+            const response = await fetch(upload.url, {
+                method: 'PUT',
+                headers: {
+                    'Content-Range': `bytes ${offset}-${end - 1}/${file.size}`,
+                    'X-CSRFToken': uploadCsrfToken(),
+                },
+                body: file.slice(offset, end),
+            });
+            const data = await response.json();
+            if (response.status === 409) {
+                offset = data.offset; // the server is ahead or behind, continue from where it is
+                continue;
+            }
+            if (!response.ok) {
+                throw new Error(data.error || 'Upload failed.');
+            }
+            offset = data.offset;
+            retries = 0;
+            if (onProgress) {
+                onProgress(offset / file.size);
+            }
+        } catch (error) {
+            if (error instanceof TypeError && retries < UPLOAD_MAX_RETRIES) {
+                // Network failure: back off, then resume from what the server has
+                retries += 1;
+                await new Promise((resolve) => setTimeout(resolve, 1000 * 2 ** retries));
+                offset = await uploadOffset(upload.url);
+                continue;
+            }
+            throw error;
+        }
+    }
+    return upload.upload_id;
+}
+
+// Upload a file for a post form, then submit the form with its upload_id instead of the file
+async function submitWithUpload(form, file, fileInputs) {
+    const buttons = form.querySelectorAll('button');
+    buttons.forEach((button) => { button.disabled = true; });
+    try {
+        const uploadId = await uploadFile(file);
+        form.querySelector('input[name="upload_id"]').value = uploadId;
+        fileInputs.forEach((input) => {
+            if (input) {
+                input.value = '';
+            }
+        });
+        form.submit();
+    } catch (error) {
+        console.error('Error uploading file:', error);
+        alert(error.message || 'Upload failed. Please try again.');
+        buttons.forEach((button) => { button.disabled = false; });
+    }
+}
+
+// Cropped canvas as a JPEG File, without going through a base64 data URL
+function canvasToFile(canvas, name) {
+    return new Promise((resolve, reject) => {
+        canvas.toBlob((blob) => {
+            if (blob) {
+                resolve(new File([blob], name, { type: 'image/jpeg' }));
+            } else {
+                reject(new Error('Error cropping image.'));
+            }
+        }, 'image/jpeg', 0.9);
+    });
+}
@@ -0,0 +1,228 @@
+import random
+from contextlib import contextmanager
+from datetime import timedelta
+from itertools import accumulate
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+from .counters import reconcile_post_counters, reconcile_profile_counters
+from .feed import rebuild_timeline, rerank_recent_posts
+from .graph import FollowGraph, store_suggestions
+from .hashtags import sync_post_hashtags
+from .models import Chat, ChatReadMarker, Comment, Follow, LikePost, Message, Post, Profile
+from .search import rebuild_index
+
+# Synthetic datasets for local benchmarking (see the generate_data and
+# benchmark_endpoints commands).
+#
+# Rows are written with bulk_create in batches, which skips the model signals,
+# so the data those signals maintain (feed timelines, search and hashtag
+# indexes, the chat inbox, counters, ranked scores, follow suggestions) is built in bulk
+# afterwards with the same functions the rebuild commands use.
+#
+# Popularity follows a Zipf law: a few users attract most follows and likes,
+# and how many people a user follows is Pareto distributed around the mean.
+# Everything is drawn from one seeded generator, so a seed always produces the
+# same dataset.
+
+PREFIX = 'gen_'
+PASSWORD = 'Synthetic#123'
+BATCH_SIZE = 1000
+HISTORY_DAYS = 90
+ZIPF_EXPONENT = 1.1
+WORDS = ('sunset', 'coffee', 'weekend', 'city', 'friends', 'music', 'travel', 'food', 'morning', 'beach', 'book',
+         'movie', 'garden', 'run', 'rain', 'street', 'art', 'photo', 'family', 'trip', 'night', 'dog', 'cat', 'lake')
+TAGS = ('travel', 'food', 'photography', 'nature', 'fitness', 'music', 'art', 'love', 'tbt', 'weekend', 'mood', 'city')
+
+
+def _batches(rows, size=BATCH_SIZE):
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+def _bulk_create(model, rows):
+    created = []
+    for batch in _batches(rows):
+        created.extend(model.objects.bulk_create(batch))
+    return created
+
+
+# auto_now_add would stamp every generated row with the same moment
+@contextmanager
+def _explicit_timestamps(*fields):
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def _fields(*names):
+    return [model._meta.get_field(name) for model, name in names]
+
+
+class Generator:
+    def __init__(self, seed=0, prefix=PREFIX):
+        self.random = random.Random(seed)
+        self.prefix = prefix
+        self.now = timezone.now()
+
+    def _moment(self, after=None):
+        start = after or self.now - timedelta(days=HISTORY_DAYS)
+        return start + (self.now - start) * self.random.random()
+
+    def _zipf_weights(self, count):
+        return list(accumulate(1 / (rank + 1) ** ZIPF_EXPONENT for rank in range(count)))
+
+    def _text(self, low, high):
+        return ' '.join(self.random.choice(WORDS) for _ in range(self.random.randint(low, high)))
+
+    def users(self, count):
+        password = make_password(PASSWORD)
+        _bulk_create(User, [User(username=f'{self.prefix}{index}', password=password, date_joined=self._moment())
+                            for index in range(count)])
+        user_ids = list(User.objects.filter(username__startswith=self.prefix).order_by('id').values_list('id', flat=True))
+        _bulk_create(Profile, [Profile(user_id=user_id, bio=self._text(3, 12), location=self.random.choice(WORDS).title())
+                               for user_id in user_ids])
+        return user_ids
+
+    # Popularity rank of each user, shuffled so it does not follow signup order
+    def popularity(self, user_ids):
+        ranked = list(user_ids)
+        self.random.shuffle(ranked)
+        return ranked, self._zipf_weights(len(ranked))
+
+    def follows(self, user_ids, ranked, weights, mean):
+        rows = []
+        for follower_id in user_ids:
+            wanted = min(len(user_ids) - 1, round(mean * self.random.paretovariate(2) / 2))
+            followed = set()
+            for _ in range(3):  # popular users come up repeatedly, draw again to fill up
+                followed.update(self.random.choices(ranked, cum_weights=weights, k=wanted - len(followed)))
+                followed.discard(follower_id)
+                if len(followed) >= wanted:
+                    break
+            rows.extend(Follow(follower_id=follower_id, followed_id=followed_id, created_at=self._moment())
+                        for followed_id in followed)
+        _bulk_create(Follow, rows)
+        return len(rows)
+
+    def posts(self, user_ids, mean):
+        rows = []
+        for user_id in user_ids:
+            for _ in range(self.random.randint(0, 2 * mean)):
+                tags = ' '.join(f'#{tag}' for tag in self.random.sample(TAGS, self.random.randint(0, 3)))
+                created_at = self._moment()
+                rows.append(Post(user_id=user_id, caption=f'{self._text(4, 20)} {tags}'.strip(),
+                                 created_at=created_at, updated_at=created_at))
+        return _bulk_create(Post, rows)
+
+    def likes(self, posts, ranked, weights, mean):
+        rows = []
+        for post in posts:
+            likers = set(self.random.choices(ranked, cum_weights=weights, k=self.random.randint(0, 2 * mean)))
+            for user_id in likers:
+                liked_at = self._moment(post.created_at)
+                rows.append(LikePost(post_id=post.id, user_id=user_id, created_at=liked_at, updated_at=liked_at))
+        _bulk_create(LikePost, rows)
+        return len(rows)
+
+    # Top-level comments first, then replies to earlier comments of the same post.
+    # Paths need the ids, so they are written once the rows exist.
+    def comments(self, posts, user_ids, mean, reply_ratio):
+        top_level, replies = [], []
+        for post in posts:
+            count = self.random.randint(0, 2 * mean)
+            for _ in range(count - round(count * reply_ratio)):
+                top_level.append(Comment(post_id=post.id, user_id=self.random.choice(user_ids), text=self._text(2, 15),
+                                         created_at=self._moment(post.created_at)))
+        top_level = _bulk_create(Comment, top_level)
+        for comment in top_level:
+            comment.path = Comment.path_for(comment.id)
+        Comment.objects.bulk_update(top_level, ['path'], batch_size=BATCH_SIZE)
+        threads = {}
+        for comment in top_level:
+            threads.setdefault(comment.post_id, []).append(comment)
+        for post_id, thread in threads.items():
+            for _ in range(round(len(thread) * reply_ratio / max(1 - reply_ratio, 0.01))):
+                parent = self.random.choice(thread)
+                reply = Comment(post_id=post_id, user_id=self.random.choice(user_ids), text=self._text(2, 15),
+                                parent=parent, created_at=self._moment(parent.created_at))
+                replies.append(reply)
+        replies = _bulk_create(Comment, replies)
+        for reply in replies:
+            reply.path = Comment.path_for(reply.id, reply.parent.path)
+        Comment.objects.bulk_update(replies, ['path'], batch_size=BATCH_SIZE)
+        return len(top_level) + len(replies)
+
+    def chats(self, user_ids, count, mean_messages):
+        pairs = set()
+        for _ in range(count * 3):
+            if len(pairs) >= count or len(user_ids) < 2:
+                break
+            pairs.add(tuple(sorted(self.random.sample(user_ids, 2))))
+        chats = _bulk_create(Chat, [Chat(pair_key=Chat.pair_key_for(*pair), created_at=self._moment()) for pair in sorted(pairs)])
+        participants = Chat.participants.through
+        _bulk_create(participants, [participants(chat_id=chat.id, user_id=user_id)
+                                    for chat, pair in zip(chats, sorted(pairs)) for user_id in pair])
+
+        messages = []
+        for chat, pair in zip(chats, sorted(pairs)):
+            moment = chat.created_at
+            for index in range(self.random.randint(1, 2 * mean_messages)):
+                moment = self._moment(moment)
+                messages.append(Message(chat_id=chat.id, sender_id=pair[index % 2], content=self._text(1, 20), timestamp=moment))
+        _bulk_create(Message, messages)
+
+        latest = Message.objects.filter(chat=OuterRef('pk')).order_by('-timestamp', '-id')
+        Chat.objects.filter(id__in=[chat.id for chat in chats]).update(
+            last_message_id=Subquery(latest.values('id')[:1]), last_message_at=Subquery(latest.values('timestamp')[:1]))
+        last_at = dict(Chat.objects.filter(id__in=[chat.id for chat in chats]).values_list('id', 'last_message_at'))
+        _bulk_create(ChatReadMarker, [
+            ChatReadMarker(chat_id=chat.id, user_id=user_id, counterpart_id=pair[1 - side], last_read_at=last_at[chat.id],
+                           unread_count=self.random.choice((0, 0, 0, 1, 2, 5)), last_activity_at=last_at[chat.id])
+            for chat, pair in zip(chats, sorted(pairs)) for side, user_id in enumerate(pair)
+        ])
+        return len(chats), len(messages)
+
+
+# Generate a dataset of `users` users and everything they do, returns the row counts
+@transaction.atomic
+def generate(users=100, follows=20, posts=5, likes=10, comments=3, reply_ratio=0.3, chats=None, messages=20,
+             seed=0, prefix=PREFIX):
+    generator = Generator(seed, prefix)
+    timestamps = _fields((Follow, 'created_at'), (Post, 'created_at'), (Post, 'updated_at'),
+                         (LikePost, 'created_at'), (LikePost, 'updated_at'), (Comment, 'created_at'),
+                         (Chat, 'created_at'), (Message, 'timestamp'))
+    with _explicit_timestamps(*timestamps):
+        user_ids = generator.users(users)
+        ranked, weights = generator.popularity(user_ids)
+        counts = {'users': len(user_ids), 'follows': generator.follows(user_ids, ranked, weights, follows)}
+        created_posts = generator.posts(user_ids, posts)
+        counts['posts'] = len(created_posts)
+        counts['likes'] = generator.likes(created_posts, ranked, weights, likes)
+        counts['comments'] = generator.comments(created_posts, user_ids, comments, reply_ratio)
+        counts['chats'], counts['messages'] = generator.chats(user_ids, users // 2 if chats is None else chats, messages)
+
+    generated = Post._base_manager.filter(user__username__startswith=prefix)
+    rebuild_index(generated)
+    for post in generated.only('id', 'caption', 'created_at').iterator():
+        sync_post_hashtags(post)
+    for user in User.objects.filter(id__in=user_ids).iterator():
+        rebuild_timeline(user)
+    reconcile_post_counters()
+    rerank_recent_posts(generator.now)  # the timelines were ranked before the counters were set
+    reconcile_profile_counters()
+    store_suggestions(FollowGraph.load(), user_ids)
+    return counts
+
+
+# Delete a generated dataset (and everything that cascades from its users)
+def clear(prefix=PREFIX):
+    deleted, _ = User.objects.filter(username__startswith=prefix).delete()
+    return deleted
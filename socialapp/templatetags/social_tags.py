@@ -0,0 +1,61 @@
+from django import template
+from django.core.files.storage import default_storage
+from django.urls import reverse
+from django.utils.html import conditional_escape, format_html, format_html_join
+from django.utils.safestring import mark_safe
+from ..cards import personalize, render_card
+from ..models import HASHTAG_RE
+
+register = template.Library()
+
+
+# Turn #hashtags in a caption into links to their tag page
+@register.filter(needs_autoescape=True)
+def link_hashtags(text, autoescape=True):
+    escape = conditional_escape if autoescape else (lambda value: value)
+    parts = []
+    position = 0
+    for match in HASHTAG_RE.finditer(text or ''):
+        parts.append(escape(text[position:match.start()]))
+        tag = match.group()
+        parts.append(format_html('<a href="{}" class="hashtag">{}</a>', reverse('hashtag', args=[tag[1:].lower()]), tag))
+        position = match.end()
+    parts.append(escape((text or '')[position:]))
+    return mark_safe(''.join(str(part) for part in parts))
+
+
+def _srcset(storage, names):
+    return ', '.join(f'{storage.url(name)} {width}w' for width, name in sorted(names.items(), key=lambda item: int(item[0])))
+
+
+# <picture> with WebP and JPEG srcsets from an image's renditions (see
+# socialapp/renditions.py); a plain <img> of the original until they exist.
+#   {% responsive_image post.image post.image_renditions sizes="600px" class="post-image" alt="Post Image" %}
+@register.simple_tag
+def responsive_image(image, renditions, sizes='100vw', **attrs):
+    if not image:
+        return ''
+    attributes = format_html_join('', ' {}="{}"', attrs.items())
+    if not renditions or renditions.get('source') != image.name or not renditions.get('jpeg'):
+        return format_html('<img src="{}"{}>', image.url, attributes)
+
+    storage = default_storage
+    jpeg = renditions['jpeg']
+    largest = jpeg[max(jpeg, key=int)]
+    webp = format_html('<source type="image/webp" srcset="{}" sizes="{}">', _srcset(storage, renditions['webp']), sizes) \
+        if renditions.get('webp') else ''
+    return format_html('<picture>{}<img src="{}" srcset="{}" sizes="{}"{}></picture>',
+                       webp, storage.url(largest), _srcset(storage, jpeg), sizes, attributes)
+
+
+# A post card: the shared fragment from the card cache (see socialapp/cards.py),
+# rendered on a miss, with the viewer's follow, like and owner bits filled in.
+#   {% post_card post card_mode %}
+@register.simple_tag(takes_context=True)
+def post_card(context, post, card_mode='feed'):
+    mode = 'profile' if card_mode == 'profile' else 'feed'
+    html = getattr(post, 'card_html', None)
+    if html is None:
+        html = render_card(post, mode)
+    following = post.user.username in (context.get('follow_statuses') or {})
+    return mark_safe(personalize(html, post, mode, context['user'], following, str(context.get('csrf_token', ''))))
@@ -0,0 +1,65 @@
+import re
+from contextlib import contextmanager
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.test.utils import CaptureQueriesContext
+
+# Test helpers for keeping views inside a declared number of SQL queries.
+#
+#     with query_budget(6):
+#         self.client.get('/base/')
+#
+# fails the test, listing every captured statement, when the block runs more
+# queries than its budget. plan_problems() EXPLAINs a captured statement and
+# reports full table scans and sorts that no index serves.
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+@contextmanager
+def query_budget(budget, using=DEFAULT_DB_ALIAS, label=None):
+    with CaptureQueriesContext(connections[using]) as context:
+        yield context
+    executed = len(context.captured_queries)
+    if executed > budget:
+        statements = '\n'.join(f'{index}. {query["sql"]}' for index, query in enumerate(context.captured_queries, start=1))
+        raise QueryBudgetExceeded(f'{label or "Block"} ran {executed} queries, budget is {budget}:\n{statements}')
+
+
+class QueryBudgetMixin:
+    # Request a URL and assert the view stays within its query budget
+    def assertQueryBudget(self, budget, method, url, data=None, **extra):
+        with query_budget(budget, label=f'{method.upper()} {url}'):
+            response = getattr(self.client, method.lower())(url, data, **extra)
+        return response
+
+
+SQLITE_FULL_SCAN = re.compile(r'^SCAN (\S+)$')
+POSTGRES_SEQ_SCAN = re.compile(r'Seq Scan on (\S+)')
+POSTGRES_SORT = re.compile(r'^\s*(->\s*)?(Incremental )?Sort\b')
+
+
+# Problems in the plan of a SELECT as ['full scan of <table>', 'sort', ...].
+# PostgreSQL plans with sequential scans and sorts disabled, so the tiny test
+# tables cannot hide a missing index: whatever is left can only be done that way.
+def plan_problems(sql, using=DEFAULT_DB_ALIAS):
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            details = [row[-1] for row in cursor.fetchall()]
+            problems = [f'full scan of {match[1]}' for match in map(SQLITE_FULL_SCAN.match, details) if match]
+            return problems + ['sort' for detail in details if 'TEMP B-TREE FOR' in detail and 'ORDER BY' in detail]
+        if connection.vendor == 'postgresql':
+            cursor.execute('SET enable_seqscan = off')
+            cursor.execute('SET enable_sort = off')
+            try:
+                cursor.execute(f'EXPLAIN {sql}')
+                lines = [row[0] for row in cursor.fetchall()]
+            finally:
+                cursor.execute('RESET enable_seqscan')
+                cursor.execute('RESET enable_sort')
+            problems = [f'full scan of {match[1]}' for line in lines for match in [POSTGRES_SEQ_SCAN.search(line)] if match]
+            return problems + ['sort' for line in lines if POSTGRES_SORT.match(line)]
+    return []
@@ -1,3 +1,892 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import inspect
+import json
+import os
+import re
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
+from asgiref.sync import sync_to_async
+from PIL import Image
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.template import Context, Template
+from django.db import DatabaseError, connection
+from django.test import TestCase, TransactionTestCase, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from . import feed, metrics, realtime, synthetic, uploads, views
+from .cards import cache_stats, card_cache
+from .chats import get_or_create_direct_chat
+from .counters import reconcile_post_counters, reconcile_profile_counters
+from .feed import fan_out_post, rerank_recent_posts
+from .graph import FollowGraph, store_suggestions
+from .media import media_storage
+from .middleware import RequestProfile
+from .ratelimit import LockedFileBasedCache, RateLimit
+from .models import Chat, ChatReadMarker, Post, LikePost, Comment, FeedEntry, Follow, FollowChange, FollowSuggestion, MediaBlob, Message, UploadSession
+from .renditions import build_renditions, is_stale
+from .management.commands import build_follow_suggestions
+from .management.commands.benchmark_endpoints import ENDPOINTS
+from .testing import QueryBudgetExceeded, QueryBudgetMixin, plan_problems, query_budget
+from .urls import urlpatterns
 
-# Create your tests here.
+MEDIA_ROOT = tempfile.mkdtemp()
+MP4_BYTES = b'\x00\x00\x00\x18ftypmp42' + b'\x00' * 52
+
+# Views that are exercised by ViewQueryBudgetTests, every view in views.py must be listed here
+BUDGETED_VIEWS = {
+    'base', 'feed_page', 'hashtag_posts', 'sign_up', 'sign_in', 'sign_out', 'search_posts', 'profile_view', 'message',
+    'open_chat', 'load_messages', 'send_message', 'profile_settings', 'create_post', 'edit_post',
+    'delete_post', 'like_post', 'toggle_follow', 'add_comment', 'handle_404', 'handle_500', 'start_upload', 'upload_chunk',
+    'serve_media', 'follow_list', 'metrics', 'comment_list',
+}
+
+
+class QueryBudgetTests(TestCase):
+    def test_within_budget(self):
+        with query_budget(1) as context:
+            User.objects.count()
+        self.assertEqual(len(context.captured_queries), 1)
+
+    def test_over_budget_lists_queries(self):
+        with self.assertRaisesMessage(QueryBudgetExceeded, 'ran 2 queries, budget is 1'):
+            with query_budget(1):
+                User.objects.count()
+                User.objects.exists()
+
+
+# Enough rows that any per-post or per-comment query would blow the query budgets
+class SocialFixtureMixin:
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = User.objects.create_user('viewer', password='Secret#123')
+        cls.authors = [User.objects.create_user(f'author{i}', password='Secret#123') for i in range(3)]
+        for author in cls.authors:
+            Follow.objects.create(follower=cls.viewer, followed=author)
+            Follow.objects.create(follower=author, followed=cls.viewer)
+        cls.posts = []
+        for i in range(12):
+            author = cls.authors[i % 3]
+            post = Post.objects.create(user=author, caption=f'Post {i} #budget', image='posts/sample.jpg')
+            fan_out_post(post)
+            for commenter in cls.authors:
+                Comment.objects.create(post=post, user=commenter, text='Nice')
+                LikePost.objects.create(post=post, user=commenter)
+            cls.posts.append(post)
+        cls.own_post = Post.objects.create(user=cls.viewer, caption='Mine', image='posts/mine.jpg')
+        fan_out_post(cls.own_post)
+        cls.chats = []
+        for author in cls.authors:
+            chat = get_or_create_direct_chat(cls.viewer, author)
+            for i in range(5):
+                Message.objects.create(chat=chat, sender=author if i % 2 else cls.viewer, content=f'Message {i}')
+            cls.chats.append(chat)
+        reconcile_post_counters()
+        reconcile_profile_counters()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        # Query counts must not depend on what earlier tests left cached (trending hashtags, ...)
+        caches['default'].clear()
+        card_cache().clear()
+        caches['ratelimit'].clear()
+        self.client.force_login(self.viewer)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, UPLOAD_SESSION_DIR=MEDIA_ROOT, PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class ViewQueryBudgetTests(SocialFixtureMixin, QueryBudgetMixin, TestCase):
+    def test_every_view_has_a_budget(self):
+        defined = {name for name, func in inspect.getmembers(views, inspect.isfunction)
+                   if func.__module__ == views.__name__ and not name.startswith('_')}
+        self.assertEqual(defined - BUDGETED_VIEWS, set())
+
+    def test_base(self):
+        response = self.assertQueryBudget(7, 'get', '/base/')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'class="post-item"', count=13)
+        # Comments are left to the comment modal
+        self.assertNotContains(response, 'class="comment-item"')
+        self.assertContains(response, f'data-next-url="/post/{self.posts[0].id}/comments/"')
+
+    def test_post_cards_are_cached_and_personalized(self):
+        self.client.get('/base/')
+        self.assertEqual(cache_stats(), {'hits': 0, 'misses': 13})
+        response = self.assertQueryBudget(6, 'get', '/base/')
+        self.assertEqual(cache_stats(), {'hits': 13, 'misses': 13})
+        self.assertContains(response, '<b>Unfollow</b>', count=12)
+        self.assertContains(response, '🩷', count=13)
+
+        self.client.post(f'/post/{self.posts[0].id}/like/')
+        response = self.client.get('/base/')
+        self.assertEqual(cache_stats(), {'hits': 25, 'misses': 14})
+        self.assertContains(response, '❤️', count=1)
+
+        self.client.force_login(self.authors[0])
+        response = self.client.get('/profile/author0/')
+        self.assertContains(response, 'class="delete-btn"', count=4)
+        self.client.force_login(self.viewer)
+        response = self.client.get('/profile/author0/')
+        self.assertNotContains(response, 'class="delete-btn"')
+        self.assertContains(response, 'class="post-footer"', count=4)
+
+    def test_feed_page(self):
+        response = self.assertQueryBudget(6, 'get', '/feed/more/', {'source': 'profile', 'username': 'author0'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_ranked_feed(self):
+        before = FeedEntry.objects.get(owner=self.viewer, post=self.posts[0]).rank_score
+        # The like only queues the rank update, which runs once it commits
+        with mock.patch.object(feed, 'FEED_FANOUT_ASYNC', False), self.captureOnCommitCallbacks() as callbacks:
+            self.client.post(f'/post/{self.posts[0].id}/like/')
+        self.assertEqual(FeedEntry.objects.get(owner=self.viewer, post=self.posts[0]).rank_score, before)
+        for callback in callbacks:
+            callback()
+        # Switching saves the session
+        response = self.assertQueryBudget(10, 'get', '/base/', {'feed': 'top'})
+        self.assertEqual(re.findall(r'Post (\d+) ', response.content.decode())[0], '0')
+        self.assertContains(response, '<a href="?feed=top" class="active">Top</a>')
+        # The choice sticks until the other mode is picked
+        response = self.assertQueryBudget(6, 'get', '/base/')
+        self.assertEqual(re.findall(r'Post (\d+) ', response.content.decode())[0], '0')
+        response = self.client.get('/base/', {'feed': 'latest'})
+        self.assertEqual(re.findall(r'Post (\d+) ', response.content.decode())[0], '11')
+
+        # The like recomputed the scores from the counters
+        liked = FeedEntry.objects.select_related('post').get(owner=self.viewer, post=self.posts[0])
+        self.assertAlmostEqual(liked.rank_score, feed.rank_score(liked.post, liked.affinity))
+
+        # Mutual follows weigh more; a rerank recomputes every score from the counters
+        FeedEntry.objects.update(rank_score=0, affinity=1)
+        self.assertEqual(rerank_recent_posts(batch_size=5), 13)
+        entry = FeedEntry.objects.get(owner=self.viewer, post=self.posts[0])
+        self.assertEqual(entry.affinity, 1.5)
+        self.assertAlmostEqual(entry.rank_score, liked.rank_score)
+        self.assertGreater(entry.rank_score, FeedEntry.objects.get(owner=self.viewer, post=self.posts[1]).rank_score)
+        page = self.assertQueryBudget(5, 'get', '/feed/more/', {'source': 'home', 'feed': 'top'}).json()
+        self.assertEqual(re.findall(r'Post (\d+) ', page['html'])[0], '0')
+        self.assertEqual(self.client.get('/feed/more/', {'source': 'home', 'feed': 'top', 'cursor': 'nonsense'}).status_code, 400)
+
+    def test_hashtag_posts(self):
+        response = self.assertQueryBudget(5, 'get', '/tag/budget/')
+        self.assertContains(response, 'class="post-item"', count=12)
+
+    def test_search_posts(self):
+        response = self.assertQueryBudget(7, 'get', '/search/', {'q': 'Post'})
+        self.assertContains(response, 'class="post-item"', count=12)
+
+    def test_search_follows_username_changes(self):
+        author = self.authors[0]
+        author.username = 'renamed'
+        author.save()
+        self.assertContains(self.client.get('/search/', {'q': 'renamed'}), 'class="post-item"', count=4)
+        self.assertNotContains(self.client.get('/search/', {'q': 'author0'}), 'class="post-item"')
+
+    def test_cards_follow_username_changes(self):
+        self.client.get('/base/')
+        author = self.authors[0]
+        author.username = 'renamed'
+        author.save()
+        response = self.client.get('/base/')
+        self.assertContains(response, '<a href="/profile/renamed/">renamed</a>', count=4)
+        self.assertNotContains(response, 'author0')
+
+    def test_profile_view(self):
+        response = self.assertQueryBudget(8, 'get', '/profile/author0/')
+        self.assertContains(response, 'class="post-item"', count=4)
+
+    def test_follow_list(self):
+        for i in range(3):
+            Follow.objects.create(follower=User.objects.create_user(f'fan{i}'), followed=self.authors[0])
+        with mock.patch.object(views, 'FOLLOW_PAGE_SIZE', 3):
+            response = self.assertQueryBudget(4, 'get', '/profile/author0/followers/')
+            page = response.json()
+            self.assertEqual(page['html'].count('class="list-item"'), 3)
+            self.assertIn('/profile/fan2/', page['html'])
+            page = self.client.get(page['next_url']).json()
+        self.assertEqual(page['html'].count('class="list-item"'), 1)
+        self.assertIn('/profile/viewer/', page['html'])
+        self.assertIsNone(page['next_url'])
+        response = self.assertQueryBudget(4, 'get', '/profile/viewer/following/')
+        self.assertIn('/profile/author2/', response.json()['html'])
+
+    def test_message(self):
+        response = self.assertQueryBudget(3, 'get', '/message/')
+        self.assertContains(response, 'class="chat-item"', count=3)
+        self.assertContains(response, 'You: Message 4', count=3)
+
+    def test_open_chat(self):
+        response = self.assertQueryBudget(4, 'get', '/chat/author0/')
+        self.assertEqual(response.json()['chat_id'], self.chats[0].id)
+
+    def test_load_messages(self):
+        url = f'/chat/{self.chats[0].id}/messages/'
+        response = self.assertQueryBudget(5, 'get', url)
+        history = response.json()
+        self.assertEqual(len(history['messages']), 5)
+        self.assertIsNone(history['before'])
+        poll = self.client.get(url, {'since': history['since']})
+        self.assertEqual(poll.json()['messages'], [])
+        response = self.assertQueryBudget(5, 'get', url, {'since': history['since']}, HTTP_IF_NONE_MATCH=poll['ETag'])
+        self.assertEqual(response.status_code, 304)
+        response = self.assertQueryBudget(4, 'get', url, {'before': history['since']})
+        self.assertEqual(len(response.json()['messages']), 4)
+
+    def test_send_message(self):
+        response = self.assertQueryBudget(8, 'post', '/send_message/', {'chat_id': self.chats[0].id, 'content': 'Hi'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_like_post(self):
+        response = self.assertQueryBudget(11, 'post', f'/post/{self.posts[0].id}/like/')
+        self.assertTrue(response.json()['liked'])
+
+    def test_add_comment(self):
+        response = self.assertQueryBudget(9, 'post', f'/post/{self.posts[0].id}/comment/', {'text': 'Hello'})
+        self.assertEqual(response.json()['comment_count'], 4)
+        comment = Comment.objects.get(pk=response.json()['id'])
+        self.assertEqual(comment.path, Comment.path_for(comment.id))
+        self.assertIn('data-depth="0"', response.json()['html'])
+
+        response = self.assertQueryBudget(10, 'post', f'/post/{self.posts[0].id}/comment/', {'text': '<b>Re</b>', 'parent': comment.id})
+        reply = Comment.objects.get(pk=response.json()['id'])
+        self.assertEqual((reply.parent_id, reply.path), (comment.id, comment.path + Comment.path_for(reply.id)))
+        self.assertIn('&lt;b&gt;Re&lt;/b&gt;', response.json()['html'])
+        self.assertEqual(self.client.post(f'/post/{self.posts[1].id}/comment/', {'text': 'Re', 'parent': comment.id}).status_code, 400)
+
+    def test_comment_list(self):
+        post = self.posts[0]
+        first, second = Comment.objects.filter(post=post).order_by('id')[:2]
+        reply = Comment.objects.create(post=post, user=self.viewer, text='Reply', parent=first)
+        nested = Comment.objects.create(post=post, user=self.authors[1], text='Nested', parent=reply)
+        with mock.patch.object(views, 'COMMENT_PAGE_SIZE', 3):
+            page = self.assertQueryBudget(4, 'get', f'/post/{post.id}/comments/').json()
+            ids = [int(id) for id in re.findall(r'data-comment-id="(\d+)"', page['html'])]
+            # Depth-first: replies right after what they reply to
+            self.assertEqual(ids, [first.id, reply.id, nested.id])
+            self.assertIn('data-depth="2"', page['html'])
+            page = self.client.get(page['next_url']).json()
+        self.assertEqual(re.findall(r'data-comment-id="(\d+)"', page['html'])[0], str(second.id))
+        self.assertIsNone(page['next_url'])
+
+        page = self.assertQueryBudget(5, 'get', f'/post/{post.id}/comments/{first.id}/replies/').json()
+        self.assertEqual(re.findall(r'data-comment-id="(\d+)"', page['html']), [str(reply.id), str(nested.id)])
+        self.assertEqual(self.client.get(f'/post/{self.posts[1].id}/comments/{first.id}/replies/').status_code, 404)
+        self.assertEqual(self.client.get(f'/post/{post.id}/comments/', {'cursor': 'nonsense'}).status_code, 400)
+
+    def test_toggle_follow(self):
+        stranger = User.objects.create_user('stranger', password='Secret#123')
+        response = self.assertQueryBudget(15, 'post', '/toggle-follow/stranger/')
+        self.assertTrue(response.json()['following_status'])
+        response = self.assertQueryBudget(12, 'post', f'/toggle-follow/{stranger.username}/')
+        self.assertFalse(response.json()['following_status'])
+
+    def test_create_post(self):
+        self.assertQueryBudget(2, 'get', '/add_post/')
+        video = SimpleUploadedFile('clip.mp4', MP4_BYTES, content_type='video/mp4')
+        response = self.assertQueryBudget(11, 'post', '/add_post/', {'caption': 'New', 'video': video})
+        self.assertEqual(response.status_code, 302)
+
+    def test_create_post_fans_out_after_commit(self):
+        self.client.force_login(self.authors[0])
+        video = SimpleUploadedFile('clip.mp4', MP4_BYTES, content_type='video/mp4')
+        with mock.patch.object(feed, 'FEED_FANOUT_ASYNC', False), mock.patch.object(feed, 'FEED_TIMELINE_SIZE', 10):
+            with self.captureOnCommitCallbacks() as callbacks:
+                self.client.post('/add_post/', {'caption': 'Fresh', 'video': video})
+            post = Post.objects.get(caption='Fresh')
+            self.assertFalse(FeedEntry.objects.filter(owner=self.viewer, post=post).exists())
+            for callback in callbacks:
+                callback()
+        # The newest entries stay, the viewer's timeline is trimmed to the cap
+        timeline = FeedEntry.objects.filter(owner=self.viewer).order_by('-created_at', '-post')
+        self.assertEqual(len(timeline), 10)
+        self.assertEqual(timeline[0].post, post)
+        self.assertFalse(timeline.filter(post__in=self.posts[:3]).exists())
+
+    def test_create_post_rejects_mismatched_upload(self):
+        fake = SimpleUploadedFile('clip.mp4', b'<html>' + b'\x00' * 16, content_type='video/mp4')
+        response = self.client.post('/add_post/', {'caption': 'New', 'video': fake})
+        self.assertContains(response, 'is not a valid video/mp4 file')
+
+    def test_resumable_upload(self):
+        response = self.assertQueryBudget(4, 'post', '/uploads/', {'filename': 'clip.mp4', 'content_type': 'video/mp4',
+                                                                    'size': len(MP4_BYTES)})
+        upload = response.json()
+        half = len(MP4_BYTES) // 2
+        response = self.assertQueryBudget(4, 'put', upload['url'], MP4_BYTES[:half], content_type='application/octet-stream',
+                                          HTTP_CONTENT_RANGE=f'bytes 0-{half - 1}/{len(MP4_BYTES)}')
+        self.assertEqual(response.json(), {'offset': half, 'complete': False})
+        response = self.assertQueryBudget(3, 'head', upload['url'])
+        self.assertEqual(response['Upload-Offset'], str(half))
+        response = self.client.put(upload['url'], MP4_BYTES[:half], content_type='application/octet-stream',
+                                   HTTP_CONTENT_RANGE=f'bytes 0-{half - 1}/{len(MP4_BYTES)}')
+        self.assertEqual(response.status_code, 409)
+        response = self.client.put(upload['url'], MP4_BYTES[half:], content_type='application/octet-stream',
+                                   HTTP_CONTENT_RANGE=f'bytes {half}-{len(MP4_BYTES) - 1}/{len(MP4_BYTES)}')
+        self.assertTrue(response.json()['complete'])
+
+        with self.captureOnCommitCallbacks(execute=True), mock.patch.object(feed, 'FEED_FANOUT_ASYNC', False):
+            response = self.assertQueryBudget(12, 'post', '/add_post/', {'caption': 'Uploaded', 'upload_id': upload['upload_id']})
+        self.assertEqual(response.status_code, 302)
+        post = Post.objects.get(caption='Uploaded')
+        self.assertEqual(post.video.read(), MP4_BYTES)
+        self.assertFalse(UploadSession.objects.exists())
+
+    def test_upload_survives_a_failed_post(self):
+        content = MP4_BYTES + b'\x01'
+        upload = self.client.post('/uploads/', {'filename': 'clip.mp4', 'content_type': 'video/mp4', 'size': len(content)}).json()
+        self.client.put(upload['url'], content, content_type='application/octet-stream',
+                        HTTP_CONTENT_RANGE=f'bytes 0-{len(content) - 1}/{len(content)}')
+        digest = hashlib.sha256(content).hexdigest()
+        name = f'posts/{digest[:2]}/{digest[2:4]}/{digest}.mp4'
+
+        with mock.patch.object(views, 'adjust', side_effect=DatabaseError), self.assertRaises(DatabaseError):
+            self.client.post('/add_post/', {'caption': 'Uploaded', 'upload_id': upload['upload_id']})
+        self.assertFalse(media_storage.exists(name))
+        self.assertFalse(Post.objects.filter(caption='Uploaded').exists())
+        self.assertTrue(UploadSession.objects.exists())
+
+        with self.captureOnCommitCallbacks(execute=True), mock.patch.object(feed, 'FEED_FANOUT_ASYNC', False):
+            self.client.post('/add_post/', {'caption': 'Uploaded', 'upload_id': upload['upload_id']})
+        self.assertEqual(Post.objects.get(caption='Uploaded').video.name, name)
+        self.assertFalse(UploadSession.objects.exists())
+
+    def test_open_uploads_are_capped(self):
+        data = {'filename': 'clip.mp4', 'content_type': 'video/mp4', 'size': 10 * 1024 * 1024}
+        with self.settings(MAX_OPEN_UPLOADS=2, MAX_PENDING_UPLOAD_BYTES=25 * 1024 * 1024):
+            self.assertEqual(self.client.post('/uploads/', data).status_code, 201)
+            response = self.client.post('/uploads/', {**data, 'size': 20 * 1024 * 1024})
+            self.assertContains(response, 'at most 25 MB', status_code=400)
+            self.assertEqual(self.client.post('/uploads/', data).status_code, 201)
+            self.assertContains(self.client.post('/uploads/', {**data, 'size': 1}), 'at most 2 uploads', status_code=400)
+            # Abandoned sessions stop counting once they are past the TTL
+            UploadSession.objects.update(updated_at=timezone.now() - timedelta(hours=uploads.UPLOAD_SESSION_TTL_HOURS + 1))
+            self.assertEqual(self.client.post('/uploads/', data).status_code, 201)
+        with self.settings(RATE_LIMITS={'start_upload': '1/h'}):
+            self.assertEqual(self.client.post('/uploads/', {**data, 'size': 1}).status_code, 429)
+
+    def test_edit_post(self):
+        url = f'/post/{self.own_post.id}/edit/'
+        self.assertQueryBudget(4, 'get', url)
+        response = self.assertQueryBudget(10, 'post', url, {'caption': 'Edited'})
+        self.assertEqual(response.status_code, 302)
+
+    def test_delete_post(self):
+        response = self.assertQueryBudget(16, 'post', f'/post/{self.own_post.id}/delete/')
+        self.assertEqual(response.status_code, 302)
+
+    def test_profile_settings(self):
+        self.assertQueryBudget(3, 'get', '/profile/settings/')
+        response = self.assertQueryBudget(4, 'post', '/profile/settings/', {'bio': 'Hello', 'location': 'Pune'})
+        self.assertEqual(response.status_code, 302)
+
+    def test_sign_in_and_out(self):
+        self.client.logout()
+        self.assertQueryBudget(0, 'get', '/')
+        response = self.assertQueryBudget(11, 'post', '/', {'username': 'viewer', 'password': 'Secret#123'})
+        self.assertRedirects(response, '/base/', fetch_redirect_response=False)
+        response = self.assertQueryBudget(4, 'get', '/sign-out/')
+        self.assertEqual(response.status_code, 302)
+
+    def test_rate_limits(self):
+        with self.settings(RATE_LIMITS={'add_comment': '2/m', 'sign_in_failures': '2/5m'}):
+            url = f'/post/{self.posts[0].id}/comment/'
+            for _ in range(2):
+                self.assertEqual(self.client.post(url, {'text': 'Hi'}).status_code, 200)
+            response = self.client.post(url, {'text': 'Hi'})
+            self.assertEqual(response.status_code, 429)
+            self.assertGreater(int(response['Retry-After']), 0)
+
+            self.client.logout()
+            for _ in range(2):
+                self.client.post('/', {'username': 'Viewer', 'password': 'wrong'})
+            response = self.client.post('/', {'username': 'viewer', 'password': 'Secret#123'})
+            self.assertContains(response, 'Too many requests', status_code=429)
+            self.assertIn('Retry-After', response)
+
+    def test_blocked_requests_are_not_counted(self):
+        limit = RateLimit('add_comment', '2/d')
+        self.assertEqual([bool(limit.hit('user:1')) for _ in range(4)], [False, False, True, True])
+        _, _, _, (current_key, _) = limit._window('user:1')
+        self.assertEqual(caches['ratelimit'].get(current_key), 2)
+
+    def test_file_cache_counts_concurrent_requests(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = LockedFileBasedCache(directory, {})
+            cache.add('rl:test', 0)
+            with ThreadPoolExecutor(max_workers=8) as pool:
+                list(pool.map(lambda _: cache.incr('rl:test'), range(400)))
+            self.assertEqual(cache.get('rl:test'), 400)
+
+    def test_sign_up(self):
+        self.client.logout()
+        self.assertQueryBudget(0, 'get', '/sign-up/')
+        response = self.assertQueryBudget(6, 'post', '/sign-up/', {
+            'username': 'newcomer', 'email': 'newcomer@example.com',
+            'password1': 'Secret#12345', 'password2': 'Secret#12345',
+        })
+        self.assertEqual(response.status_code, 302)
+
+    def test_metrics(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+
+        # A new client, as the middleware is loaded by its first request
+        self.client = self.client_class()
+        self.client.force_login(self.viewer)
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(METRICS_ENABLED=True, METRICS_DIR=directory, METRICS_TOKEN='secret'):
+            self.client.get('/base/')
+            self.client.get('/base/')
+            self.client.get('/no-such-page/')
+            response = self.assertQueryBudget(0, 'get', '/metrics', HTTP_AUTHORIZATION='Bearer secret')
+            text = response.content.decode()
+            self.assertIn('socialapp_requests_total{view="base",method="GET",status="200"} 2', text)
+            self.assertIn('socialapp_requests_total{view="unmatched",method="GET",status="404"} 1', text)
+            self.assertIn('socialapp_request_queries_bucket{view="base",le="10"} 2', text)
+            self.assertIn('socialapp_request_duration_seconds_count{view="base"} 2', text)
+            self.assertIn('socialapp_post_card_cache_total{result="hit"} 13', text)
+            # The scrape itself is in progress
+            self.assertIn('socialapp_requests_in_progress 1', text)
+
+            self.assertEqual(self.client.get('/metrics').status_code, 403)
+            self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+            User.objects.filter(pk=self.viewer.pk).update(is_staff=True)
+            self.assertQueryBudget(2, 'get', '/metrics')
+
+    def test_serve_media(self):
+        name = media_storage.save('posts/clip.mp4', SimpleUploadedFile('clip.mp4', MP4_BYTES))
+        url = f'/media/{name}'
+        response = self.assertQueryBudget(0, 'get', url)
+        self.assertEqual(b''.join(response.streaming_content), MP4_BYTES)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('immutable', response['Cache-Control'])
+
+        response = self.assertQueryBudget(0, 'get', url, HTTP_RANGE='bytes=8-15')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 8-15/{len(MP4_BYTES)}')
+        self.assertEqual(b''.join(response.streaming_content), MP4_BYTES[8:16])
+        response = self.client.get(url, HTTP_RANGE='bytes=-4')
+        self.assertEqual(b''.join(response.streaming_content), MP4_BYTES[-4:])
+        response = self.client.get(url, HTTP_RANGE=f'bytes={len(MP4_BYTES)}-')
+        self.assertEqual(response.status_code, 416)
+        response = self.client.get(url, HTTP_RANGE='bytes=0-3', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+
+        etag = response['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.client.get('/media/../settings.py').status_code, 404)
+        with self.settings(MEDIA_ACCEL='x-accel-redirect'):
+            response = self.client.get(url, HTTP_RANGE='bytes=8-15')
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/{name}')
+        self.assertEqual(response.content, b'')
+
+    def test_error_handlers(self):
+        request = RequestFactory().get('/missing/')
+        request.user = self.viewer
+        with query_budget(0):
+            self.assertEqual(views.handle_404(request, None).status_code, 404)
+            self.assertEqual(views.handle_500(request).status_code, 500)
+
+
+# Sorts on computed values that no index can hold: trending sums and search relevance
+COMPUTED_ORDERINGS = ('SUM(', 'bm25(', 'ts_rank')
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class QueryPlanTests(SocialFixtureMixin, TestCase):
+    def assertIndexedPlans(self, url, data=None):
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(url, data)
+        for query in context.captured_queries:
+            if not query['sql'].startswith('SELECT'):
+                continue
+            problems = plan_problems(query['sql'])
+            if any(ordering in query['sql'] for ordering in COMPUTED_ORDERINGS):
+                problems = [problem for problem in problems if problem != 'sort']
+            self.assertEqual(problems, [], f'GET {url}: {query["sql"]}')
+
+    def test_read_views_use_indexes(self):
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            self.skipTest(f'No plan checks for {connection.vendor}')
+        for url, data in (('/base/', None), ('/feed/more/', {'source': 'profile', 'username': 'author0'}),
+                          ('/feed/more/', {'source': 'home', 'feed': 'top'}),
+                          ('/tag/budget/', None), ('/search/', {'q': 'Post'}), ('/profile/author0/', None),
+                          ('/profile/author0/followers/', None), ('/profile/viewer/following/', None), ('/message/', None),
+                          (f'/chat/{self.chats[0].id}/messages/', None), (f'/post/{self.own_post.id}/edit/', None),
+                          (f'/post/{self.posts[0].id}/comments/', None)):
+            with self.subTest(url=url):
+                card_cache().clear()
+                self.assertIndexedPlans(url, data)
+
+    def test_plan_problems_reports_scans_and_sorts(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('SQLite plan wording')
+        self.assertEqual(plan_problems("SELECT * FROM socialapp_post WHERE caption = 'x' ORDER BY likes_count"),
+                         ['full scan of socialapp_post', 'sort'])
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class ImageRenditionTests(TestCase):
+    def test_renditions_are_built_after_commit_and_used_in_srcset(self):
+        buffer = BytesIO()
+        Image.new('RGB', (800, 600), 'red').save(buffer, 'PNG')
+        author = User.objects.create_user('photographer', password='Secret#123')
+        with self.captureOnCommitCallbacks() as callbacks:
+            post = Post.objects.create(user=author, image=SimpleUploadedFile('photo.png', buffer.getvalue()))
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(post.image_renditions, {})
+
+        data = build_renditions('post', post.pk, post.image.name)
+        self.assertEqual(sorted(data['jpeg'], key=int), ['320', '640', '800'])
+        post.refresh_from_db()
+        self.assertEqual(post.image_renditions, data)
+        self.assertFalse(is_stale(post, 'post'))
+
+        html = Template('{% load social_tags %}{% responsive_image post.image post.image_renditions sizes="600px" %}').render(
+            Context({'post': post}))
+        self.assertIn('<picture>', html)
+        self.assertIn('_320w.jpg 320w', html)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class MediaBlobTests(TestCase):
+    def test_identical_uploads_share_one_file_until_the_last_reference_goes(self):
+        first_author = User.objects.create_user('first', password='Secret#123')
+        second_author = User.objects.create_user('second', password='Secret#123')
+        first = Post.objects.create(user=first_author, video=SimpleUploadedFile('a.MP4', MP4_BYTES))
+        second = Post.objects.create(user=second_author, video=SimpleUploadedFile('b.mp4', MP4_BYTES))
+        self.assertEqual(first.video.name, second.video.name)
+        self.assertRegex(first.video.name, r'^posts/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.mp4$')
+        self.assertEqual(MediaBlob.objects.get(name=first.video.name).refcount, 2)
+
+        name = first.video.name
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(media_storage.exists(name))
+        with self.captureOnCommitCallbacks(execute=True):
+            second.video = SimpleUploadedFile('c.mp4', MP4_BYTES + b'\x00')
+            second.save()
+        self.assertFalse(media_storage.exists(name))
+        self.assertFalse(MediaBlob.objects.filter(name=name).exists())
+        self.assertEqual(MediaBlob.objects.get(name=second.video.name).refcount, 1)
+
+
+class FollowSuggestionTests(TestCase):
+    def test_graph_ranks_friends_of_friends_and_applies_changes(self):
+        graph = FollowGraph.from_edges([(1, 2), (1, 3), (2, 4), (3, 4), (3, 5), (6, 1)])
+        self.assertEqual(graph.suggestions(1), [(4, 2, False, 2), (5, 1, False, 1), (6, 0, True, 0.5)])
+        graph.apply(1, 4, True)
+        graph.apply(1, 3, False)
+        self.assertEqual(graph.following(1), [2, 4])
+        self.assertTrue(graph.follows(1, 4))
+        self.assertEqual(graph.mutual_count(6, 4), 1)
+        self.assertEqual(graph.suggestions(1), [(6, 0, True, 0.5)])
+
+    def test_suggestions_are_precomputed_and_refreshed_from_follow_changes(self):
+        reader, friend, first, second = [User.objects.create_user(name, password='Secret#123')
+                                         for name in ('reader', 'friend', 'first', 'second')]
+        for follower, followed in ((reader, friend), (friend, first), (friend, second)):
+            Follow.objects.create(follower=follower, followed=followed)
+        call_command('build_follow_suggestions', stdout=StringIO())
+        graph = FollowGraph.load()
+
+        self.client.force_login(reader)
+        response = self.client.get('/base/')
+        self.assertContains(response, 'People you may know')
+        self.assertContains(response, "toggleFollowUser('first')")
+        self.assertContains(self.client.get('/profile/second/'), 'Followed by 1 person you follow')
+
+        self.client.post('/toggle-follow/first/')
+        self.assertNotContains(self.client.get('/base/'), "toggleFollowUser('first')")
+        store_suggestions(graph, graph.apply_changes(FollowChange.objects.all()))
+        self.assertEqual(list(FollowSuggestion.objects.filter(user=reader).values_list('suggested__username', flat=True)), ['second'])
+        self.assertEqual(list(FollowSuggestion.objects.filter(user=first).order_by('suggested__username')
+                              .values_list('suggested__username', 'follows_you')), [('friend', True), ('reader', True)])
+
+    def test_watch_applies_changes_that_commit_out_of_id_order(self):
+        reader, friend, other = [User.objects.create_user(name) for name in ('reader', 'friend', 'other')]
+        graph = FollowGraph.load()
+        command = build_follow_suggestions.Command(stdout=StringIO())
+        FollowChange.objects.create(id=10, follower_id=reader.id, followed_id=friend.id, following=True)
+        command._apply_pending(graph, 20)
+        # A transaction that took id 5 before the batch was read commits after it
+        FollowChange.objects.create(id=5, follower_id=friend.id, followed_id=other.id, following=True)
+        command._apply_pending(graph, 20)
+        self.assertTrue(graph.follows(friend.id, other.id))
+        self.assertFalse(FollowChange.objects.exists())
+
+class SyntheticDataTests(TestCase):
+    def test_generate_builds_a_consistent_dataset(self):
+        counts = synthetic.generate(users=12, follows=4, posts=2, likes=3, comments=4, messages=3, seed=1, prefix='syn_')
+        self.assertEqual(counts['users'], User.objects.filter(username__startswith='syn_').count())
+        self.assertEqual(counts['posts'], Post.objects.count())
+        self.assertTrue(Comment.objects.filter(parent__isnull=False).exists())
+        for reply in Comment.objects.filter(parent__isnull=False).select_related('parent'):
+            self.assertEqual(reply.path, Comment.path_for(reply.id, reply.parent.path))
+        self.assertEqual(ChatReadMarker.objects.count(), 2 * counts['chats'])
+        self.assertTrue(FeedEntry.objects.exists())
+        self.assertEqual(reconcile_post_counters() + reconcile_profile_counters(), 0)
+        self.assertEqual(synthetic.generate(users=12, follows=4, seed=1, prefix='again_')['follows'], counts['follows'])
+
+    def test_benchmark_covers_every_url_and_reports_json(self):
+        self.assertEqual({pattern.name for pattern in urlpatterns} - ENDPOINTS.keys(), set())
+        output = StringIO()
+        call_command('benchmark_endpoints', '--current-db', '--sizes', '8', '--requests', '2', '--warmup', '0',
+                     '--endpoint', 'base', '--endpoint', 'delete_post', stdout=output)
+        run = json.loads(output.getvalue())['runs'][0]
+        self.assertEqual(run['users'], 8)
+        self.assertEqual([(endpoint['name'], endpoint['statuses']) for endpoint in run['endpoints']],
+                         [('base', {'200': 2}), ('delete_post', {'302': 2})])
+        self.assertGreater(run['endpoints'][0]['queries'], 0)
+        self.assertFalse(User.objects.filter(username__startswith='bench_').exists())
+
+@override_settings(ROOT_URLCONF='socialapp.async_urls', PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class AsyncViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = User.objects.create_user('viewer', password='Secret#123')
+        cls.author = User.objects.create_user('author', password='Secret#123')
+        cls.post = Post.objects.create(user=cls.author, caption='Async')
+
+    def setUp(self):
+        caches['ratelimit'].clear()
+
+    def test_middleware_is_async_capable(self):
+        # A sync-only middleware would run every ASGI request in a worker thread
+        for path in settings.MIDDLEWARE:
+            self.assertTrue(getattr(import_string(path), 'async_capable', False), path)
+
+    # Rank updates run inline instead of on the pool, which cannot see the test's transaction
+    @mock.patch.object(feed, 'FEED_FANOUT_ASYNC', False)
+    async def test_write_endpoints(self):
+        await self.async_client.aforce_login(self.viewer)
+        response = await self.async_client.post(f'/post/{self.post.id}/like/')
+        self.assertEqual(response.json(), {'liked': True, 'like_count': 1})
+        response = await self.async_client.post(f'/post/{self.post.id}/like/')
+        self.assertEqual(response.json(), {'liked': False, 'like_count': 0})
+
+        response = await self.async_client.post('/toggle-follow/author/')
+        self.assertEqual(response.json(), {'following_status': True, 'followers_count': 1, 'following_count': 0})
+        self.assertTrue(await FeedEntry.objects.filter(owner=self.viewer, post=self.post).aexists())
+        response = await self.async_client.post('/toggle-follow/author/')
+        self.assertFalse(response.json()['following_status'])
+        self.assertFalse(await FeedEntry.objects.filter(owner=self.viewer, post=self.post).aexists())
+
+        response = await self.async_client.post(f'/post/{self.post.id}/comment/', {'text': 'Hi'})
+        self.assertEqual(response.json()['comment_count'], 1)
+        # Likes change the card, comments do not
+        post = await Post.objects.aget(pk=self.post.pk)
+        self.assertEqual(post.card_version, 2)
+
+        chat_id = (await self.async_client.get('/chat/author/')).json()['chat_id']
+        self.assertEqual((await self.async_client.get('/chat/author/')).json()['chat_id'], chat_id)
+        response = await self.async_client.post('/send_message/', {'chat_id': chat_id, 'content': 'Hello'})
+        self.assertEqual(response.json()['sender'], 'viewer')
+        chat = await Chat.objects.aget(pk=chat_id)
+        self.assertEqual(chat.last_message_id, response.json()['id'])
+
+
+# Drives socialapp.realtime the way an ASGI server would, no channel layer needed
+class SocketClient:
+    def __init__(self, path, session_key=None, origin='http://testserver'):
+        headers = [(b'host', b'testserver')]
+        if session_key:
+            headers.append((b'cookie', f'{settings.SESSION_COOKIE_NAME}={session_key}'.encode()))
+        if origin:
+            headers.append((b'origin', origin.encode()))
+        self.incoming = asyncio.Queue()
+        self.outgoing = asyncio.Queue()
+        scope = {'type': 'websocket', 'path': path, 'headers': headers}
+        self.task = asyncio.ensure_future(realtime.websocket_application(scope, self.incoming.get, self.outgoing.put))
+
+    async def connect(self):
+        await self.incoming.put({'type': 'websocket.connect'})
+        return (await self.receive())['type']
+
+    async def receive(self):
+        return await asyncio.wait_for(self.outgoing.get(), 5)
+
+    async def receive_json(self):
+        return json.loads((await self.receive())['text'])
+
+    async def send(self, content):
+        await self.incoming.put({'type': 'websocket.receive', 'text': json.dumps({'content': content})})
+
+    async def close(self):
+        await self.incoming.put({'type': 'websocket.disconnect'})
+        await asyncio.wait_for(self.task, 5)
+
+
+# Messages are published once committed, so these tests commit
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class RealtimeTests(TransactionTestCase):
+    def setUp(self):
+        caches['ratelimit'].clear()
+        self.viewer = User.objects.create_user('viewer', password='Secret#123')
+        self.author = User.objects.create_user('author', password='Secret#123')
+        self.chat = get_or_create_direct_chat(self.viewer, self.author)
+        self.path = f'/ws/chat/{self.chat.id}/'
+
+    async def session_key(self, user):
+        self.async_client.cookies.clear()
+        await self.async_client.aforce_login(user)
+        return self.async_client.cookies[settings.SESSION_COOKIE_NAME].value
+
+    async def test_rejects_anonymous_and_outsiders(self):
+        self.assertEqual(await SocketClient(self.path).connect(), 'websocket.close')
+        outsider = await User.objects.acreate(username='outsider')
+        self.assertEqual(await SocketClient(self.path, await self.session_key(outsider)).connect(), 'websocket.close')
+        self.assertEqual(await SocketClient('/ws/other/', await self.session_key(self.viewer)).connect(), 'websocket.close')
+
+    async def test_rejects_other_and_missing_origins(self):
+        session_key = await self.session_key(self.viewer)
+        self.assertEqual(await SocketClient(self.path, session_key, 'http://evil.example').connect(), 'websocket.close')
+        self.assertEqual(await SocketClient(self.path, session_key, origin=None).connect(), 'websocket.close')
+        with mock.patch.object(realtime, 'CHAT_SOCKET_ORIGINLESS_HOSTS', ('testserver',)):
+            socket = SocketClient(self.path, session_key, origin=None)
+            self.assertEqual(await socket.connect(), 'websocket.accept')
+            await socket.close()
+
+    async def test_delivers_to_every_socket_of_the_chat(self):
+        sender = SocketClient(self.path, await self.session_key(self.viewer))
+        recipient = SocketClient(self.path, await self.session_key(self.author))
+        self.assertEqual(await sender.connect(), 'websocket.accept')
+        self.assertEqual(await recipient.connect(), 'websocket.accept')
+        await sender.send('Hello there')
+        message = await recipient.receive_json()
+        self.assertEqual((message['sender__username'], message['content']), ('viewer', 'Hello there'))
+        self.assertEqual((await sender.receive_json())['id'], message['id'])
+        await sender.close()
+        await recipient.close()
+
+    async def test_sends_share_the_send_message_limit(self):
+        socket = SocketClient(self.path, await self.session_key(self.viewer))
+        self.assertEqual(await socket.connect(), 'websocket.accept')
+        with self.settings(RATE_LIMITS={'send_message': '1/m'}):
+            await socket.send('First')
+            self.assertEqual((await socket.receive_json())['content'], 'First')
+            await socket.send('Second')
+            refusal = await socket.receive_json()
+            self.assertIn('Too many requests', refusal['error'])
+            self.assertGreater(refusal['retry_after'], 0)
+            response = await self.async_client.post('/send_message/', {'chat_id': self.chat.id, 'content': 'Third'})
+            self.assertEqual(response.status_code, 429)
+        await socket.close()
+        self.assertEqual(await Message.objects.filter(chat=self.chat).acount(), 1)
+
+    @skipUnless(os.environ.get('CHAT_BROADCAST_URL'), 'needs a Redis server in CHAT_BROADCAST_URL')
+    async def test_redis_broadcast(self):
+        broadcast = realtime.RedisBroadcast(os.environ['CHAT_BROADCAST_URL'], prefix='socialapp-test')
+        subscription = await broadcast.subscribe('chat.test')
+        await sync_to_async(broadcast.publish)('chat.test', {'content': 'Hi'})
+        self.assertEqual(await asyncio.wait_for(broadcast.receive(subscription), 5), {'content': 'Hi'})
+        await broadcast.unsubscribe('chat.test', subscription)
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        settings_override = override_settings(METRICS_ENABLED=True, METRICS_DIR=self.directory)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_processes_are_added_up(self):
+        metrics.REQUESTS.inc(view='base', method='GET', status=200)
+        metrics.REQUEST_LATENCY.observe(0.2, view='base')
+        metrics.REQUESTS_IN_PROGRESS.set(2)
+        # Another worker, no longer running
+        with mock.patch('os.getpid', return_value=2 ** 22 + 1):
+            metrics.REQUESTS.inc(3, view='base', method='GET', status=200)
+            metrics.REQUEST_LATENCY.observe(0.02, view='base')
+            metrics.REQUESTS_IN_PROGRESS.set(5)
+        metrics.store()  # back to this process's file
+
+        text = metrics.exposition()
+        self.assertIn('# TYPE socialapp_requests counter\nsocialapp_requests_total{view="base",method="GET",status="200"} 4\n', text)
+        self.assertIn('socialapp_request_duration_seconds_bucket{view="base",le="0.01"} 0\n', text)
+        self.assertIn('socialapp_request_duration_seconds_bucket{view="base",le="0.025"} 1\n', text)
+        self.assertIn('socialapp_request_duration_seconds_bucket{view="base",le="+Inf"} 2\n', text)
+        self.assertIn('socialapp_request_duration_seconds_sum{view="base"} 0.22', text)
+        self.assertIn('socialapp_requests_in_progress 2\n', text)
+
+    def test_store_grows_and_reopens(self):
+        path = f'{self.directory}/1.db'
+        store = metrics.MmapStore(path)
+        for index in range(5000):
+            store.add(f'["socialapp_requests", "_total", [["view", "{index}"]]]', index)
+        self.assertGreater(os.path.getsize(path), metrics.INITIAL_FILE_SIZE)
+        reopened = metrics.MmapStore(path)
+        reopened.add('["socialapp_requests", "_total", [["view", "4999"]]]', 1)
+        self.assertEqual(len(reopened._offsets), 5000)
+        values = metrics.collect()['socialapp_requests']
+        self.assertEqual(values[('_total', (('view', '4999'),))], 5000)
+
+    def test_files_of_a_previous_run_are_removed(self):
+        metrics.MmapStore(f'{self.directory}/{2 ** 22 + 1}.db').add('["socialapp_requests_in_progress", "", []]', 3)
+        metrics.REQUESTS_IN_PROGRESS.inc()
+        self.assertEqual(sorted(os.listdir(self.directory)), ['.lock', f'{os.getpid()}.db'])
+        self.assertIn('socialapp_requests_in_progress 1\n', metrics.exposition())
+
+    def test_files_of_running_workers_are_kept(self):
+        worker = f'{self.directory}/{os.getppid()}.db'
+        metrics.MmapStore(worker).add('["socialapp_requests", "_total", [["view", "base"], ["method", "GET"], ["status", "200"]]]', 3)
+        metrics.REQUESTS.inc(view='base', method='GET', status=200)
+        self.assertTrue(os.path.exists(worker))
+        self.assertIn('socialapp_requests_total{view="base",method="GET",status="200"} 4\n', metrics.exposition())
+
+    def test_labels_are_checked(self):
+        with self.assertRaises(ValueError):
+            metrics.REQUESTS.inc(view='base')
+
+
+class ProfilingMiddlewareTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = User.objects.create_user('viewer', password='Secret#123')
+        author = User.objects.create_user('author', password='Secret#123')
+        Post.objects.create(user=author, caption='Profiled')
+
+    def setUp(self):
+        self.client.force_login(self.viewer)
+
+    def test_disabled_by_default(self):
+        self.assertNotIn('Server-Timing', self.client.get('/base/'))
+
+    @override_settings(REQUEST_PROFILING=True, PROFILING_SLOW_MS=0, PROFILING_REPEAT_THRESHOLD=1000)
+    def test_server_timing_and_slow_log(self):
+        with self.assertLogs('socialapp.profiling', 'WARNING') as logs:
+            response = self.client.get('/base/')
+        self.assertRegex(response['Server-Timing'], r'^sql;dur=[\d.]+;desc="\d+ queries", tpl;dur=[\d.]+, view;dur=')
+        entry = json.loads(logs.records[0].getMessage())
+        self.assertEqual((entry['path'], entry['status']), ('/base/', 200))
+        self.assertGreater(entry['queries'], 0)
+        self.assertGreater(entry['template_ms'], 0)
+        self.assertLessEqual(len(entry['slowest_queries']), settings.PROFILING_SLOWEST_QUERIES)
+        self.assertEqual(entry['repeated_queries'], [])
+
+    @override_settings(PROFILING_SLOW_MS=60000, PROFILING_REPEAT_THRESHOLD=3)
+    def test_repeated_queries_are_flagged(self):
+        profile = RequestProfile()
+        lookup = 'SELECT * FROM "auth_user" WHERE "auth_user"."id" = %s'
+        profile.queries = [('SELECT * FROM "socialapp_post"', 0.002)] + [(lookup, 0.001)] * 3
+        with self.assertLogs('socialapp.profiling', 'WARNING') as logs:
+            response = profile.finish(RequestFactory().get('/base/'), HttpResponse())
+        self.assertIn('sql;dur=5.0;desc="4 queries"', response['Server-Timing'])
+        self.assertIn('nplusone;desc="1 repeated statements"', response['Server-Timing'])
+        entry = json.loads(logs.records[0].getMessage())
+        self.assertEqual(entry['repeated_queries'], [{'sql': lookup, 'count': 3}])
+        self.assertEqual(entry['slowest_queries'][0], {'sql': 'SELECT * FROM "socialapp_post"', 'ms': 2.0})
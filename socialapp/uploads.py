@@ -0,0 +1,235 @@
+import os
+import re
+import tempfile
+from contextlib import contextmanager
+from datetime import timedelta
+from pathlib import PurePath
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.core.files.uploadhandler import FileUploadHandler, SkipFile
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .media import delete_unreferenced
+from .models import UploadSession
+
+# Upload limits and the resumable upload path for post media.
+#
+# Every multipart upload goes through LimitedUploadHandler (first entry of
+# FILE_UPLOAD_HANDLERS), which rejects a file as soon as its declared type,
+# its first bytes or its running size break the limits, before the rest is
+# buffered. Rejected files are dropped and reported back to the form.
+#
+# Large files and cropped images use the resumable protocol instead:
+#
+#   POST /uploads/                   filename, size, content_type -> {upload_id, url, offset, chunk_size}
+#   PUT  /uploads/<id>/              Content-Range: bytes <start>-<end>/<size>, raw chunk as the body
+#   HEAD /uploads/<id>/              Upload-Offset: bytes received so far, to resume after a failure
+#
+# Chunks are streamed into a partial file under UPLOAD_SESSION_DIR (shared by
+# every worker that serves uploads) and the finished file is handed to the
+# post form as upload_id, which copies it to media storage in chunks. A user
+# can have at most settings.MAX_OPEN_UPLOADS sessions open, reserving at most
+# settings.MAX_PENDING_UPLOAD_BYTES between them, so nobody can fill the
+# directory; sessions past UPLOAD_SESSION_TTL_HOURS no longer count
+# (purge_uploads deletes them).
+
+MB = 1024 * 1024
+MAX_UPLOAD_SIZE = getattr(settings, 'MAX_UPLOAD_SIZE', {'image': 10 * MB, 'video': 200 * MB})
+UPLOAD_CHUNK_SIZE = getattr(settings, 'UPLOAD_CHUNK_SIZE', 2 * MB)
+UPLOAD_SESSION_TTL_HOURS = getattr(settings, 'UPLOAD_SESSION_TTL_HOURS', 24)
+
+# content type: (kind, extension)
+UPLOAD_TYPES = {
+    'image/jpeg': ('image', 'jpg'),
+    'image/png': ('image', 'png'),
+    'image/gif': ('image', 'gif'),
+    'image/webp': ('image', 'webp'),
+    'video/mp4': ('video', 'mp4'),
+    'video/quicktime': ('video', 'mov'),
+    'video/webm': ('video', 'webm'),
+}
+
+CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+READ_SIZE = 64 * 1024
+
+
+class UploadRejected(ValueError):
+    pass
+
+
+# The kind ('image' or 'video') of an allowed upload, checked against its declared size
+def check_upload(content_type, size=None):
+    content_type = (content_type or '').split(';')[0].strip().lower()
+    if content_type not in UPLOAD_TYPES:
+        raise UploadRejected(f'Files of type "{content_type or "unknown"}" cannot be uploaded.')
+    kind = UPLOAD_TYPES[content_type][0]
+    if size is not None and size > MAX_UPLOAD_SIZE[kind]:
+        raise UploadRejected(f'{kind.capitalize()}s can be at most {MAX_UPLOAD_SIZE[kind] // MB} MB.')
+    return kind
+
+
+# Whether the first bytes of a file look like its declared type
+def matches_type(content_type, head):
+    content_type = (content_type or '').split(';')[0].strip().lower()
+    if content_type == 'image/jpeg':
+        return head.startswith(b'\xff\xd8\xff')
+    if content_type == 'image/png':
+        return head.startswith(b'\x89PNG\r\n\x1a\n')
+    if content_type == 'image/gif':
+        return head[:6] in (b'GIF87a', b'GIF89a')
+    if content_type == 'image/webp':
+        return head[:4] == b'RIFF' and head[8:12] == b'WEBP'
+    if content_type in ('video/mp4', 'video/quicktime'):
+        return head[4:8] in (b'ftyp', b'moov', b'mdat', b'wide', b'free')
+    if content_type == 'video/webm':
+        return head.startswith(b'\x1a\x45\xdf\xa3')
+    return False
+
+
+class LimitedUploadHandler(FileUploadHandler):
+    def new_file(self, field_name, file_name, content_type, content_length, charset=None, content_type_extra=None):
+        super().new_file(field_name, file_name, content_type, content_length, charset, content_type_extra)
+        self.kind = None
+        try:
+            self.kind = check_upload(content_type, content_length)
+        except UploadRejected as exc:
+            self._reject(str(exc))
+
+    def receive_data_chunk(self, raw_data, start):
+        if start == 0 and not matches_type(self.content_type, raw_data[:16]):
+            self._reject(f'{self.file_name} is not a valid {self.content_type} file.')
+        if start + len(raw_data) > MAX_UPLOAD_SIZE[self.kind]:
+            self._reject(f'{self.kind.capitalize()}s can be at most {MAX_UPLOAD_SIZE[self.kind] // MB} MB.')
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None
+
+    def _reject(self, message):
+        if self.request is not None:
+            if not hasattr(self.request, 'rejected_uploads'):
+                self.request.rejected_uploads = {}
+            self.request.rejected_uploads[self.field_name] = message
+        raise SkipFile(message)
+
+
+def rejected_uploads(request):
+    return getattr(request, 'rejected_uploads', {})
+
+
+def session_dir():
+    return getattr(settings, 'UPLOAD_SESSION_DIR', os.path.join(tempfile.gettempdir(), 'socialapp-uploads'))
+
+
+def partial_path(session):
+    return os.path.join(session_dir(), f'{session.id}.part')
+
+
+def start_session(user, filename, content_type, size):
+    if size <= 0:
+        raise UploadRejected('The file is empty.')
+    kind = check_upload(content_type, size)
+    max_open, max_pending = getattr(settings, 'MAX_OPEN_UPLOADS', 5), getattr(settings, 'MAX_PENDING_UPLOAD_BYTES', 400 * MB)
+    open_sessions = (UploadSession.objects.filter(user=user, updated_at__gte=timezone.now() - timedelta(hours=UPLOAD_SESSION_TTL_HOURS))
+                     .aggregate(count=Count('id'), reserved=Coalesce(Sum('size'), 0)))
+    if open_sessions['count'] >= max_open:
+        raise UploadRejected(f'You can have at most {max_open} uploads in progress.')
+    if open_sessions['reserved'] + size > max_pending:
+        raise UploadRejected(f'Uploads in progress can add up to at most {max_pending // MB} MB.')
+    content_type = content_type.split(';')[0].strip().lower()
+    extension = UPLOAD_TYPES[content_type][1]
+    stem = PurePath(filename or '').stem[:80] or 'upload'
+    session = UploadSession.objects.create(user=user, kind=kind, content_type=content_type, filename=f'{stem}.{extension}', size=size)
+    os.makedirs(session_dir(), exist_ok=True)
+    open(partial_path(session), 'wb').close()
+    return session
+
+
+def parse_content_range(header):
+    match = CONTENT_RANGE_RE.match(header or '')
+    if match is None:
+        raise UploadRejected('A "Content-Range: bytes <start>-<end>/<size>" header is required.')
+    start, end, total = (int(value) for value in match.groups())
+    if end < start or end >= total or end - start + 1 > UPLOAD_CHUNK_SIZE:
+        raise UploadRejected('Invalid Content-Range.')
+    return start, end, total
+
+
+# Stream one chunk of the request body into the partial file at its offset.
+# Writing at the offset (not appending) makes a retried chunk idempotent.
+# Returns the new offset.
+def write_chunk(session, stream, start, end):
+    expected = end - start + 1
+    written = 0
+    with open(partial_path(session), 'r+b') as partial:
+        partial.seek(start)
+        while written < expected:
+            data = stream.read(min(READ_SIZE, expected - written))
+            if not data:
+                break
+            if start + written == 0 and not matches_type(session.content_type, data[:16]):
+                raise UploadRejected(f'The file is not a valid {session.content_type} file.')
+            partial.write(data)
+            written += len(data)
+        partial.truncate(start + written)
+    UploadSession.objects.filter(id=session.id).update(received=start + written, updated_at=timezone.now())
+    return start + written
+
+
+# The finished upload `upload_id` of `user`, None when no id was sent
+def claim_upload(user, upload_id):
+    if not upload_id:
+        return None
+    try:
+        session = UploadSession.objects.filter(id=upload_id, user=user).first()
+    except ValidationError:
+        session = None
+    if session is None:
+        raise UploadRejected('The upload was not found, please upload the file again.')
+    if session.received != session.size:
+        raise UploadRejected('The upload is not complete yet.')
+    return session
+
+
+# Transaction to save a post in, with a finished upload (or None) copied into
+# its image or video field first. The session is dropped once the transaction
+# commits. If it rolls back, the session stays for another try and the copy is
+# deleted again unless a MediaBlob already references the same content.
+@contextmanager
+def attach_upload(post, session):
+    stored = None
+    try:
+        with transaction.atomic():
+            if session is not None:
+                field, other = ('image', 'video') if session.kind == 'image' else ('video', 'image')
+                with open(partial_path(session), 'rb') as partial:
+                    getattr(post, field).save(session.filename, File(partial), save=False)
+                stored = getattr(post, field).name
+                setattr(post, other, None)
+                transaction.on_commit(lambda: discard_session(session))
+            yield
+    except BaseException:
+        if stored:
+            delete_unreferenced([stored])
+        raise
+
+
+def discard_session(session):
+    try:
+        os.remove(partial_path(session))
+    except FileNotFoundError:
+        pass
+    session.delete()
+
+
+# Delete sessions that have not received data for UPLOAD_SESSION_TTL_HOURS, returns how many
+def purge_stale_sessions(hours=UPLOAD_SESSION_TTL_HOURS):
+    stale = UploadSession.objects.filter(updated_at__lt=timezone.now() - timedelta(hours=hours))
+    total = 0
+    for session in stale.iterator():
+        discard_session(session)
+        total += 1
+    return total
@@ -1,34 +1,133 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import login, authenticate, logout
 from django.contrib.auth.decorators import login_required
-from django.views.decorators.http import require_POST
+from django.views.decorators.http import require_POST, require_safe
 from django.contrib.auth.models import User
+from django.conf import settings
 from django.views.decorators.csrf import csrf_exempt
 from .forms import PostForm, CommentForm, UserRegisterForm, ProfileUpdateForm
-from .models import Profile, Post, LikePost, Comment, Follow, Chat, Message
-from django.urls import reverse_lazy
-from django.http import HttpResponseForbidden, JsonResponse,HttpResponseNotAllowed
-import base64
-from django.core.files.base import ContentFile
+from .models import Profile, Post, LikePost, Comment, Follow, Chat, PostHashtag, UploadSession
+from .feed import FEED_MODES, FEED_PAGE_SIZE, schedule_fan_out, backfill_follow, bump_rank, remove_follow, timeline_page, load_post_cards
+from .pagination import InvalidCursor, keyset_page
+from .counters import adjust
+from .search import search_page
+from .hashtags import trending_hashtags
+from .uploads import (UPLOAD_CHUNK_SIZE, UploadRejected, attach_upload, claim_upload, parse_content_range,
+                      rejected_uploads, start_session, write_chunk)
+from .graph import people_you_may_know, record_follow, suggestion_for
+from .comments import COMMENT_PAGE_SIZE, reply_parent, thread_page
+from .chats import get_or_create_direct_chat, inbox_page, mark_read, message_history, post_message
+from .serving import media_response
+from .ratelimit import RateLimit, by_ip, rate_limit, too_many_requests
+from .metrics import exposition
+from django.db import transaction
+from django.urls import reverse
+from django.template.loader import render_to_string
+from urllib.parse import urlencode
+from django.http import Http404, HttpResponse, HttpResponseForbidden, JsonResponse,HttpResponseNotAllowed
 from django.contrib import messages
-from django.db.models import Q
-from django.core.cache import cache
-from time import sleep
+from django.db.models import F, Q
 from django.utils.dateformat import format
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.crypto import constant_time_compare
+from django.utils.http import quote_etag
+import hashlib
+
+FOLLOW_PAGE_SIZE = getattr(settings, 'FOLLOW_PAGE_SIZE', 30)
+
+# Follow buttons are only needed for the authors on the current page
+def _follow_statuses(user, posts):
+    if not user.is_authenticated:
+        return {}
+    author_ids = {post.user_id for post in posts}
+    follows = Follow.objects.filter(follower=user, followed_id__in=author_ids).values_list('followed__username', flat=True)
+    return {username: True for username in follows}
+
+# Link to the next page of an infinitely scrolling post list
+def _next_page_url(source, cursor, **params):
+    if not cursor:
+        return None
+    return f"{reverse('feed_page')}?{urlencode({'source': source, 'cursor': cursor, **params})}"
+
+# Home feed order from ?feed=latest|top, a choice made on the base page is kept in the session
+def _feed_mode(request, remember=False):
+    mode = request.GET.get('feed')
+    if mode not in FEED_MODES:
+        return request.session.get('feed_mode', FEED_MODES[0]) if remember else FEED_MODES[0]
+    if remember and request.session.get('feed_mode', FEED_MODES[0]) != mode:
+        request.session['feed_mode'] = mode
+    return mode
+
+# Post list pages, each returns (posts, next_cursor) with the cards batch-loaded
+def _home_posts(request, cursor=None, mode='latest'):
+    posts, next_cursor = timeline_page(request.user, cursor, mode=mode)
+    return load_post_cards(posts, request.user), next_cursor
+
+def _profile_posts(request, user, cursor=None):
+    posts, next_cursor = keyset_page(Post.objects.filter(user=user).select_related('user'), cursor, FEED_PAGE_SIZE)
+    return load_post_cards(posts, request.user, card_mode='profile'), next_cursor
+
+def _search_posts(request, query, cursor=None):
+    posts, next_cursor = search_page(query, cursor)
+    return load_post_cards(posts, request.user), next_cursor
+
+def _hashtag_posts(request, name, cursor=None):
+    links = PostHashtag.objects.filter(hashtag__name=name.lower()).select_related('post__user')
+    links, next_cursor = keyset_page(links, cursor, FEED_PAGE_SIZE, keys=('created_at', 'post_id'))
+    return load_post_cards([link.post for link in links], request.user), next_cursor
 
 # Base view
 def base(request):
-    posts = Post.objects.all()
-    follow_statuses = {}
+    posts = []
+    next_cursor = None
+    trending = []
+    suggestions = []
+    feed_mode = None
 
     if request.user.is_authenticated:
-        follows = Follow.objects.filter(follower=request.user).values_list('followed__username', flat=True)
-        follow_statuses = {username: True for username in follows}
-        
-    return render(request, 'base.html', {'posts': posts, 'follow_statuses': follow_statuses})
+        feed_mode = _feed_mode(request, remember=True)
+        posts, next_cursor = _home_posts(request, mode=feed_mode)
+        trending = trending_hashtags()
+        suggestions = people_you_may_know(request.user)
+
+    return render(request, 'base.html', {'posts': posts, 'follow_statuses': _follow_statuses(request.user, posts),
+                                         'next_page_url': _next_page_url('home', next_cursor, feed=feed_mode), 'trending': trending,
+                                         'suggestions': suggestions, 'feed_mode': feed_mode})
+
+# Infinite-scroll JSON endpoint, returns the next page of post cards
+@login_required
+def feed_page(request):
+    source = request.GET.get('source', 'home')
+    cursor = request.GET.get('cursor')
+    params = {}
+    card_mode = 'feed'
+    try:
+        if source == 'home':
+            params['feed'] = _feed_mode(request)
+            posts, next_cursor = _home_posts(request, cursor, params['feed'])
+        elif source == 'profile':
+            user = get_object_or_404(User, username=request.GET.get('username'))
+            posts, next_cursor = _profile_posts(request, user, cursor)
+            params['username'] = user.username
+            card_mode = 'profile'
+        elif source == 'search' and request.GET.get('q'):
+            params['q'] = request.GET['q']
+            posts, next_cursor = _search_posts(request, params['q'], cursor)
+        elif source == 'tag' and request.GET.get('name'):
+            params['name'] = request.GET['name']
+            posts, next_cursor = _hashtag_posts(request, params['name'], cursor)
+        else:
+            return JsonResponse({'error': 'Unknown feed source'}, status=400)
+    except InvalidCursor:
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+
+    html = render_to_string('post_list_page.html', {'posts': posts, 'card_mode': card_mode,
+                                                    'follow_statuses': _follow_statuses(request.user, posts)}, request=request)
+    return JsonResponse({'html': html, 'next_cursor': next_cursor, 'next_url': _next_page_url(source, next_cursor, **params)})
 
 # Sign-up view
 @csrf_exempt
+@rate_limit('sign_up', key=by_ip, methods=('POST',), template='sign_up.html', context=lambda request: {'form': UserRegisterForm()})
 def sign_up(request):
     if request.method == 'POST':
         form = UserRegisterForm(request.POST)
@@ -47,6 +146,9 @@ def sign_up(request):
     return render(request, 'sign_up.html', {'form': form})
 
 # Sign-in view
+SIGN_IN_FAILURES = RateLimit('sign_in_failures')
+
+@rate_limit('sign_in', key=by_ip, methods=('POST',), template='sign_in.html')
 def sign_in(request):
     if request.method == 'POST':
         username = request.POST['username']
@@ -55,11 +157,11 @@ def sign_in(request):
             messages.error(request, 'Username and password are required.')
             return render(request, 'sign_in.html')
         
-        login_attempts = cache.get(username, 0)
-
-        if login_attempts >= 5:
-            messages.error(request, 'Too many failed attempts. Please try again later.')
-            return redirect('sign_in')
+        # Failed attempts are limited per username, on top of the per-IP limit on all attempts
+        failure_key = f'username:{username.lower()}'
+        wait = SIGN_IN_FAILURES.retry_after(failure_key)
+        if wait:
+            return too_many_requests(request, wait, 'sign_in.html')
 
         user = authenticate(request, username=username, password=password)
         
@@ -71,9 +173,8 @@ def sign_in(request):
                 messages.error(request, 'Your account has been blocked by an admin.')
                 return redirect('sign_in')
         else:
-            cache.set(username, login_attempts + 1, timeout=300)
+            SIGN_IN_FAILURES.count(failure_key)
             messages.error(request, 'Invalid username or password.')
-            sleep(0.5)  # Delay response slightly
     return render(request, 'sign_in.html')
 
 # Sign-out view
@@ -86,61 +187,98 @@ def sign_out(request):
 @login_required
 def search_posts(request):
     query = request.GET.get("q")
-    posts = None
+    posts = []
+    next_cursor = None
     profiles = None
     if query:
-        posts = Post.objects.filter(Q(caption__icontains=query) | Q(caption__regex=fr"#\b{query}\b")).distinct()
+        posts, next_cursor = _search_posts(request, query)
         # Search for user profiles (like usernames or full names)
-        profiles = User.objects.filter(Q(username__icontains=query) | Q(first_name__icontains=query)).distinct()
+        profiles = User.objects.filter(Q(username__icontains=query) | Q(first_name__icontains=query)).select_related('profile').order_by('username')[:20]
     else:
         # Handle the case when no query is provided (optional)
-        posts = Post.objects.none()
         profiles = User.objects.none()
     
-    return render(request, "search_results.html", {"posts": posts, "profiles": profiles, "query": query})
+    return render(request, "search_results.html", {"posts": posts, "profiles": profiles, "query": query,
+                                                   "follow_statuses": _follow_statuses(request.user, posts),
+                                                   "next_page_url": _next_page_url('search', next_cursor, q=query)})
+
+# Hashtag view
+@login_required
+def hashtag_posts(request, name):
+    posts, next_cursor = _hashtag_posts(request, name)
+    return render(request, 'hashtag.html', {'hashtag': name.lower(), 'posts': posts,
+                                            'follow_statuses': _follow_statuses(request.user, posts),
+                                            'next_page_url': _next_page_url('tag', next_cursor, name=name.lower())})
 
 # Profile view
 @login_required
 def profile_view(request, username):
     user = get_object_or_404(User, username=username)
     profile = user.profile
-    following_list = user.following.all()
-    followers_list = user.followers.all()
     # chat, created = Chat.objects.get_or_create(participants=request.user)
-    posts = Post.objects.filter(user=user)
+    posts, next_cursor = _profile_posts(request, user)
     is_following = Follow.objects.filter(follower=request.user, followed=user).exists()if request.user.is_authenticated else False
     follow_back = Follow.objects.filter(follower=profile.user, followed=request.user).exists() if request.user.is_authenticated else False
-    return render(request, 'profile.html', {'profile': profile, 'posts': posts, 'is_following': is_following, 'following': following_list, 'followers': followers_list, 'follow_back': follow_back,'user': request.user,})
+    # Own profile lists suggestions, someone else's shows how many people you follow follow them
+    suggestions = people_you_may_know(user) if request.user == user else []
+    suggestion = suggestion_for(request.user, user) if request.user != user and not is_following else None
+    return render(request, 'profile.html', {'profile': profile, 'posts': posts, 'is_following': is_following, 'follow_back': follow_back,'user': request.user,
+                                            'suggestions': suggestions, 'suggestion': suggestion,
+                                            'next_page_url': _next_page_url('profile', next_cursor, username=user.username)})
+
+# Followers or following of a profile, newest first, a page at a time for the profile modals
+@login_required
+def follow_list(request, username, relation):
+    user = get_object_or_404(User, username=username)
+    if relation == 'followers':
+        follows, other, empty = Follow.objects.filter(followed=user), 'follower', 'No followers.'
+    else:
+        follows, other, empty = Follow.objects.filter(follower=user), 'followed', 'No following users.'
+    cursor = request.GET.get('cursor')
+    try:
+        page, next_cursor = keyset_page(follows.select_related(f'{other}__profile'), cursor, FOLLOW_PAGE_SIZE)
+    except InvalidCursor:
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+
+    html = render_to_string('follow_list_page.html', {'users': [getattr(follow, other) for follow in page],
+                                                      'empty': None if cursor else empty}, request=request)
+    next_url = f"{reverse(relation, kwargs={'username': user.username})}?{urlencode({'cursor': next_cursor})}" if next_cursor else None
+    return JsonResponse({'html': html, 'next_cursor': next_cursor, 'next_url': next_url})
 
 # Message view
 @login_required
 def message(request):
-    chats = Chat.objects.filter(participants=request.user).distinct()
-    profiles = []
-    for chat in chats:
-        other_users = chat.participants.exclude(id=request.user.id)
-        if other_users.exists():
-            profiles.append(other_users.first())
-    context = {'profiles': profiles}
+    try:
+        conversations, next_cursor = inbox_page(request.user, request.GET.get('cursor'))
+    except InvalidCursor:
+        return redirect('message')
+    context = {'conversations': conversations, 'next_cursor': next_cursor}
     return render(request,'messages.html',context)
 
 @login_required
 def open_chat(request, username):
     recipient = get_object_or_404(User, username=username)
-    chat = Chat.objects.filter(participants=request.user).filter(participants=recipient).distinct().first()
-    if not chat:
-        chat = Chat.objects.create()
-        chat.participants.add(request.user, recipient)
+    chat = get_or_create_direct_chat(request.user, recipient)
     return JsonResponse({'chat_id': chat.id})
 
 @login_required
 def load_messages(request, chat_id):
-    chat = get_object_or_404(Chat, id=chat_id)
-    messages = chat.messages.all().order_by('timestamp')
-    messages_data = [{'sender__username': msg.sender.username, 'content': msg.content, 'timestamp': msg.timestamp} for msg in messages]
-    return JsonResponse({'messages': messages_data})
+    chat = get_object_or_404(Chat, id=chat_id, participants=request.user)
+    try:
+        history = message_history(chat.id, since=request.GET.get('since'), before=request.GET.get('before'))
+    except InvalidCursor:
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+    if not request.GET.get('before'):
+        mark_read(chat.id, request.user)
+
+    # Polls that find nothing new are answered with an empty 304
+    response = JsonResponse(history, json_dumps_params={'separators': (',', ':')})
+    response['ETag'] = quote_etag(hashlib.md5(response.content).hexdigest())
+    patch_cache_control(response, private=True, no_cache=True)
+    return get_conditional_response(request, etag=response['ETag'], response=response)
 
 @login_required
+@rate_limit('send_message')
 def send_message(request):
     if request.method == 'POST':
         chat_id = request.POST.get('chat_id')
@@ -148,9 +286,9 @@ def send_message(request):
         if not chat_id or not content:
             return JsonResponse({'error': 'Chat ID and content are required'}, status=400)
         
-        chat = get_object_or_404(Chat, id=chat_id)
-        message = Message.objects.create(chat=chat, sender=request.user, content=content)
-        return JsonResponse({'sender': message.sender.username, 'content': message.content, 'timestamp': message.timestamp.isoformat()})
+        chat = get_object_or_404(Chat, id=chat_id, participants=request.user)
+        message = post_message(chat, request.user, content)
+        return JsonResponse({'id': message.id, 'sender': message.sender.username, 'content': message.content, 'timestamp': message.timestamp.isoformat()})
     
 # Profile settings view
 @login_required
@@ -165,27 +303,68 @@ def profile_settings(request):
     return render(request, 'profile_settings.html', {'form': form})
 
   
+# PostForm with any finished upload_id and rejected files attached
+def _post_form(request, instance=None):
+    upload_id = request.POST.get('upload_id')  # parses the body, running the upload handlers
+    upload, rejected = None, dict(rejected_uploads(request))
+    try:
+        upload = claim_upload(request.user, upload_id)
+    except UploadRejected as exc:
+        rejected[None] = str(exc)
+    return PostForm(request.POST, request.FILES, instance=instance, upload=upload, rejected_uploads=rejected)
+
 # Create post view
 @login_required
 def create_post(request):
     if request.method == 'POST':
-        form = PostForm(request.POST, request.FILES)
+        form = _post_form(request)
         if form.is_valid():
             post = form.save(commit=False)
             post.user = request.user
-            cropped_image_data = request.POST.get('cropped_image')
-            # If cropped image data is available, decode and save it
-            if cropped_image_data:
-                format, imgstr = cropped_image_data.split(';base64,')
-                ext = format.split('/')[-1]
-                cropped_image = ContentFile(base64.b64decode(imgstr), name=f'cropped_image.{ext}')
-                post.image = cropped_image  # Set the cropped image in place of the original image
-            post.save()
+            # A cropped image or a large file arrives as a finished resumable upload
+            with attach_upload(post, form.upload):
+                post.save()
+                adjust(Profile.objects.filter(user=request.user), posts_count=1)
+                schedule_fan_out(post)
             return redirect('base')
     else:
         form = PostForm()
     return render(request, 'create_post.html', {'form': form})
 
+# Start a resumable upload, see socialapp/uploads.py
+@login_required
+@require_POST
+@rate_limit('start_upload')
+def start_upload(request):
+    try:
+        session = start_session(request.user, request.POST.get('filename'), request.POST.get('content_type', ''),
+                                int(request.POST.get('size', '')))
+    except ValueError as exc:  # UploadRejected, or a size that is not a number
+        return JsonResponse({'error': str(exc) if isinstance(exc, UploadRejected) else 'Invalid size'}, status=400)
+    return JsonResponse({'upload_id': str(session.id), 'url': reverse('upload_chunk', args=[session.id]),
+                         'offset': 0, 'chunk_size': UPLOAD_CHUNK_SIZE}, status=201)
+
+# HEAD reports how much of an upload has arrived, PUT sends the next chunk
+@login_required
+def upload_chunk(request, upload_id):
+    session = get_object_or_404(UploadSession, id=upload_id, user=request.user)
+    if request.method == 'HEAD':
+        response = HttpResponse()
+        response['Upload-Offset'] = session.received
+        response['Upload-Length'] = session.size
+        return response
+    if request.method != 'PUT':
+        return HttpResponseNotAllowed(['HEAD', 'PUT'])
+
+    try:
+        start, end, total = parse_content_range(request.headers.get('Content-Range'))
+        if total != session.size or start != session.received:
+            return JsonResponse({'error': 'Unexpected offset', 'offset': session.received}, status=409)
+        offset = write_chunk(session, request, start, end)
+    except UploadRejected as exc:
+        return JsonResponse({'error': str(exc), 'offset': session.received}, status=400)
+    return JsonResponse({'offset': offset, 'complete': offset == session.size})
+
 # Edit post view
 @login_required
 def edit_post(request, pk):
@@ -194,15 +373,11 @@ def edit_post(request, pk):
         return HttpResponseForbidden("You are not allowed to edit this post.")
     
     if request.method == 'POST':
-        form = PostForm(request.POST, request.FILES, instance=post)
+        form = _post_form(request, instance=post)
         if form.is_valid():
-            cropped_image_data = request.POST.get('cropped_image')
-            if cropped_image_data:
-                format, imgstr = cropped_image_data.split(';base64,')
-                ext = format.split('/')[-1]
-                cropped_image = ContentFile(base64.b64decode(imgstr), name=f'cropped_image.{ext}')
-                post.image = cropped_image
-            form.save()
+            post.card_version = F('card_version') + 1
+            with attach_upload(post, form.upload):
+                form.save()
             return redirect('profile', username=post.user.username)
     else:
         form = PostForm(instance=post)
@@ -218,24 +393,33 @@ def delete_post(request, pk):
         return HttpResponseForbidden("You are not allowed to delete this post.")
     
     if request.method == 'POST':
-        post.delete()
+        with transaction.atomic():
+            post.delete()
+            adjust(Profile.objects.filter(user=request.user), posts_count=-1)
         return redirect('profile', request.user)
 
 # AJAX-enabled Like post view
 @login_required
+@rate_limit('like_post')
 def like_post(request, pk):
     post = get_object_or_404(Post, pk=pk)
     liked = False
-    like, created = LikePost.objects.get_or_create(post=post, user=request.user)
-    
-    if not created:
-        like.delete()
-    else:
-        liked = True
+    with transaction.atomic():
+        like, created = LikePost.objects.get_or_create(post=post, user=request.user)
+
+        if not created:
+            like.delete()
+            adjust(Post.objects.filter(pk=post.pk), likes_count=-1, card_version=1)
+            bump_rank(post)
+        else:
+            liked = True
+            adjust(Post.objects.filter(pk=post.pk), likes_count=1, card_version=1)
+            bump_rank(post)
+        post.refresh_from_db(fields=['likes_count'])
     
     data = {
         'liked': liked,
-        'like_count': post.likes.count()
+        'like_count': post.likes_count
     }
     
     return JsonResponse(data)
@@ -243,6 +427,7 @@ def like_post(request, pk):
 # AJAX-enabled Follow/Unfollow user view
 @login_required
 @require_POST
+@rate_limit('toggle_follow')
 def toggle_follow(request, username):
     target_user = get_object_or_404(User, username=username)
 
@@ -251,17 +436,25 @@ def toggle_follow(request, username):
         return JsonResponse({'error': 'You cannot follow yourself.'}, status=400)
 
     following_status = False
-    follow_instance, created = Follow.objects.get_or_create(follower=request.user, followed=target_user)
+    with transaction.atomic():
+        follow_instance, created = Follow.objects.get_or_create(follower=request.user, followed=target_user)
+        delta = 1 if created else -1
+        if not created:
+            # User is already following, so unfollow
+            follow_instance.delete()
+        else:
+            # Now following
+            following_status = True
+        adjust(Profile.objects.filter(user=request.user), following_count=delta)
+        adjust(Profile.objects.filter(user=target_user), followers_count=delta)
+        record_follow(request.user, target_user, following_status)
 
-    if not created:
-        # User is already following, so unfollow
-        follow_instance.delete()
+    if following_status:
+        backfill_follow(request.user, target_user)
     else:
-        # Now following
-        following_status = True
+        remove_follow(request.user, target_user)
 
-    followers_count = target_user.followers.count()
-    following_count = target_user.following.count()
+    followers_count, following_count = Profile.objects.filter(user=target_user).values_list('followers_count', 'following_count').get()
 
     return JsonResponse({
         'following_status': following_status,
@@ -272,6 +465,7 @@ def toggle_follow(request, username):
 
 # AJAX-enabled Add comment view
 @login_required
+@rate_limit('add_comment')
 def add_comment(request, pk):
     post = get_object_or_404(Post, pk=pk)
     if request.method == 'POST':
@@ -280,18 +474,69 @@ def add_comment(request, pk):
             comment = form.save(commit=False)
             comment.user = request.user
             comment.post = post
-            comment.save()
+            if request.POST.get('parent'):
+                parent = Comment.objects.filter(post=post, pk=request.POST['parent']).first() if request.POST['parent'].isdigit() else None
+                if parent is None:
+                    return JsonResponse({'error': 'Invalid request'}, status=400)
+                comment.parent = reply_parent(parent)
+            # Comments are loaded with the modal, not part of the cached card
+            with transaction.atomic():
+                comment.save()
+                adjust(Post.objects.filter(pk=post.pk), comments_count=1)
+                bump_rank(post)
+                post.refresh_from_db(fields=['comments_count'])
             
             response_data = {
+                'id': comment.id,
+                'parent_id': comment.parent_id,
                 'username': comment.user.username,
                 'text': comment.text,
                 'created_at': format(comment.created_at, 'N j, Y, P'),
-                'comment_count': post.comments.count()
+                'comment_count': post.comments_count,
+                'html': render_to_string('comment_list_page.html', {'comments': [comment], 'post_id': post.pk}),
             }
             return JsonResponse(response_data)
         
     return JsonResponse({'error': 'Invalid request'}, status=400)
 
+# A page of a post's comment thread for its comment modal, or with comment_id
+# of the replies under that comment
+@login_required
+@require_safe
+def comment_list(request, pk, comment_id=None):
+    post = get_object_or_404(Post.objects.only('id'), pk=pk)
+    root = get_object_or_404(Comment.objects.only('id', 'path'), pk=comment_id, post=post) if comment_id else None
+    cursor = request.GET.get('cursor')
+    try:
+        comments, next_cursor = thread_page(post.pk, root, cursor, COMMENT_PAGE_SIZE)
+    except InvalidCursor:
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+
+    html = render_to_string('comment_list_page.html', {'comments': comments, 'post_id': post.pk,
+                                                       'empty': None if cursor or root else 'No comments yet.'}, request=request)
+    next_url = None
+    if next_cursor:
+        url = reverse('comment_replies', args=[post.pk, root.pk]) if root else reverse('comments', args=[post.pk])
+        next_url = f"{url}?{urlencode({'cursor': next_cursor})}"
+    return JsonResponse({'html': html, 'next_cursor': next_cursor, 'next_url': next_url})
+
+# Uploaded media with Range, ETag and Last-Modified support (see serving.py)
+@require_safe
+def serve_media(request, path):
+    return media_response(request, path)
+
+# Request, query and cache metrics of every worker in the Prometheus text format,
+# for staff users and scrapers sending METRICS_TOKEN
+@require_safe
+def metrics(request):
+    if not getattr(settings, 'METRICS_ENABLED', False):
+        raise Http404
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    authorized = token and constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}')
+    if not authorized and not request.user.is_staff:
+        return HttpResponseForbidden()
+    return HttpResponse(exposition(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 # Handle 404 error
 def handle_404(request, exception):
     return render(request, '404.html', status=404)
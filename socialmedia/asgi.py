@@ -2,6 +2,9 @@
 ASGI config for socialmedia project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+HTTP requests go to Django, with the JSON write endpoints served by their
+async versions (``socialapp.async_views``); WebSocket connections (real-time
+chat) go to ``socialapp.realtime``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
@@ -12,5 +15,15 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'socialmedia.settings')
+os.environ.setdefault('SOCIALAPP_ASYNC_VIEWS', '1')  # route the JSON write endpoints to socialapp.async_views
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from socialapp.realtime import websocket_application  # noqa: E402  (needs Django set up)
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'websocket':
+        await websocket_application(scope, receive, send)
+    else:
+        await django_application(scope, receive, send)
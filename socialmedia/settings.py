@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 
 from pathlib import Path
 import os
+import tempfile
 import dj_database_url
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -45,6 +46,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'socialapp.middleware.MetricsMiddleware',
+    'socialapp.middleware.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -52,9 +55,32 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'socialapp.middleware.StaticFilesMiddleware',
 ]
 
+# Serve the JSON write endpoints from socialapp.async_views. socialmedia/asgi.py
+# turns this on; WSGI deployments keep the sync views.
+ASYNC_VIEWS = os.environ.get('SOCIALAPP_ASYNC_VIEWS') == '1'
+
+# Per-request profiling (socialapp.middleware.ProfilingMiddleware): a
+# Server-Timing header on every response, and a JSON entry on the
+# "socialapp.profiling" logger for requests slower than PROFILING_SLOW_MS or
+# running one statement PROFILING_REPEAT_THRESHOLD times or more (N+1 queries).
+# Off by default, the middleware then drops out of the stack.
+REQUEST_PROFILING = os.environ.get('SOCIALAPP_PROFILING') == '1'
+PROFILING_SLOW_MS = 500
+PROFILING_SLOWEST_QUERIES = 5
+PROFILING_REPEAT_THRESHOLD = 3
+
+# Request, cache and query metrics served at /metrics (socialapp/metrics.py),
+# off unless SOCIALAPP_METRICS=1. Each worker process writes its samples to a
+# file in METRICS_DIR, which the workers of a host share and no other deployment
+# may use: it is emptied when the server restarts. /metrics answers staff users
+# and, when METRICS_TOKEN is set, scrapers sending "Authorization: Bearer <token>".
+METRICS_ENABLED = os.environ.get('SOCIALAPP_METRICS') == '1'
+METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join(BASE_DIR, 'metrics'))
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN') or None
+
 ROOT_URLCONF = 'socialmedia.urls'
 
 TEMPLATES = [
@@ -160,6 +186,103 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 # Media files (uploads)
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# Media is served by socialapp.views.serve_media. Set MEDIA_ACCEL to
+# 'x-accel-redirect' behind nginx (with an internal location at
+# MEDIA_ACCEL_PREFIX aliased to MEDIA_ROOT) or 'x-sendfile' behind Apache to
+# let the front-end server send the bytes.
+MEDIA_ACCEL = os.environ.get('MEDIA_ACCEL') or None
+MEDIA_ACCEL_PREFIX = '/protected-media/'
+MEDIA_MAX_AGE = 60 * 60
+
+# Upload limits and resumable uploads (socialapp/uploads.py). Partial uploads
+# live in UPLOAD_SESSION_DIR, outside MEDIA_ROOT so they are never served; it
+# must be shared by all web workers.
+FILE_UPLOAD_HANDLERS = [
+    'socialapp.uploads.LimitedUploadHandler',
+    'django.core.files.uploadhandler.MemoryFileUploadHandler',
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+MAX_UPLOAD_SIZE = {'image': 10 * 1024 * 1024, 'video': 200 * 1024 * 1024}
+UPLOAD_CHUNK_SIZE = 2 * 1024 * 1024
+UPLOAD_SESSION_DIR = os.environ.get('UPLOAD_SESSION_DIR', os.path.join(BASE_DIR, 'partial_uploads'))
+UPLOAD_SESSION_TTL_HOURS = 24
+MAX_OPEN_UPLOADS = 5  # per user
+MAX_PENDING_UPLOAD_BYTES = 400 * 1024 * 1024  # per user, over their open sessions
+
+# Home timeline (fan-out-on-write)
+FEED_PAGE_SIZE = 20
+FEED_BACKFILL_SIZE = 200
+FEED_TIMELINE_SIZE = 500
+FEED_FANOUT_WORKERS = 2
+
+# Full-text post search
+SEARCH_PAGE_SIZE = 20
+
+# Trending hashtags (hourly buckets)
+TRENDING_WINDOW_HOURS = 24
+TRENDING_LIMIT = 10
+
+# Caches. Rendered post cards get their own alias (socialapp/cards.py) so they
+# can be sized and evicted apart from everything else; the local-memory default
+# culls a quarter of the entries when MAX_ENTRIES is reached. Point
+# POST_CARD_CACHE_URL at Redis (with an allkeys-lru maxmemory-policy) to share
+# the cards between workers.
+CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'post_cards': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'post-cards',
+        'TIMEOUT': 24 * 60 * 60,
+        'OPTIONS': {'MAX_ENTRIES': 10000, 'CULL_FREQUENCY': 4},
+    },
+}
+if os.environ.get('POST_CARD_CACHE_URL'):
+    CACHES['post_cards'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['POST_CARD_CACHE_URL'],
+        'TIMEOUT': 24 * 60 * 60,
+    }
+POST_CARD_CACHE = 'post_cards'
+POST_CARD_CACHE_TIMEOUT = 24 * 60 * 60
+
+# Rate limits (socialapp/ratelimit.py). Counters must be shared by all worker
+# processes and incremented atomically. The default keeps them in files that
+# every process of one host shares, incremented under a file lock; set
+# RATELIMIT_CACHE_URL to Redis when requests are served from more than one
+# host. RATE_LIMITS overrides the per-scope rates, e.g. {'add_comment': '20/m'}.
+# Behind a proxy that sets it, RATELIMIT_IP_HEADER = 'HTTP_X_FORWARDED_FOR'
+# identifies the client.
+CACHES['ratelimit'] = {
+    'BACKEND': 'socialapp.ratelimit.LockedFileBasedCache',
+    'LOCATION': os.environ.get('RATELIMIT_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'socialapp-ratelimit')),
+}
+if os.environ.get('RATELIMIT_CACHE_URL'):
+    CACHES['ratelimit'] = {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': os.environ['RATELIMIT_CACHE_URL']}
+RATELIMIT_CACHE = 'ratelimit'
+RATE_LIMITS = {}
+RATELIMIT_IP_HEADER = None
+
+# Resized JPEG/WebP renditions of uploaded images (socialapp/renditions.py)
+POST_IMAGE_WIDTHS = (320, 640, 1080)
+PROFILE_PIC_WIDTHS = (64, 128, 256)
+IMAGE_RENDITION_WORKERS = 2
+
+# Chat history (load_messages) and inbox (message)
+MESSAGE_PAGE_SIZE = 50
+INBOX_PAGE_SIZE = 20
+
+# Real-time chat broadcast layer (WebSockets, see socialapp/realtime.py).
+# The in-process default only reaches sockets served by the same process; set
+# CHAT_BROADCAST_URL to a Redis URL when running several ASGI workers.
+CHAT_BROADCAST = {'BACKEND': 'socialapp.realtime.InProcessBroadcast'}
+if os.environ.get('CHAT_BROADCAST_URL'):
+    CHAT_BROADCAST = {
+        'BACKEND': 'socialapp.realtime.RedisBroadcast',
+        'OPTIONS': {'url': os.environ['CHAT_BROADCAST_URL']},
+    }
+# Hosts that may open a chat socket without an Origin header (non-browser
+# clients); browsers always send one and it must match the Host.
+CHAT_SOCKET_ORIGINLESS_HOSTS = ()
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
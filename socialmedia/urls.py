@@ -21,8 +21,8 @@ from django.conf.urls.static import static
 
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path('', include('socialapp.urls')),
+    # Async JSON write endpoints under ASGI, see socialapp/async_views.py
+    path('', include('socialapp.async_urls' if settings.ASYNC_VIEWS else 'socialapp.urls')),
 ]
 if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
     urlpatterns += static(settings.STATIC_URL, document_root=settings.STATICFILES_DIRS[0])
\ No newline at end of file
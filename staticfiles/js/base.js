@@ -8,8 +8,47 @@ document.addEventListener("DOMContentLoaded", () => {
             }
         });
     });
+
+    document.querySelectorAll('.feed-sentinel').forEach(observeFeedSentinel);
 });
 
+// Infinite scroll: load the next page of posts when the sentinel comes into view.
+// `insert` adds a page's HTML to the list, appending it by default.
+function observeFeedSentinel(sentinel, insert = (list, html) => list.insertAdjacentHTML('beforeend', html)) {
+    const postList = sentinel.previousElementSibling;
+    let loading = false;
+
+    const observer = new IntersectionObserver(async (entries) => {
+        if (!entries.some(entry => entry.isIntersecting) || loading) {
+            return;
+        }
+        loading = true;
+        try {
+            const response = await fetch(sentinel.dataset.nextUrl, {
+                headers: { 'Accept': 'application/json' },
+            });
+            if (!response.ok) {
+                throw new Error('Failed to load more posts');
+            }
+            const data = await response.json();
+            insert(postList, data.html);
+            if (data.next_url) {
+                sentinel.dataset.nextUrl = data.next_url;
+            } else {
+                observer.disconnect();
+                sentinel.remove();
+            }
+        } catch (error) {
+            console.error('Error loading more posts:', error);
+            observer.disconnect();
+        } finally {
+            loading = false;
+        }
+    }, { rootMargin: '600px 0px' });
+
+    observer.observe(sentinel);
+}
+
 // Function to toggle follow/unfollow a user
 async function toggleFollowUser(username) {
     const csrftoken = getCookie('csrftoken');
@@ -90,11 +129,38 @@ function toggleComments(postId) {
     commentSection.classList.toggle('hidden');
     if (commentSection.style.display === 'none' || commentSection.style.display === '') {
         commentSection.style.display = 'block';
+        // Comments are loaded the first time the modal opens, then as it scrolls
+        const sentinel = commentSection.querySelector('.comments-sentinel');
+        if (sentinel && !sentinel.dataset.observed) {
+            sentinel.dataset.observed = 'true';
+            observeFeedSentinel(sentinel, appendComments);
+        }
     } else {
         commentSection.style.display = 'none';
     }
 }
 
+// Append a page of comments, skipping any already shown (e.g. just added by the viewer)
+function appendComments(commentList, html) {
+    const page = document.createElement('template');
+    page.innerHTML = html;
+    page.content.querySelectorAll('.comment-item').forEach(item => {
+        if (commentList.querySelector(`[data-comment-id="${item.dataset.commentId}"]`)) {
+            item.remove();
+        }
+    });
+    commentList.append(page.content);
+}
+
+// Point the comment form at a comment, the next comment sent replies to it
+function replyToComment(button) {
+    const comment = button.closest('.comment-item');
+    const form = button.closest('.modal-content').querySelector('.comment-form');
+    form.elements.parent.value = comment.dataset.commentId;
+    form.elements.text.placeholder = `Reply to ${comment.dataset.username}...`;
+    form.elements.text.focus();
+}
+
 // Add a comment to a post
 async function addComment(event, postId) {
     event.preventDefault(); 
@@ -119,14 +185,26 @@ async function addComment(event, postId) {
         const data = await response.json();
         const commentsContainer = document.getElementById(`comments-${postId}`);
         const commentList = commentsContainer.querySelector('.comments-list');
-
-        const newCommentItem = document.createElement('li');
-        newCommentItem.classList.add('comment-item');
-        newCommentItem.innerHTML = `<strong>${data.username}:</strong> ${data.text}
-        <p class="comment-date">${data.created_at}</p>`;
-        commentList.appendChild(newCommentItem);
+        commentList.querySelector('.comments-empty')?.remove();
+
+        // A reply goes after the last comment shown in its parent's thread
+        let anchor = null;
+        const parent = data.parent_id && commentList.querySelector(`[data-comment-id="${data.parent_id}"]`);
+        if (parent) {
+            anchor = parent;
+            while (anchor.nextElementSibling && Number(anchor.nextElementSibling.dataset.depth) > Number(parent.dataset.depth)) {
+                anchor = anchor.nextElementSibling;
+            }
+        }
+        if (anchor) {
+            anchor.insertAdjacentHTML('afterend', data.html);
+        } else {
+            commentList.insertAdjacentHTML('beforeend', data.html);
+        }
 
         form.reset();
+        form.elements.parent.value = '';
+        form.elements.text.placeholder = 'Add a comment...';
     } catch (error) {
         console.error('Error adding comment:', error);
     }
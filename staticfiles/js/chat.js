@@ -0,0 +1,236 @@
+// Chat modal shared by the messages and profile pages.
+// New messages arrive over a WebSocket (/ws/chat/<id>/); sends go over the
+// socket when it is open and fall back to the send_message POST otherwise.
+// Without a socket the chat polls load_messages with the `since` cursor, and
+// scrolling to the top pages back through history with the `before` cursor.
+const CHAT_POLL_INTERVAL = 5000;
+let chatSocket = null;
+let chatState = null;
+
+// Build one message element, null if it is already on screen (socket echo of our own send)
+function renderChatMessage(message) {
+    const chatBox = document.getElementById('chat-box');
+    if (message.id && chatBox.querySelector(`[data-message-id="${message.id}"]`)) {
+        return null;
+    }
+    const placeholder = chatBox.querySelector('.no-messages');
+    if (placeholder) {
+        placeholder.remove();
+    }
+    const currentUser = chatBox.getAttribute('data-current-user');
+    const messageElement = document.createElement('div');
+    messageElement.className = message.sender__username === currentUser ? 'message sent' : 'message received';
+    if (message.id) {
+        messageElement.dataset.messageId = message.id;
+    }
+    const sender = document.createElement('strong');
+    sender.textContent = message.sender__username;
+    const content = document.createElement('p');
+    content.textContent = message.content;
+    const timestamp = document.createElement('span');
+    timestamp.className = 'timestamp';
+    timestamp.textContent = new Date(message.timestamp).toLocaleString('en-US', {year: 'numeric', month: 'short', day: 'numeric', hour: 'numeric', minute: '2-digit', hour12: true});
+    messageElement.append(sender, content, timestamp);
+    return messageElement;
+}
+
+function appendChatMessage(message) {
+    const chatBox = document.getElementById('chat-box');
+    const messageElement = renderChatMessage(message);
+    if (messageElement) {
+        chatBox.appendChild(messageElement);
+        chatBox.scrollTop = chatBox.scrollHeight;
+    }
+}
+
+async function fetchMessages(chatId, params) {
+    const query = new URLSearchParams(params).toString();
+    const response = await fetch(`/chat/${chatId}/messages/${query ? '?' + query : ''}`);
+    if (!response.ok) {
+        throw new Error('Failed to load messages.');
+    }
+    return response.json();
+}
+
+// Load the latest messages for a chat, then listen for new ones
+async function loadMessages(chatId) {
+    stopChatPolling();
+    chatState = { chatId: chatId, since: null, before: null, loadingOlder: false, pollTimer: null };
+    try {
+        const data = await fetchMessages(chatId, {});
+        const chatBox = document.getElementById('chat-box');
+        chatBox.innerHTML = '';
+        if (data.messages.length === 0) {
+            chatBox.innerHTML = '<p class="no-messages">No messages yet.</p>';
+        } else {
+            data.messages.forEach(appendChatMessage);
+        }
+        chatState.since = data.since;
+        chatState.before = data.before;
+        chatBox.scrollTop = chatBox.scrollHeight;
+        chatBox.onscroll = () => {
+            if (chatBox.scrollTop < 40) {
+                loadOlderMessages();
+            }
+        };
+        connectChatSocket(chatId);
+    } catch (error) {
+        console.error('Error loading messages:', error);
+        alert('Failed to load messages. Please try again.');
+    }
+}
+
+// Prepend the page of history before the oldest message on screen
+async function loadOlderMessages() {
+    const state = chatState;
+    if (!state || !state.before || state.loadingOlder) {
+        return;
+    }
+    state.loadingOlder = true;
+    try {
+        const data = await fetchMessages(state.chatId, { before: state.before });
+        if (state !== chatState) {
+            return;
+        }
+        const chatBox = document.getElementById('chat-box');
+        const previousHeight = chatBox.scrollHeight;
+        const fragment = document.createDocumentFragment();
+        data.messages.forEach((message) => {
+            const messageElement = renderChatMessage(message);
+            if (messageElement) {
+                fragment.appendChild(messageElement);
+            }
+        });
+        chatBox.insertBefore(fragment, chatBox.firstChild);
+        chatBox.scrollTop += chatBox.scrollHeight - previousHeight; // keep the view where it was
+        state.before = data.before;
+    } catch (error) {
+        console.error('Error loading older messages:', error);
+    } finally {
+        state.loadingOlder = false;
+    }
+}
+
+// Fetch only what arrived after the newest message seen; unchanged polls are 304s
+async function pollMessages() {
+    const state = chatState;
+    if (!state) {
+        return;
+    }
+    try {
+        let data;
+        do {
+            data = await fetchMessages(state.chatId, state.since ? { since: state.since } : {});
+            if (state !== chatState) {
+                return;
+            }
+            data.messages.forEach(appendChatMessage);
+            state.since = data.since || state.since;
+        } while (data.more);
+    } catch (error) {
+        console.error('Error polling messages:', error);
+    }
+    if (state === chatState && !chatSocket) {
+        state.pollTimer = setTimeout(pollMessages, CHAT_POLL_INTERVAL);
+    }
+}
+
+function startChatPolling() {
+    if (chatState && !chatState.pollTimer) {
+        chatState.pollTimer = setTimeout(pollMessages, CHAT_POLL_INTERVAL);
+    }
+}
+
+function stopChatPolling() {
+    if (chatState && chatState.pollTimer) {
+        clearTimeout(chatState.pollTimer);
+        chatState.pollTimer = null;
+    }
+}
+
+// Open the push channel for a chat
+function connectChatSocket(chatId) {
+    disconnectChatSocket();
+    if (!('WebSocket' in window)) {
+        startChatPolling();
+        return;
+    }
+    const scheme = window.location.protocol === 'https:' ? 'wss' : 'ws';
+    const socket = new WebSocket(`${scheme}://${window.location.host}/ws/chat/${chatId}/`);
+    socket.addEventListener('message', (event) => {
+        const data = JSON.parse(event.data);
+        if (data.error) {
+            alert(data.error); // e.g. the send_message rate limit
+            return;
+        }
+        appendChatMessage(data);
+    });
+    socket.addEventListener('close', () => {
+        // No socket (WSGI deployment) or a dropped one: fall back to polling
+        if (chatSocket === socket) {
+            chatSocket = null;
+            startChatPolling();
+        }
+    });
+    chatSocket = socket;
+}
+
+function disconnectChatSocket() {
+    if (chatSocket) {
+        const socket = chatSocket;
+        chatSocket = null;
+        socket.close();
+    }
+}
+
+// Send a message in the chat
+async function sendMessage(event) {
+    event.preventDefault();
+    const chatForm = document.getElementById('chat-form');
+    const chatId = chatForm.dataset.chatId;
+    const chatInput = document.getElementById('chat-message');
+    const messageContent = chatInput.value.trim();
+    if (!chatId) {
+        console.error('Chat ID is not defined.');
+        alert('Chat session not initialized.');
+        return;
+    }
+    if (!messageContent) {
+        alert('Message cannot be empty.');
+        return;
+    }
+    if (chatSocket && chatSocket.readyState === WebSocket.OPEN) {
+        chatSocket.send(JSON.stringify({ content: messageContent }));
+        chatInput.value = '';
+        return;
+    }
+    try {
+        const response = await fetch(`/send_message/`, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/x-www-form-urlencoded',
+                'X-CSRFToken': document.getElementsByName('csrfmiddlewaretoken')[0].value,
+            },
+            body: new URLSearchParams({ chat_id: chatId, content: messageContent }),
+        });
+        if (!response.ok) {
+            throw new Error(await response.text());
+        }
+        const data = await response.json();
+        appendChatMessage({ id: data.id, sender__username: data.sender, content: data.content, timestamp: data.timestamp });
+        chatInput.value = '';
+    } catch (error) {
+        console.error('Error sending message:', error);
+        alert('Failed to send message. Please try again.');
+    }
+}
+
+// Close the chat modal
+function closeChatModal() {
+    stopChatPolling();
+    chatState = null;
+    disconnectChatSocket();
+    document.getElementById('chat-modal').style.display = 'none';
+    document.getElementById('chat-box').innerHTML = ''; // Clear chat messages
+    document.getElementById('chat-form').dataset.chatId = ''; // Reset chat ID
+}
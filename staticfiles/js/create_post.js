@@ -82,7 +82,6 @@ document.addEventListener('DOMContentLoaded', function () {
     const videoInput = document.getElementById('id_video');
     const cropButton = document.getElementById('crop-button');
     const form = document.querySelector('.box');  // Form element
-    const croppedImageInput = document.getElementById('cropped-image');
 
     if (imageInput) {
         imageInput.addEventListener('change', handleFileSelect);
@@ -91,14 +90,12 @@ document.addEventListener('DOMContentLoaded', function () {
         videoInput.addEventListener('change', handleFileSelect);
     }
 
-    // Crop button functionality
-    cropButton.addEventListener('click', function () {
+    // Crop button functionality: upload the cropped JPEG in chunks, then post it
+    cropButton.addEventListener('click', async function () {
         if (cropper) {
             const canvas = cropper.getCroppedCanvas();
             if (canvas) {
-                const croppedImageDataURL = canvas.toDataURL('image/jpeg'); // Convert to Data URL (JPEG format)
-                croppedImageInput.value = croppedImageDataURL;
-                form.submit();
+                submitWithUpload(form, await canvasToFile(canvas, 'cropped_image.jpg'), [imageInput, videoInput]);
             } else {
                 alert('Error cropping image. Please try again.');
             }
@@ -107,6 +104,15 @@ document.addEventListener('DOMContentLoaded', function () {
         }
     });
 
+    // Plain post: send the selected file through the resumable upload too
+    form.addEventListener('submit', function (event) {
+        const input = [imageInput, videoInput].find((fileInput) => fileInput && fileInput.files.length > 0);
+        if (input) {
+            event.preventDefault();
+            submitWithUpload(form, input.files[0], [imageInput, videoInput]);
+        }
+    });
+
     // Cancel button functionality
     const cancelButton = document.getElementById('cancel-button');
     cancelButton.addEventListener('click', function() {
@@ -5,7 +5,6 @@ document.addEventListener('DOMContentLoaded', function () {
     const previewImage = document.getElementById('preview-image');
     const previewVideo = document.getElementById('preview-video');
     const cropButton = document.getElementById('crop-button');
-    const croppedImageInput = document.getElementById('cropped-image'); 
     let cropper = null;
 
     cropButton.style.display = 'none';
@@ -88,17 +87,25 @@ document.addEventListener('DOMContentLoaded', function () {
         });
     }
 
-    // Crop button functionality - post cropped image
+    // Crop button functionality - upload the cropped image in chunks, then save
     if (cropButton) {
-        cropButton.addEventListener('click', function () {
+        cropButton.addEventListener('click', async function () {
             if (cropper) {
                 const canvas = cropper.getCroppedCanvas(); // Get the cropped image
-                croppedImageInput.value = canvas.toDataURL('image/jpeg');
-                form.submit();
+                submitWithUpload(form, await canvasToFile(canvas, 'cropped_image.jpg'), [imageInput, videoInput]);
             }
         });
     }
 
+    // Plain save with a new file: send it through the resumable upload too
+    form.addEventListener('submit', function (event) {
+        const input = [imageInput, videoInput].find((fileInput) => fileInput && fileInput.files.length > 0);
+        if (input) {
+            event.preventDefault();
+            submitWithUpload(form, input.files[0], [imageInput, videoInput]);
+        }
+    });
+
     
 
     // Cancel button functionality - Redirect to profile page